@@ -0,0 +1,349 @@
+"""
+存储方式与更新流程的性能基准
+
+使用与examples/data_function.py形状相同的合成数据, 对methods.DICT中的每一种存储方式测量:
+- create_table, update_data(逐日写入), max_date, list_date, list_field_date
+- DataUpdate.dates_update_all(field函数组) 与 range_update_all 的完整流程
+- 提供 --compression 时, 文件类存储在每种压缩方式下的写入/读取耗时与占用的磁盘空间
+
+sql使用临时的sqlite数据库, 文件类存储使用临时目录, 因此可以离线运行
+postgresql只有在提供 --pg-url 时才会测量, parquet在未安装pyarrow时跳过
+
+    python benchmarks/bench_storage.py --dates 250 --fields 20 --rows 500 --output bench.json
+    python benchmarks/bench_storage.py --dates 250 --fields 20 --rows 500 --baseline bench.json
+    python benchmarks/bench_storage.py --storage csv csvfolder pickle parquet --compression none gzip zstd lz4
+
+结果以JSON输出并记录当前的git commit, 便于在不同commit之间比较
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import pandas as pd
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datarepo import DataUpdate, data_config
+from datarepo.methods import methods, compression
+
+
+FIELD_STRUCTURE = {
+    'date': "CHAR(8)",
+    'field': "VARCHAR(32)",
+    'sid': "CHAR(6)",
+    'value': 'FLOAT'
+}
+
+# parquet支持的压缩方式
+PARQUET_CODEC = (None, 'snappy', 'gzip', 'zstd', 'lz4', 'brotli')
+
+RANGE_STRUCTURE = {
+    'date': "CHAR(8)",
+    'sid': "CHAR(6)",
+    'value': 'FLOAT'
+}
+
+
+def make_frame(dates, fields, rows):
+    """
+    生成 日期 x field x 股票 的合成数据
+
+    Parameters
+    ----------
+    dates: list of YYYYmmdd
+    fields: list of str, 为空时不包含field列
+    rows: int
+        每个日期(及field)的记录数
+    """
+    sid = ["{:06d}".format(x) for x in range(rows)]
+    index = pd.MultiIndex.from_product([dates, fields or [None], sid], names=['date', 'field', 'sid'])
+    data = index.to_frame(index=False)
+    data['value'] = range(len(data))
+    data['value'] = data['value'] * 0.01
+    if not fields:
+        data = data.drop('field', axis=1)
+    return data
+
+
+@data_config(
+    status='update',
+    table_name='bench_field',
+    data_structure=FIELD_STRUCTURE,
+    update_method='dates',
+    index=['date', 'field']
+)
+def field_value(date, field, rows):
+    """
+    indicator_from_func使用的field函数
+    """
+    return make_frame([date], [field], rows)
+
+
+def make_range_func(table_name, rows):
+    """
+    生成range更新使用的函数
+    """
+    @data_config(
+        status='update',
+        table_name=table_name,
+        data_structure=RANGE_STRUCTURE,
+        update_method='range',
+        index=['date']
+    )
+    def range_value(start_date, end_date):
+        dates = [x.strftime("%Y%m%d") for x in pd.date_range(start_date, end_date)]
+        return make_frame(dates, [], rows)
+    return range_value
+
+
+def timeit(func, repeat=1):
+    """
+    运行func repeat次, 返回最短的耗时(秒)
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        used = time.perf_counter() - start
+        best = used if best is None else min(best, used)
+    return best
+
+
+def connect(storage_type, folder, pg_url=None):
+    """
+    生成存储方式对应的连接, 无法测量的存储方式返回None
+    """
+    if storage_type == 'sql':
+        return sa.create_engine("sqlite:///{}".format(os.path.join(folder, 'bench.db')))
+    if storage_type == 'postgresql':
+        return sa.create_engine(pg_url) if pg_url else None
+    path = os.path.join(folder, storage_type)
+    os.makedirs(path, exist_ok=True)
+    return path if methods.check_connection(path, storage_type) else None
+
+
+def disk_bytes(path):
+    """
+    文件或文件夹占用的字节数
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, x)) for x in files)
+    return total
+
+
+def drop_tables(conn, table_list):
+    """
+    删除postgresql中测量使用的表
+    """
+    with conn.begin() as c:
+        for x in table_list:
+            c.execute(sa.text("DROP TABLE IF EXISTS {}".format(x)))
+
+
+def bench_backend(storage_type, conn, args):
+    """
+    测量一种存储方式
+
+    Returns
+    -------
+    list of dict: {storage_type, op, seconds, ...}
+    """
+    dates = [x.strftime("%Y%m%d") for x in pd.bdate_range('20100101', periods=args.dates)]
+    fields = ["f{:03d}".format(x) for x in range(args.fields)]
+    results = list()
+    tables = ['bench_primitive', 'bench_dates', 'bench_range']
+    if storage_type == 'postgresql':
+        drop_tables(conn, tables)
+
+    def record(op, seconds, **kwargs):
+        results.append(dict(storage_type=storage_type, op=op, seconds=round(seconds, 6), **kwargs))
+        logging.info("{:<12}{:<22}{:>10.4f}s".format(storage_type, op, seconds))
+
+    # 存储方法本身: 建表, 逐日写入所有field, 检索最大日期/已有日期
+    config = dict(field_value.data_config, table_name='bench_primitive')
+    module = methods.DICT[storage_type]
+    record('create_table', timeit(lambda: module.create_table(conn, config)))
+
+    data = make_frame(dates, fields, args.rows)
+    by_date = [x for _, x in data.groupby('date')]
+    record('update_data', timeit(lambda: [module.update_data(x, conn, config) for x in by_date]),
+           rows=len(data), writes=len(by_date))
+
+    field_config = dict(config, field=fields[-1])
+    record('max_date', timeit(lambda: module.max_date(conn, field_config), args.repeat))
+    record('list_date', timeit(lambda: module.list_date(conn, field_config), args.repeat))
+    if hasattr(module, 'list_field_date'):
+        record('list_field_date', timeit(lambda: module.list_field_date(conn, config), args.repeat))
+
+    # 完整的更新流程: 第一次为全量计算写入, 第二次为无需更新时的检索开销
+    update_instance = DataUpdate.indicator_from_func(
+        field_value, storage_type, conn, fields, 'bench_dates', base_date=dates[0], workers=args.workers,
+        rows=args.rows
+    )
+    record('dates_update_all', timeit(lambda: update_instance.dates_update_all(dates)),
+           rows=len(data), workers=args.workers)
+    record('dates_update_all_noop', timeit(lambda: update_instance.dates_update_all(dates), args.repeat))
+
+    range_func = make_range_func('bench_range', args.rows)
+    update_instance = DataUpdate({'bench_range': range_func}, storage_type, conn, base_date=dates[0])
+    record('range_update_all', timeit(lambda: update_instance.range_update_all(dates[-1])))
+    record('range_update_all_noop', timeit(lambda: update_instance.range_update_all(dates[-1]), args.repeat))
+
+    if storage_type == 'postgresql':
+        drop_tables(conn, tables)
+    return results
+
+
+def bench_compression(storage_type, conn, args):
+    """
+    测量文件类存储在每种压缩方式下逐日写入/全表读取的耗时与占用的磁盘空间
+
+    Returns
+    -------
+    list of dict: {storage_type, op, compression, seconds, ...}
+    """
+    dates = [x.strftime("%Y%m%d") for x in pd.bdate_range('20100101', periods=args.dates)]
+    fields = ["f{:03d}".format(x) for x in range(args.fields)]
+    data = make_frame(dates, fields, args.rows)
+    by_date = [x for _, x in data.groupby('date')]
+    module = methods.DICT[storage_type]
+    results = list()
+
+    for codec in args.compression:
+        codec = None if codec == 'none' else codec
+        table_name = 'bench_{}'.format(codec or 'none')
+        config = dict(field_value.data_config, table_name=table_name)
+        if storage_type == 'parquet':
+            # parquet文件内部的压缩方式, none为不压缩(不指定时默认为snappy)
+            config['compression'] = codec or 'none'
+            if codec not in PARQUET_CODEC:
+                logging.info("{:<12}{:<22}跳过".format(storage_type, codec))
+                continue
+        elif codec is not None:
+            config['compression'] = codec
+            if codec not in compression.EXTENSION or (
+                    codec == 'zstd' and compression.zstandard is None) or (
+                    codec == 'lz4' and compression.lz4_frame is None):
+                logging.info("{:<12}{:<22}跳过".format(storage_type, codec))
+                continue
+
+        module.create_table(conn, config)
+        write = timeit(lambda: [module.update_data(x, conn, config) for x in by_date])
+        read = timeit(lambda: module.read_data(conn, config), args.repeat)
+        size = disk_bytes(os.path.join(conn, table_name + ('.csv' + compression.extension(codec)
+                                                          if storage_type == 'csv' else '')))
+        for op, seconds in [('compressed_write', write), ('compressed_read', read)]:
+            results.append(dict(storage_type=storage_type, op=op, compression=codec or 'none',
+                                seconds=round(seconds, 6), disk_bytes=size, rows=len(data)))
+            logging.info("{:<12}{:<22}{:<8}{:>10.4f}s{:>14d}B".format(storage_type, op, codec or 'none',
+                                                                   seconds, size))
+    return results
+
+
+def compare(report, baseline_path):
+    """
+    输出各项耗时相对于baseline的比例, 比例大于1表示变慢
+    """
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('params') != report['params']:
+        logging.warning("baseline的参数与本次不同: {}".format(baseline.get('params')))
+    base = {(x['storage_type'], x['op'], x.get('compression')): x['seconds'] for x in baseline['results']}
+    logging.info("相对于 {}:".format(baseline.get('commit')))
+    for x in report['results']:
+        before = base.get((x['storage_type'], x['op'], x.get('compression')))
+        if before:
+            logging.info("{:<12}{:<22}{:>10.4f}s {:>10.4f}s {:>8.2f}x".format(
+                x['storage_type'], x['op'] + ('/' + x['compression'] if 'compression' in x else ''),
+                before, x['seconds'], x['seconds'] / before
+            ))
+
+
+def git_commit():
+    """
+    当前的git commit, 无法获取时返回None
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="datarepo 存储方式与更新流程的性能基准")
+    parser.add_argument('--dates', type=int, default=60, help="日期数量")
+    parser.add_argument('--fields', type=int, default=10, help="field数量")
+    parser.add_argument('--rows', type=int, default=200, help="每个日期每个field的记录数")
+    parser.add_argument('--repeat', type=int, default=3, help="检索类操作的重复次数, 取最短耗时")
+    parser.add_argument('--workers', type=int, default=1, help="dates_update_all使用的workers")
+    parser.add_argument('--storage', nargs='*', default=list(methods.DICT), help="需要测量的存储方式")
+    parser.add_argument('--pg-url', default=os.environ.get('DATAREPO_BENCH_PG_URL'),
+                        help="postgresql连接, 不提供时跳过postgresql")
+    parser.add_argument('--compression', nargs='*', default=[],
+                        help="文件类存储测量的压缩方式, none表示不压缩, 如 none gzip zstd lz4")
+    parser.add_argument('--output', help="JSON结果的输出路径, 默认输出至stdout")
+    parser.add_argument('--baseline', help="之前输出的JSON结果, 提供时输出各项耗时相对于其的比例")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logging.getLogger('datarepo').setLevel(logging.WARNING)
+
+    report = {
+        'commit': git_commit(),
+        'time': pd.Timestamp.now().isoformat(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'sqlalchemy': sa.__version__,
+        'params': {'dates': args.dates, 'fields': args.fields, 'rows': args.rows, 'repeat': args.repeat,
+                   'workers': args.workers, 'compression': args.compression},
+        'results': [],
+        'skipped': {}
+    }
+
+    for storage_type in args.storage:
+        folder = tempfile.mkdtemp(prefix='datarepo_bench_')
+        conn = None
+        try:
+            conn = connect(storage_type, folder, args.pg_url)
+            if conn is None:
+                report['skipped'][storage_type] = "未提供连接或缺少依赖"
+                logging.info("{:<12}跳过".format(storage_type))
+                continue
+            report['results'].extend(bench_backend(storage_type, conn, args))
+            if args.compression and storage_type in ('csv', 'csvfolder', 'pickle', 'parquet'):
+                report['results'].extend(bench_compression(storage_type, conn, args))
+        except Exception as e:
+            report['skipped'][storage_type] = "测量失败: {}".format(e)
+            logging.exception("{:<12}测量失败".format(storage_type))
+        finally:
+            if hasattr(conn, 'dispose'):
+                conn.dispose()
+            shutil.rmtree(folder, ignore_errors=True)
+
+    if args.baseline:
+        compare(report, args.baseline)
+
+    content = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(content)
+    else:
+        print(content)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,4 +3,7 @@
 from .core import DataUpdate, data_config
 from .logger import handler
 from .import methods
-from .func_utils import gen_func_list
\ No newline at end of file
+from .func_utils import gen_func_list
+from .cache import DataCache
+from .async_update import AsyncDataUpdate
+from .task_queue import SQLiteQueue
\ No newline at end of file
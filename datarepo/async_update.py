@@ -0,0 +1,265 @@
+"""
+基于asyncio的数据更新
+
+适用于主要时间花在等待I/O上的计算函数(如从镜像拉取供应商文件, 读取数据库),
+计算函数可以是 async def, 在同一个事件循环中以协程并发运行, 并发数由semaphore控制:
+
+    @data_config(status='update', table_name='vendor_px', data_structure=..., update_method='dates')
+    async def vendor_px(date):
+        ...
+
+    update_instance = AsyncDataUpdate.from_file_path(path, storage_type, conn)
+    asyncio.run(update_instance.arun(end_date=END_DATE, date_list=TRADE_DT))
+
+普通(同步)的计算函数同样可以使用, 将在线程中运行而不阻塞事件循环
+各存储方式的读写接口均为同步接口(sqlalchemy engine, 文件), 写入在线程中进行,
+同一张表的写入通过表锁串行, 每个函数的写入按日期顺序进行
+"""
+
+import time
+import asyncio
+import inspect
+import logging
+import datetime
+from collections import deque
+from functools import partial
+
+from .core import DataUpdate, _label
+from .scheduler import build_dag, arun_dag, ALL_DATES
+from .report import timed_call, period_of
+
+
+module_logger = logging.getLogger(__name__)
+
+
+def is_async_func(func):
+    """
+    判断计算函数是否为async def定义的函数(包括经过functools.wraps包装的函数)
+    """
+    return inspect.iscoroutinefunction(inspect.unwrap(func))
+
+
+class _SyncFunc:
+    """
+    将async def的计算函数包装为同步调用, 在调用所在的线程中以新的事件循环运行
+
+    用于range/batch等仍由同步流程更新的函数
+    """
+    def __init__(self, func):
+        self.func = func
+        self.data_config = func.data_config
+
+    def __call__(self, **kwargs):
+        result = self.func(**kwargs)
+        if inspect.isawaitable(result):
+            return asyncio.run(_await(result))
+        return result
+
+
+async def _await(awaitable):
+    """
+    将awaitable转换为协程, 以便于asyncio.run运行
+    """
+    return await awaitable
+
+
+class AsyncDataUpdate(DataUpdate):
+    """
+    基于asyncio的数据更新
+    """
+    def __init__(self, func_dict, storage_type, conn, base_date='20080101', workers=1, executor='thread',
+                 catalog=False, cache_bytes=1024 ** 3, journal=None, concurrency=16):
+        """
+        初始化, 参数同DataUpdate
+
+        Parameters
+        ----------
+        concurrency: int, optional
+            每个函数同时进行计算的日期数量上限
+        """
+        super().__init__(func_dict, storage_type, conn, base_date, workers, executor, catalog, cache_bytes, journal)
+        self.concurrency = concurrency
+
+    async def _timed_call(self, func, kwargs):
+        """
+        调用计算函数并在运行报告中记录耗时, async函数直接await, 同步函数在线程中运行
+
+        async函数与其他协程共享事件循环所在的线程, 因此只记录wall time
+        """
+        if not is_async_func(func):
+            data, error, *timing = await self._to_thread(timed_call, func, kwargs)
+            self._record_compute(func, kwargs, *timing)
+            if error is not None:
+                raise error
+            return data
+
+        start_time = datetime.datetime.now()
+        wall = time.perf_counter()
+        try:
+            return await func(**kwargs)
+        finally:
+            self.report.add(_label(func.data_config), period_of(kwargs), 'compute', start_time,
+                            time.perf_counter() - wall, None)
+
+    @staticmethod
+    async def _to_thread(func, *args, **kwargs):
+        """
+        在默认的线程池中运行同步的函数(存储读写, 同步的计算函数)
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+    async def _aiter_calculate(self, tasks):
+        """
+        _iter_calculate的asyncio版本, 按tasks的顺序逐个给出 (标识, 计算结果, 计算错误)
+
+        同时进行的计算不超过concurrency个, 已提交但尚未取出的任务数同样有上限
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _calculate(func, kwargs):
+            async with semaphore:
+                return await self._timed_call(func, kwargs)
+
+        pending = deque()
+        try:
+            for tag, func, kwargs in tasks:
+                pending.append((tag, asyncio.ensure_future(_calculate(func, kwargs))))
+                if len(pending) < self.concurrency * 4:
+                    continue
+                yield await _pop_task(pending)
+            while pending:
+                yield await _pop_task(pending)
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def aupdate(self, func, skip_dates=None, **kwargs):
+        """
+        update的asyncio版本
+
+        dates更新的函数逐日并发计算; range与batch更新的函数仍按照同步的流程在线程中更新
+
+        Returns
+        -------
+        更新失败的日期: set of str / scheduler.ALL_DATES
+        """
+        if func.data_config['update_method'] != 'dates':
+            if is_async_func(func):
+                func = _SyncFunc(func)
+            return await self._to_thread(self.update, func, skip_dates, **kwargs)
+
+        await self._to_thread(self._create_table, func.data_config)
+        return await self.adates_update(func, kwargs['date_list'], skip_dates, kwargs.get('existing'))
+
+    async def adates_update(self, func, date_list, skip_dates=None, existing=None):
+        """
+        dates_update的asyncio版本, 缺失的日期并发计算, 结果按日期顺序逐个写入
+
+        Returns
+        -------
+        更新失败的日期: set of str / scheduler.ALL_DATES
+        """
+        label = _label(func.data_config)
+
+        if skip_dates == ALL_DATES:
+            module_logger.warning("{} 上游数据更新失败, 跳过更新".format(label))
+            return ALL_DATES
+
+        # 检索需要更新的日期
+        update_list, failed = await self._to_thread(self._plan_dates, func, date_list, skip_dates, existing)
+
+        # 若没有需要更新的日期，则不进行计算
+        if len(update_list) == 0:
+            module_logger.info("{} 无需更新".format(label))
+            return failed
+
+        async for dt, data, error in self._aiter_calculate([(dt, func, {'date': dt}) for dt in update_list]):
+            # 数据计算
+            if error is not None:
+                module_logger.error("{} 数据计算错误, {}: {}".format(label, dt, error), exc_info=error)
+                failed.add(dt)
+                continue
+            module_logger.debug("{} {}数据计算成功".format(label, dt))
+
+            # 如有新数据
+            if len(data) > 0:
+                # 数据更新
+                try:
+                    self._journal_writing(label, [dt])
+                    await self._to_thread(self._write, func.data_config, data, dt)
+                    self._journal_done(label, [dt])
+                    module_logger.info("{} 数据更新成功, {} 共 {} 条记录".format(label, dt, len(data)))
+                except Exception as e:
+                    module_logger.error("{} 数据更新错误, {}: {}".format(label, dt, e), exc_info=True)
+                    failed.add(dt)
+            # 如果没有新数据
+            else:
+                module_logger.info("{} {}未更新，计算结果得到0条记录".format(label, dt))
+        return failed
+
+    async def arange_update_all(self, end_date):
+        """
+        range_update_all的asyncio版本
+
+        Returns
+        -------
+        dict: {函数名: 更新失败的日期}
+        """
+        func_dict = {x: self.func_dict[x] for x in self.func_dict
+                     if self.func_dict[x].data_config['update_method'] == 'range'}
+        failed = await arun_dag(
+            build_dag(func_dict),
+            lambda x, skip_dates: self.aupdate(func=func_dict[x], skip_dates=skip_dates, end_date=end_date)
+        )
+        self.cache.log_stats()
+        return failed
+
+    async def adates_update_all(self, date_list, frequency=None):
+        """
+        dates_update_all的asyncio版本, 互不依赖的函数同时更新
+
+        Returns
+        -------
+        dict: {函数名: 更新失败的日期}
+        """
+        func_dict = {x: self.func_dict[x] for x in self.func_dict
+                     if self.func_dict[x].data_config['update_method'] in ('dates', 'batch')}
+        await self._to_thread(self._journal_begin, date_list, 'field')
+        existing = await self._to_thread(self._batch_existing, self._unplanned(func_dict))
+        failed = await arun_dag(
+            build_dag(func_dict),
+            lambda x, skip_dates: self.aupdate(func=func_dict[x], skip_dates=skip_dates, date_list=date_list,
+                                               existing=existing.get(x))
+        )
+        if self.journal is not None:
+            self.journal.end()
+        self.cache.log_stats()
+        return failed
+
+    async def arun(self, end_date=None, date_list=None):
+        """
+        更新range类数据至end_date, 并更新date_list中的逐日数据
+
+        Returns
+        -------
+        dict: {函数名: 更新失败的日期}
+        """
+        failed = dict()
+        if end_date is not None:
+            failed.update(await self.arange_update_all(end_date))
+        if date_list is not None:
+            failed.update(await self.adates_update_all(date_list))
+        return failed
+
+
+async def _pop_task(pending):
+    """
+    取出最早提交的任务的 (标识, 计算结果, 计算错误)
+    """
+    tag, task = pending.popleft()
+    try:
+        data = await task
+    except Exception as e:
+        return tag, None, e
+    return tag, data, None
@@ -0,0 +1,148 @@
+"""
+数据读取的进程内缓存
+
+同一日期下的多个field函数通常需要读取相同的上游数据(收益率, 股票池, 价格等),
+通过缓存使这些数据只读取一次
+
+    CACHE = DataCache(max_bytes=2 * 1024 ** 3)
+
+    @CACHE.cached
+    def load_ret(start_date, end_date):
+        ...
+
+缓存返回的是同一个对象, 调用方应当将其视为只读
+"""
+
+import sys
+import logging
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+
+module_logger = logging.getLogger(__name__)
+
+
+class DataCache:
+    """
+    按照内存预算进行LRU淘汰的数据缓存
+    """
+    def __init__(self, max_bytes=1024 ** 3):
+        """
+        Parameters
+        ----------
+        max_bytes: int
+            缓存占用内存的上限, 超出时淘汰最久未使用的数据
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._loading = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """
+        获取key对应的数据, 未缓存时调用loader()读取并缓存
+        同一key同时只会有一个loader在读取
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key][0]
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                # 等待期间可能已由其他线程读取
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return self._data[key][0]
+                self.misses += 1
+            try:
+                value = loader()
+                self.put(key, value)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return value
+
+    def put(self, key, value):
+        """
+        缓存数据, 超出内存预算时淘汰最久未使用的数据
+        单个数据超过内存预算时不进行缓存
+        """
+        size = _sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._data.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._data[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.nbytes -= evicted
+
+    def invalidate(self, table_name):
+        """
+        删除某张表的所有缓存, 表被写入后需要调用以避免读取到过期的数据
+        """
+        with self._lock:
+            for key in [x for x in self._data if isinstance(x, tuple) and len(x) > 0 and x[0] == table_name]:
+                self.nbytes -= self._data.pop(key)[1]
+
+    def clear(self):
+        """
+        清空缓存
+        """
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def cached(self, func):
+        """
+        用于缓存函数结果的decorator, 以 (函数名, 参数) 作为key
+        """
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__module__, func.__qualname__, _freeze(args), _freeze(kwargs))
+            return self.get(key, lambda: func(*args, **kwargs))
+        return wrapper
+
+    def log_stats(self):
+        """
+        在日志中记录缓存的命中情况
+        """
+        if self.hits + self.misses > 0:
+            module_logger.info("数据缓存: 命中{}次, 未命中{}次, 占用{:.1f}MB".format(
+                self.hits, self.misses, self.nbytes / 1024 ** 2
+            ))
+
+
+def _freeze(obj):
+    """
+    将参数转换为可以作为key的形式
+    """
+    if isinstance(obj, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in obj.items()))
+    if isinstance(obj, (set, frozenset)):
+        return frozenset(_freeze(x) for x in obj)
+    if isinstance(obj, (list, tuple)):
+        return tuple(_freeze(x) for x in obj)
+    return obj
+
+
+def _sizeof(value):
+    """
+    估计数据占用的内存
+    """
+    if hasattr(value, 'memory_usage'):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    return sys.getsizeof(value)
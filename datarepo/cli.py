@@ -0,0 +1,105 @@
+"""
+命令行入口
+
+    # 检索需要更新的日期并放入队列
+    datarepo enqueue --queue tasks.db --path data_function.py --storage sql --conn postgresql://... \
+        --dates 20110104 20110105 --end-date 20110105
+    # 在任意数量的进程/机器上启动worker
+    datarepo worker --queue tasks.db --path data_function.py --storage sql --conn postgresql://...
+    # 查看队列中各状态的任务数量
+    datarepo status --queue tasks.db
+"""
+
+import json
+import logging
+import argparse
+
+from .core import DataUpdate
+from .logger import handler
+from .task_queue import SQLiteQueue, run_worker
+
+
+# 文件类存储, 多个worker写入时需要进程间的写入锁
+FILE_STORAGE = ('pickle', 'csvfolder', 'csv', 'parquet')
+
+
+def _connection(storage_type, conn):
+    """
+    根据命令行参数生成数据连接, sql类存储为sqlalchemy engine, 文件类存储为路径
+    """
+    if storage_type in ('sql', 'postgresql'):
+        import sqlalchemy as sa
+        return sa.create_engine(conn)
+    return conn
+
+
+def _update_instance(args):
+    """
+    根据命令行参数实例化DataUpdate
+    """
+    update_instance = DataUpdate.from_file_path(
+        path=args.path, storage_type=args.storage, conn=_connection(args.storage, args.conn),
+        base_date=args.base_date, workers=args.workers, catalog=args.catalog
+    )
+    if args.storage in FILE_STORAGE:
+        update_instance.lock_dir = args.lock_dir or args.conn
+    return update_instance
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='datarepo', description="datarepo 数据更新")
+    sub = parser.add_subparsers(dest='command')
+
+    def _common(p):
+        p.add_argument('--queue', required=True, help="任务队列所在的sqlite文件")
+        p.add_argument('--max-attempts', type=int, default=3, help="每个任务最多尝试的次数")
+
+    def _storage(p):
+        p.add_argument('--path', required=True, help="数据更新函数所在的py文件")
+        p.add_argument('--storage', required=True, help="存储方式")
+        p.add_argument('--conn', required=True, help="数据连接, sql类存储为数据库url, 文件类存储为目录")
+        p.add_argument('--base-date', default='20080101', help="range更新的基期")
+        p.add_argument('--workers', type=int, default=1, help="每个任务内并发计算的worker数量")
+        p.add_argument('--catalog', action='store_true', help="使用表状态目录")
+        p.add_argument('--lock-dir', help="进程间写入锁所在的目录, 文件类存储默认为conn")
+
+    p = sub.add_parser('enqueue', help="检索需要更新的日期并放入队列")
+    _common(p)
+    _storage(p)
+    p.add_argument('--dates', nargs='*', help="dates/batch类数据需要保有的日期 YYYYmmdd")
+    p.add_argument('--end-date', help="range类数据更新到的日期 YYYYmmdd")
+
+    p = sub.add_parser('worker', help="从队列中领取任务, 计算并写入")
+    _common(p)
+    _storage(p)
+    p.add_argument('--name', help="worker名称, 默认为 主机名:进程号")
+    p.add_argument('--lease', type=float, default=600, help="任务租约的时长(秒)")
+    p.add_argument('--poll', type=float, default=5, help="没有任务时等待的时间(秒)")
+    p.add_argument('--forever', action='store_true', help="队列中没有任务时继续等待, 而不是退出")
+
+    p = sub.add_parser('status', help="查看队列中各状态的任务数量")
+    _common(p)
+    p.add_argument('--run-id', help="只查看某一次运行")
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(handler())
+
+    queue = SQLiteQueue(args.queue, max_attempts=args.max_attempts)
+    if args.command == 'enqueue':
+        run_id = _update_instance(args).enqueue(queue, date_list=args.dates, end_date=args.end_date)
+        print(run_id)
+    elif args.command == 'worker':
+        run_worker(_update_instance(args), queue, worker=args.name, lease=args.lease, poll=args.poll,
+                   forever=args.forever)
+    else:
+        print(json.dumps(queue.stats(args.run_id), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,25 @@
 数据更新核心
 """
 
+import re
+import uuid
 import logging 
+import datetime
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import pandas as pd 
 
 from .methods import methods
-from .func_utils import get_func, gen_func_list
+from .func_utils import get_func, gen_func_list, picklable, FieldFunc
+from .scheduler import build_dag, run_dag, topological_order, ALL_DATES
+from .cache import DataCache
+from .report import RunReport, RUNS_CONFIG, timed_call, period_of, data_bytes
+from .journal import RunJournal, run_key
+from .locks import TableLock
+from .shared import SharedStore
 
 
 module_logger = logging.getLogger(__name__)
@@ -43,11 +56,59 @@ def data_config(status, table_name, data_structure, update_method, **kwargs):
     return wrapper
 
 
+def _split_range(start_date, end_date, chunk=None):
+    """
+    将时间范围按照chunk拆分为多个窗口
+
+    Parameters
+    ----------
+    start_date, end_date: str
+        YYYYmmdd, 包含两端
+    chunk: str, optional
+        窗口长度, 数字加单位, 单位为 D(日)/W(周)/M(月)/Y(年), 如 '1Y', '90D'
+        不提供时不进行拆分
+
+    Returns
+    -------
+    list of (窗口开始日期, 窗口结束日期)
+    """
+    if chunk is None:
+        return [(start_date, end_date)]
+
+    match = re.match(r'^(\d+)([DWMY])$', str(chunk).upper())
+    assert match is not None and int(match.group(1)) > 0, "不支持的chunk: {}".format(chunk)
+    n = int(match.group(1))
+    offset = {
+        'D': pd.DateOffset(days=n),
+        'W': pd.DateOffset(weeks=n),
+        'M': pd.DateOffset(months=n),
+        'Y': pd.DateOffset(years=n)
+    }[match.group(2)]
+
+    windows = list()
+    window_start = pd.Timestamp(start_date)
+    end = pd.Timestamp(end_date)
+    while window_start <= end:
+        window_end = min(window_start + offset - datetime.timedelta(days=1), end)
+        windows.append((window_start.strftime("%Y%m%d"), window_end.strftime("%Y%m%d")))
+        window_start = window_end + datetime.timedelta(days=1)
+    return windows
+
+
+def _label(data_config):
+    """
+    日志中用于标识数据的名称
+    """
+    return data_config['table_name'] if "field" not in data_config \
+        else "{}@{}".format(data_config['field'], data_config['table_name'])
+
+
 class DataUpdate:
     """
     用于数据更新的基类
     """
-    def __init__(self, func_dict, storage_type, conn, base_date='20080101'):
+    def __init__(self, func_dict, storage_type, conn, base_date='20080101', workers=1, executor='thread',
+                 catalog=False, cache_bytes=1024 ** 3, journal=None):
         """
         初始化
 
@@ -56,27 +117,59 @@ class DataUpdate:
         func_dict: dict of function
             一系列使用data_config作为decorator的数据计算方法
         storage_type:
-            数据存储方式, sql, csvfolder, pickle
+            数据存储方式, sql, postgresql, csvfolder, pickle, csv, parquet
         conn: str / sqlalchemy.engine
             用于连接数据库的方式 
+        workers: int, optional
+            同时进行的计算数量的上限, 默认为1即串行计算
+            一次运行(range_update_all/dates_update_all)中互不依赖的分支并发更新, 所有函数的计算共享同一个线程池/进程池
+        executor: str, optional
+            并发计算的方式, thread / process
+            process方式要求计算函数及其返回结果可以被pickle(from_file_path载入的函数以py文件路径与函数名提交),
+            indicator_from_func中较大的数值型参数在一次运行中只写入一次共享文件, worker以mmap只读打开(参见shared)
+        catalog: bool, optional
+            是否使用表状态目录记录已更新的日期, 使用时检索待更新日期不再需要扫描整张表
+        cache_bytes: int, optional
+            read所使用的数据缓存(self.cache)的内存上限
+        journal: str, optional
+            运行日志(RunJournal)的文件路径, 提供时dates_update_all在中断后再次运行将从中断处继续
         """
         assert methods.check_connection(conn, storage_type), "未能成功连接服务器"
-        assert storage_type in ('sql', "postgresql", 'pickle', 'csvfolder', 'csv'), "不支持的存储方式"
+        assert storage_type in ('sql', "postgresql", 'pickle', 'csvfolder', 'csv', 'parquet'), "不支持的存储方式"
+        assert executor in ('thread', 'process'), "不支持的并发方式"
         self.func_dict = func_dict
         self.storage_type = storage_type
         self.conn = conn 
         self.base_date = base_date
+        self.workers = workers
+        self.executor = executor
+        self.catalog = catalog
+        self.cache = DataCache(cache_bytes)
+        # executor='process'时进程池共享的大参数, 每次*_update_all结束时清理
+        self.shared = SharedStore()
+        # 一次运行中所有函数共享的线程池/进程池, 参见_run_pool
+        self._pool = None
+        self.report = RunReport()
+        self.journal = RunJournal(journal) if journal is not None else None
+        self._local = threading.local()
+        # 多个进程写入同一个文件类存储时, 用于存放进程间写入锁的目录
+        self.lock_dir = None
+        self._lock = threading.Lock()
+        self._table_locks = dict()
 
     @classmethod
-    def from_file_path(cls, path, storage_type, conn, base_date='20080101'):
+    def from_file_path(cls, path, storage_type, conn, base_date='20080101', workers=1, executor='thread',
+                       catalog=False, journal=None, manifest=True):
         """
         根据path读取某一指定py文件中的数据更新函数并实例化 DataUpdate
+        manifest为True时使用缓存的函数清单, py文件未变化时不执行该文件, 直到某一函数需要计算时才载入
         """
-        FUNC = get_func(path)
-        return cls(FUNC, storage_type, conn, base_date)
+        FUNC = get_func(path, manifest=manifest)
+        return cls(FUNC, storage_type, conn, base_date, workers, executor, catalog, journal=journal)
 
     @classmethod
-    def indicator_from_func(cls, func, storage_type, conn, field_list, table_name, base_date='20080101', **kwargs):
+    def indicator_from_func(cls, func, storage_type, conn, field_list, table_name, base_date='20080101',
+                            workers=1, executor='thread', catalog=False, journal=None, **kwargs):
         """
         根据某一prototype function对field延展成一个function dictionary, 
         每个元素function有不同的field
@@ -84,127 +177,790 @@ class DataUpdate:
         kwargs通常用于计算函数多余需要的参数与数据
         """
         FUNC = gen_func_list(func, field_list, table_name,**kwargs)
-        return cls(FUNC, storage_type, conn, base_date)
+        return cls(FUNC, storage_type, conn, base_date, workers, executor, catalog, journal=journal)
 
 
-    def update(self, func, **kwargs):
+    def update(self, func, skip_dates=None, **kwargs):
         """
         数据更新
+
+        Parameters
+        ----------
+        skip_dates: set of str / scheduler.ALL_DATES, optional
+            上游数据更新失败的日期, 对应日期将不进行计算
+
+        Returns
+        -------
+        更新失败的日期: set of str / scheduler.ALL_DATES
         """
         # 若表不存在，则创建表
-        if not methods.check_table_exist(self.conn, func.data_config, self.storage_type):
-            try:
-                methods.create_table(self.conn, func.data_config, self.storage_type)
-                module_logger.info("表{}创建成功".format(func.data_config['table_name']))
-            except Exception as e:
-                module_logger.error("表{}创建失败: {}".format(func.data_config['table_name'], e), exc_info=True)
+        self._create_table(func.data_config)
         
         update_method = func.data_config['update_method']
 
         # 根据更新方法获取当前数据情况并计算待更新的数据
         if update_method == 'range':
-            self.range_update(func, end_date=kwargs['end_date'])
+            return self.range_update(func, end_date=kwargs['end_date'], skip_dates=skip_dates)
         elif update_method == 'dates':
-            self.dates_update(func, date_list=kwargs['date_list'])
+            return self.dates_update(func, date_list=kwargs['date_list'], skip_dates=skip_dates,
+                                     existing=kwargs.get('existing'))
+        elif update_method == 'batch':
+            return self.batch_update(func, date_list=kwargs['date_list'], skip_dates=skip_dates,
+                                     existing=kwargs.get('existing'))
         else:
             module_logger.error("不存在的update_method: {}".format(update_method))
+            return ALL_DATES
             
-    def range_update(self, func, end_date):
+    def range_update(self, func, end_date, skip_dates=None):
         """
         计算一段时间内的数据并更新
+
+        若上游数据在某些日期更新失败, 则只更新至最早的失败日期之前
+        data_config中声明chunk(如 '1Y', '3M', '90D')时, 时间范围将被拆分为多个窗口按顺序计算并写入,
+        内存占用以窗口为上限, 失败时下次更新从最后一个成功写入的窗口之后继续.
+        同时声明stateless=True时, 各窗口可以并发计算(写入仍按顺序进行)
+
+        Returns
+        -------
+        更新失败的日期: set of str / scheduler.ALL_DATES
         """
+        label = _label(func.data_config)
+
+        if skip_dates == ALL_DATES:
+            module_logger.warning("{} 上游数据更新失败, 跳过更新".format(label))
+            return ALL_DATES
+
         # 检索需要更新的时间范围
-        start_date = methods.range_start_date(self.conn, func.data_config, self.storage_type)
+        with self.report.timer(label, "~{}".format(end_date), 'plan'):
+            start_date = methods.range_start_date(self.conn, func.data_config, self.storage_type, self.catalog)
         if start_date is None:
             start_date = self.base_date
         end_date = pd.Timestamp(end_date).strftime("%Y%m%d")
 
-        label = func.data_config['table_name'] if "field" not in func.data_config \
-            else "{}@{}".format(func.data_config['field'], func.data_config['table_name'])
+        # 上游数据缺失的日期之后不进行计算
+        if skip_dates:
+            first_skip = min(skip_dates)
+            if first_skip <= end_date:
+                end_date = (pd.Timestamp(first_skip) - datetime.timedelta(days=1)).strftime("%Y%m%d")
+                module_logger.warning("{} 上游数据在{}更新失败, 仅更新至{}".format(label, first_skip, end_date))
 
         # 若更新开始时间在更新结束时间之后，则不必进行计算
         if start_date > end_date:
             module_logger.info("{} :已更新至{},无需更新".format(label, start_date))
-        else:
-            # 数据计算
-            try:
-                data = func(start_date=start_date, end_date=end_date)
-                module_logger.debug("{} {} ~ {}数据计算成功".format(label, start_date, end_date))
+            return set()
+
+        # 按照data_config中的chunk将时间范围拆分为多个窗口, 逐个窗口计算并写入
+        windows = _split_range(start_date, end_date, func.data_config.get('chunk'))
+        tasks = [((x, y), func, {'start_date': x, 'end_date': y}) for x, y in windows]
+        for (window_start, window_end), data, error in self._iter_calculate(
+                tasks, parallel=func.data_config.get('stateless', False)):
+            # 某一窗口失败后, 之后的窗口均不再写入, 下次更新时将从该窗口重新开始
+            failed = set(x.strftime("%Y%m%d") for x in pd.date_range(window_start, end_date))
             # 计算失败
-            except Exception as e:
-                module_logger.error("{} {} ~ {}数据计算错误: {}".format(label, start_date, end_date, e), exc_info=True)
-            # 计算成功
+            if error is not None:
+                module_logger.error("{} {} ~ {}数据计算错误: {}".format(label, window_start, window_end, error),
+                                    exc_info=error)
+                return failed
+            module_logger.debug("{} {} ~ {}数据计算成功".format(label, window_start, window_end))
+
+            # 如有新数据
+            if len(data) > 0:
+                # 数据更新
+                try:
+                    self._write(func.data_config, data, "{}~{}".format(window_start, window_end))
+                    module_logger.info("{} 数据更新成功, {} ~ {} 共 {} 条记录".format(
+                        label, window_start, window_end, len(data)
+                    ))
+                except Exception as e:
+                    module_logger.error("{} {} ~ {}数据更新错误: {}".format(label, window_start, window_end, e),
+                                        exc_info=True)
+                    return failed
+            # 如果没有新数据
             else:
-                # 如有新数据
-                if len(data) > 0:
-                    # 数据更新
-                    try:
-                        methods.update_data(data, self.conn, func.data_config, self.storage_type)
-                        module_logger.info("{} 数据更新成功, {} ~ {} 共 {} 条记录".format(
-                            label, start_date, end_date, len(data)
-                        ))
-                    except Exception as e:
-                        module_logger.error("{} {} ~ {}数据更新错误: {}".format(label, start_date, end_date, e), exc_info=True)
-                # 如果没有新数据
-                else:
-                    module_logger.info("{} {}~{}未更新，计算结果得到0条记录".format(label, start_date, end_date))
+                module_logger.info("{} {}~{}未更新，计算结果得到0条记录".format(label, window_start, window_end))
+        return set()
 
-    def dates_update(self, func, date_list):
+    def dates_update(self, func, date_list, skip_dates=None, existing=None):
         """
         逐日计算数据并更新
+
+        上游数据更新失败的日期(skip_dates)将被跳过, 以避免基于过期的数据进行计算
+        existing为已经批量检索得到的已有日期, 若提供则不再逐个检索
+
+        Returns
+        -------
+        更新失败的日期: set of str / scheduler.ALL_DATES
         """
-        # 检索需要更新的日期
-        existing = methods.existing_date_list(self.conn, func.data_config, self.storage_type)
-        date_list = pd.to_datetime(date_list)
-        date_list = [x.strftime("%Y%m%d") for x in date_list]
-        update_list = [x for x in date_list if x not in existing]
+        label = _label(func.data_config)
+
+        if skip_dates == ALL_DATES:
+            module_logger.warning("{} 上游数据更新失败, 跳过更新".format(label))
+            return ALL_DATES
 
-        label = func.data_config['table_name'] if "field" not in func.data_config \
-            else "{}@{}".format(func.data_config['field'], func.data_config['table_name'])
+        # 检索需要更新的日期
+        update_list, failed = self._plan_dates(func, date_list, skip_dates, existing)
 
         # 若没有需要更新的日期，则不进行计算
         if len(update_list) == 0:
             module_logger.info("{} 无需更新".format(label))
         
         else:
-            for dt in update_list:
-                # 数据计算
-                try:
-                    data = func(date=dt)
+            # 所有日期的写入共享同一个连接与事务(sql类存储)
+            written = list()
+            with self._write_batch(label, written, failed):
+                # 计算可并发进行, 但结果按日期顺序逐个写入, 以保证非并发安全的存储方式(csv, pickle)的一致性
+                for dt, data, error in self._iter_calculate([(dt, func, {'date': dt}) for dt in update_list]):
+                    # 数据计算
+                    if error is not None:
+                        module_logger.error("{} 数据计算错误, {}: {}".format(label, dt, error), exc_info=error)
+                        failed.add(dt)
+                        continue
                     module_logger.debug("{} {}数据计算成功".format(label, dt))
-                except Exception as e:
-                    module_logger.error("{} 数据计算错误, {}: {}".format(label, dt, e), exc_info=True)
-                else: 
+
                     # 如有新数据
                     if len(data) > 0:
                         # 数据更新
                         try:
-                            methods.update_data(data, self.conn, func.data_config, self.storage_type)
+                            self._journal_writing(label, [dt])
+                            self._write(func.data_config, data, dt)
+                            written.append(dt)
+                            self._journal_done(label, [dt])
                             module_logger.info("{} 数据更新成功, {} 共 {} 条记录".format(
                                 label, dt, len(data)
                             ))
                         except Exception as e:
                             module_logger.error("{} 数据更新错误, {}: {}".format(label, dt, e), exc_info=True)
+                            failed.add(dt)
                     # 如果没有新数据
                     else:
                         module_logger.info("{} {}未更新，计算结果得到0条记录".format(label, dt))
+        return failed
+
+    def read(self, table_name, start_date=None, end_date=None, fields=None, columns=None, cache=True):
+        """
+        读取表中的数据
+
+        日期与field的筛选会在存储端执行(SQL中的WHERE, csvfolder/parquet中的文件与分区选择, pickle中的分段选择),
+        只读取所需的日期与列
+
+        Parameters
+        ----------
+        table_name: str
+            表名
+        start_date, end_date: str, optional
+            日期区间, 包含两端
+        fields: list of str, optional
+            需要读取的field
+        columns: list of str, optional
+            需要读取的列, 默认读取所有列
+        cache: bool, optional
+            是否使用self.cache缓存读取结果, 缓存的结果为同一个对象, 应当视为只读
+            表被写入后对应的缓存会被清除
+
+        Returns
+        -------
+        pd.DataFrame
+        """
+        def _read():
+            return methods.read_data(self.conn, table_name, self.storage_type, start_date, end_date, fields, columns,
+                                     self._table_config(table_name))
+        if not cache:
+            return _read()
+        key = (table_name, start_date, end_date,
+               None if fields is None else tuple(fields), None if columns is None else tuple(columns))
+        return self.cache.get(key, _read)
+
+    def _table_config(self, table_name):
+        """
+        func_dict中写入table_name的函数的data_config, 不存在时返回None
+        """
+        if table_name == RUNS_CONFIG['table_name']:
+            return RUNS_CONFIG
+        for x in self.func_dict:
+            if self.func_dict[x].data_config['table_name'] == table_name:
+                return self.func_dict[x].data_config
+        return None
+
+    def rebuild_catalog(self):
+        """
+        根据实际数据重建func_dict中所有表在目录中的记录, 用于目录与数据不一致时的恢复
+        """
+        rebuilt = set()
+        for x in self.func_dict:
+            data_config = self.func_dict[x].data_config
+            if data_config['table_name'] in rebuilt:
+                continue
+            with self._table_lock(data_config['table_name']):
+                if methods.rebuild_catalog(self.conn, data_config, self.storage_type):
+                    rebuilt.add(data_config['table_name'])
+            module_logger.info("{} 目录重建成功".format(x))
+
+    def compact(self):
+        """
+        合并func_dict中所有表的存储分段(适用于pickle等以追加分段方式写入的存储)
+        """
+        compacted = set()
+        for x in self.func_dict:
+            data_config = self.func_dict[x].data_config
+            if data_config['table_name'] in compacted:
+                continue
+            compacted.add(data_config['table_name'])
+            try:
+                with self._table_lock(data_config['table_name']):
+                    if not methods.check_table_exist(self.conn, data_config, self.storage_type):
+                        continue
+                    if methods.compact(self.conn, data_config, self.storage_type):
+                        module_logger.info("表{}合并成功".format(data_config['table_name']))
+            except Exception as e:
+                module_logger.error("表{}合并失败: {}".format(data_config['table_name'], e), exc_info=True)
+
+    def enqueue(self, queue, date_list=None, end_date=None):
+        """
+        检索需要更新的日期, 并将 (函数, 日期/批次/时间范围) 作为任务放入队列, 由worker计算并写入
+
+        - dates: 每个缺失的日期一个任务
+        - batch: 每batch_size个缺失的日期一个任务
+        - range: 每个函数一个任务
+        任务按照depends_on的依赖关系分层, 上一层的任务全部结束后worker才会领取下一层的任务
+
+        Parameters
+        ----------
+        queue: task_queue.TaskQueue
+        date_list: list of str, optional
+            dates/batch类数据需要保有的日期, 不提供时不更新dates/batch类数据
+        end_date: str, optional
+            range类数据更新到的日期, 不提供时不更新range类数据
+
+        Returns
+        -------
+        str: 本次运行的run_id
+        """
+        func_dict = {x: self.func_dict[x] for x in self.func_dict
+                     if (self.func_dict[x].data_config['update_method'] == 'range' and end_date is not None)
+                     or (self.func_dict[x].data_config['update_method'] in ('dates', 'batch') and date_list is not None)}
+        dag = build_dag(func_dict)
+        existing = self._batch_existing(func_dict)
+
+        run_id = uuid.uuid4().hex
+        level = dict()
+        tasks = list()
+        for x in topological_order(dag):
+            level[x] = max([level[y] + 1 for y in dag[x]], default=0)
+            task = {'func_name': x, 'upstream': dag[x], 'level': level[x]}
+            func = func_dict[x]
+            self._create_table(func.data_config)
+
+            if func.data_config['update_method'] == 'range':
+                tasks.append(dict(task, kwargs={'end_date': end_date}, dates=[]))
+                continue
+            update_list, _ = self._plan_dates(func, date_list, existing=existing.get(x))
+            batch_size = 1 if func.data_config['update_method'] == 'dates' \
+                else func.data_config.get('batch_size') or max(len(update_list), 1)
+            for i in range(0, len(update_list), batch_size):
+                batch = update_list[i: i + batch_size]
+                tasks.append(dict(task, kwargs={'date_list': batch}, dates=batch))
+
+        queue.put(run_id, tasks)
+        module_logger.info("运行{}: {}个函数共{}个任务已放入队列".format(run_id, len(func_dict), len(tasks)))
+        return run_id
+
+    def save_report(self):
+        """
+        将运行报告(self.report)写入存储中的 _datarepo_runs 表, 写入后清空报告并开始新的run_id
+        """
+        report = self.report.to_frame()
+        if len(report) == 0:
+            return
+        report.insert(2, 'field', report['run_id'])
+        self._create_table(RUNS_CONFIG)
+        try:
+            with self._table_lock(RUNS_CONFIG['table_name']):
+                methods.update_data(report, self.conn, RUNS_CONFIG, self.storage_type)
+            module_logger.info("运行报告写入成功, 共 {} 条记录".format(len(report)))
+        except Exception as e:
+            module_logger.error("运行报告写入失败: {}".format(e), exc_info=True)
+            return
+        self.report.reset()
+
+    def _batch_existing(self, func_dict):
+        """
+        对同一张表下的多个field函数(如indicator_from_func生成的函数)批量检索已有日期,
+        每张表只进行一次检索, 而不是每个field检索一次
+
+        Returns
+        -------
+        dict: {函数名: list of YYYYmmdd}
+        不支持批量检索或检索失败的函数不包含在内, 将在更新时逐个检索
+        """
+        tables = dict()
+        for x in func_dict:
+            if "field" in func_dict[x].data_config:
+                tables.setdefault(func_dict[x].data_config['table_name'], []).append(x)
+
+        existing = dict()
+        for t in tables:
+            # 只有一个field时批量检索并无优势
+            if len(tables[t]) < 2:
+                continue
+            data_config = func_dict[tables[t][0]].data_config
+            try:
+                with self.report.timer("*@{}".format(t), '', 'plan'):
+                    if methods.check_table_exist(self.conn, data_config, self.storage_type):
+                        field_date = methods.existing_field_date_dict(self.conn, data_config, self.storage_type,
+                                                                      self.catalog)
+                    else:
+                        field_date = dict()
+            except Exception as e:
+                module_logger.warning("{} 批量检索已有日期失败, 将逐个field检索: {}".format(t, e))
+                continue
+            if field_date is None:
+                continue
+            for x in tables[t]:
+                existing[x] = field_date.get(str(func_dict[x].data_config['field']), [])
+            module_logger.debug("{} 批量检索{}个field的已有日期".format(t, len(tables[t])))
+        return existing
+
+    def _table_lock(self, table_name):
+        """
+        获取表对应的写入锁
+
+        并发运行的分支可能写入同一张表(如indicator_from_func生成的field函数),
+        对同一张表的建表与写入需要串行进行. lock_dir不为空时同时在该目录下通过锁文件在进程之间串行
+        """
+        with self._lock:
+            if table_name not in self._table_locks:
+                self._table_locks[table_name] = TableLock(table_name)
+            self._table_locks[table_name].lock_dir = self.lock_dir
+            return self._table_locks[table_name]
+
+    def batch_update(self, func, date_list, skip_dates=None, existing=None):
+        """
+        将所有缺失的日期一次性(或按data_config中的batch_size分批)交给函数计算并更新
+
+        函数的参数为date_list (list of YYYYmmdd), 返回包含这些日期的一个DataFrame,
+        适用于可以对任意一组不连续的日期进行向量化计算的数据. 每一批的结果只写入一次
+
+        Returns
+        -------
+        更新失败的日期: set of str / scheduler.ALL_DATES
+        """
+        label = _label(func.data_config)
+
+        if skip_dates == ALL_DATES:
+            module_logger.warning("{} 上游数据更新失败, 跳过更新".format(label))
+            return ALL_DATES
+
+        # 检索需要更新的日期
+        update_list, failed = self._plan_dates(func, date_list, skip_dates, existing)
+        if len(update_list) == 0:
+            module_logger.info("{} 无需更新".format(label))
+            return failed
+
+        batch_size = func.data_config.get('batch_size') or len(update_list)
+        batches = [update_list[i: i + batch_size] for i in range(0, len(update_list), batch_size)]
+
+        written = list()
+        with self._write_batch(label, written, failed):
+            for batch, data, error in self._iter_calculate([(tuple(x), func, {'date_list': x}) for x in batches]):
+                batch_label = "{} ~ {}({}个日期)".format(batch[0], batch[-1], len(batch))
+                # 数据计算
+                if error is not None:
+                    module_logger.error("{} {}数据计算错误: {}".format(label, batch_label, error), exc_info=error)
+                    failed.update(batch)
+                    continue
+                module_logger.debug("{} {}数据计算成功".format(label, batch_label))
+
+                # 按日期拆分计算结果, 只保留本批次需要更新的日期
+                dt = pd.to_datetime(data['date'].astype(str)).dt.strftime("%Y%m%d") if len(data) > 0 \
+                    else pd.Series([], dtype=object)
+                in_batch = dt.isin(batch)
+                if not in_batch.all():
+                    module_logger.warning("{} {}计算结果中含有{}条不在本批次日期内的记录, 已忽略".format(
+                        label, batch_label, int((~in_batch).sum())
+                    ))
+                    data, dt = data.loc[in_batch.values], dt.loc[in_batch]
+                counts = dt.value_counts()
+                for x in batch:
+                    if x not in counts.index:
+                        module_logger.info("{} {}未更新，计算结果得到0条记录".format(label, x))
+
+                # 如有新数据, 一次性写入
+                if len(data) > 0:
+                    try:
+                        self._journal_writing(label, batch)
+                        self._write(func.data_config, data, period_of({'date_list': batch}))
+                        written.extend(batch)
+                        self._journal_done(label, batch)
+                        module_logger.info("{} 数据更新成功, {} 共 {} 条记录".format(label, batch_label, len(data)))
+                    except Exception as e:
+                        module_logger.error("{} {}数据更新错误: {}".format(label, batch_label, e), exc_info=True)
+                        failed.update(batch)
+        return failed
+
+    def dates_update_by_date(self, func_dict, date_list, skip_dates=None, existing=None):
+        """
+        以日期优先的顺序更新同一张表下的一组field函数(如indicator_from_func生成的函数)
+
+        对每个缺失的日期, 计算所有缺失该日期的field, 并将结果合并后一次性写入,
+        使得同一日期的计算在时间上集中(便于共享缓存中的数据), 写入次数也由 field数 x 日期数 降为 日期数
+
+        Parameters
+        ----------
+        func_dict: dict of function
+            同一张表下的field函数
+        existing: dict, optional
+            {函数名: 已有日期}, 已经批量检索得到的已有日期
+
+        Returns
+        -------
+        更新失败的日期: set of str / scheduler.ALL_DATES
+        """
+        existing = existing if existing is not None else dict()
+        data_config = next(iter(func_dict.values())).data_config
+        table_name = data_config['table_name']
+
+        if skip_dates == ALL_DATES:
+            module_logger.warning("{} 上游数据更新失败, 跳过更新".format(table_name))
+            return ALL_DATES
+
+        self._create_table(data_config)
+
+        # 检索每个field需要更新的日期
+        failed = set()
+        date_field = dict()
+        for x in func_dict:
+            update_list, field_failed = self._plan_dates(func_dict[x], date_list, skip_dates, existing.get(x))
+            failed.update(field_failed)
+            for dt in update_list:
+                date_field.setdefault(dt, []).append(x)
+
+        if len(date_field) == 0:
+            module_logger.info("{} 无需更新".format(table_name))
+            return failed
+
+        written = list()
+        with self._write_batch(table_name, written, failed):
+            tasks = [((dt, x), func_dict[x], {'date': dt}) for dt in sorted(date_field) for x in date_field[dt]]
+            batch = list()
+            batch_label = list()
+            batch_date = None
+            for (dt, x), data, error in self._iter_calculate(tasks):
+                # 日期变化时写入前一日期的所有field
+                if batch_date is not None and dt != batch_date:
+                    self._write_date(data_config, batch_date, batch, written, failed, batch_label)
+                    batch = list()
+                    batch_label = list()
+                batch_date = dt
+
+                label = _label(func_dict[x].data_config)
+                if error is not None:
+                    module_logger.error("{} 数据计算错误, {}: {}".format(label, dt, error), exc_info=error)
+                    failed.add(dt)
+                    continue
+                module_logger.debug("{} {}数据计算成功".format(label, dt))
+                if len(data) > 0:
+                    if 'field' not in data.columns:
+                        data = data.assign(field=func_dict[x].data_config['field'])
+                    batch.append(data)
+                    batch_label.append(label)
+                else:
+                    module_logger.info("{} {}未更新，计算结果得到0条记录".format(label, dt))
+
+            self._write_date(data_config, batch_date, batch, written, failed, batch_label)
+        return failed
+
+    def _write_date(self, data_config, dt, batch, written, failed, labels=()):
+        """
+        将同一日期下多个field的计算结果合并后一次性写入
+        写入成功的日期记入written, 失败的日期记入failed, labels为batch中各结果对应的函数标识
+        """
+        if len(batch) == 0:
+            return
+        data = pd.concat(batch, ignore_index=True)
+        try:
+            for x in labels:
+                self._journal_writing(x, [dt])
+            self._write(data_config, data, dt)
+            written.append(dt)
+            for x in labels:
+                self._journal_done(x, [dt])
+            module_logger.info("{} 数据更新成功, {} 共 {} 个field {} 条记录".format(
+                data_config['table_name'], dt, len(batch), len(data)
+            ))
+        except Exception as e:
+            module_logger.error("{} 数据更新错误, {}: {}".format(data_config['table_name'], dt, e), exc_info=True)
+            failed.add(dt)
+
+    def _write(self, data_config, data, period=''):
+        """
+        在表锁内写入数据, 并删除该表的读取缓存
+        写入的耗时(包括等待表锁的时间), 记录数与数据大小记录在运行报告中
+        """
+        with self.report.timer(_label(data_config), period, 'write') as size:
+            size.update({'n_rows': len(data), 'n_bytes': data_bytes(data)})
+            with self._table_lock(data_config['table_name']):
+                methods.update_data(data, self.conn, data_config, self.storage_type, self.catalog)
+                self.cache.invalidate(data_config['table_name'])
+
+    @contextmanager
+    def _write_batch(self, label, written, failed):
+        """
+        一批写入共享同一个连接与事务(sql类存储), 批内单次写入失败只回滚该次写入
+        最终提交失败时, 本批中已写入的日期(written)均记为失败;
+        批内处理计算结果时的错误不在此处理, 回滚后继续抛出, 由调度将整个函数记为失败
+        """
+        # 共享事务中的写入在提交后才记入运行日志
+        deferred = list()
+        self._local.deferred = deferred
+        body_error = False
+        try:
+            with methods.write_batch(self.conn, self.storage_type):
+                try:
+                    yield
+                except BaseException:
+                    body_error = True
+                    raise
+        except Exception as e:
+            if body_error:
+                raise
+            module_logger.error("{} 数据提交错误: {}".format(label, e), exc_info=True)
+            failed.update(written)
+        else:
+            for x, dates in deferred:
+                self.journal.mark_done(x, dates)
+        finally:
+            self._local.deferred = None
+
+    def _journal_begin(self, date_list, order):
+        """
+        开始运行日志, 日志中参数相同且中断的运行将被恢复
+        """
+        if self.journal is not None:
+            self.journal.begin(run_key('dates', date_list=[x.strftime("%Y%m%d") for x in pd.to_datetime(date_list)],
+                                       order=order))
+
+    def _unplanned(self, func_dict):
+        """
+        运行日志中尚没有更新计划的函数, 有计划的函数不需要再检索已有日期
+        """
+        if self.journal is None:
+            return func_dict
+        return {x: func_dict[x] for x in func_dict if self.journal.remaining(_label(func_dict[x].data_config)) is None}
+
+    def _journal_writing(self, label, dates):
+        """
+        在运行日志中记录即将写入的日期, 恢复时将先检查这些日期是否已经写入(参见_confirm_written)
+        """
+        if self.journal is not None:
+            self.journal.mark_writing(label, dates)
+
+    def _confirm_written(self, func, remaining):
+        """
+        从中断的运行中恢复时, 在存储中检查开始写入但尚未记为完成的日期,
+        已经写入的日期(如文件类存储追加数据之后, 记录日志之前退出)记为完成, 不再重复写入
+
+        Returns
+        -------
+        仍需更新的日期
+        """
+        label = _label(func.data_config)
+        unconfirmed = self.journal.unconfirmed(label)
+        if len(unconfirmed) == 0:
+            return remaining
+        # 目录在数据之后写入, 直接检查存储中的数据
+        missing = set(methods.missing_date_list(self.conn, func.data_config, self.storage_type, unconfirmed))
+        written = [x for x in unconfirmed if x not in missing]
+        if len(written) > 0:
+            self.journal.mark_done(label, written)
+            module_logger.info("{} 中断前已写入, 不再更新: {}".format(label, ", ".join(written)))
+        return [x for x in remaining if x not in written]
+
+    def _journal_done(self, label, dates):
+        """
+        在运行日志中记录写入成功的日期, 处于共享事务的批量写入中时, 推迟至提交之后记录
+        """
+        if self.journal is None:
+            return
+        deferred = getattr(self._local, 'deferred', None)
+        if deferred is not None and methods.in_write_batch(self.conn, self.storage_type):
+            deferred.append((label, list(dates)))
+        else:
+            self.journal.mark_done(label, dates)
+
+    def _plan_dates(self, func, date_list, skip_dates=None, existing=None):
+        """
+        检索函数需要更新的日期, 并剔除上游数据更新失败的日期
+
+        Returns
+        -------
+        (需要更新的日期, 因上游失败而跳过的日期)
+        """
+        label = _label(func.data_config)
+        remaining = self.journal.remaining(label) if self.journal is not None else None
+        if remaining is not None:
+            # 从中断的运行中恢复, 只更新计划中尚未完成的日期
+            update_list = self._confirm_written(func, remaining)
+        elif existing is None:
+            with self.report.timer(label, period_of({'date_list': list(date_list)}), 'plan'):
+                update_list = methods.missing_date_list(self.conn, func.data_config, self.storage_type, date_list,
+                                                        self.catalog)
+        else:
+            existing = set(existing)
+            date_list = pd.to_datetime(date_list)
+            date_list = [x.strftime("%Y%m%d") for x in date_list]
+            update_list = [x for x in date_list if x not in existing]
+        if remaining is None and self.journal is not None:
+            self.journal.plan(label, update_list)
+
+        skipped = set()
+        if skip_dates:
+            skipped = set(x for x in update_list if x in skip_dates)
+            if len(skipped) > 0:
+                module_logger.warning("{} 上游数据更新失败, 跳过: {}".format(
+                    label, ", ".join(sorted(skipped))
+                ))
+                update_list = [x for x in update_list if x not in skipped]
+        return update_list, skipped
+
+    def _create_table(self, data_config):
+        """
+        若表不存在，则创建表
+        """
+        with self._table_lock(data_config['table_name']):
+            if not methods.check_table_exist(self.conn, data_config, self.storage_type):
+                try:
+                    methods.create_table(self.conn, data_config, self.storage_type, self.catalog)
+                    module_logger.info("表{}创建成功".format(data_config['table_name']))
+                except Exception as e:
+                    module_logger.error("表{}创建失败: {}".format(data_config['table_name'], e), exc_info=True)
+
+    def _iter_calculate(self, tasks, parallel=True):
+        """
+        按tasks的顺序逐个给出 (标识, 计算结果, 计算错误)
+
+        Parameters
+        ----------
+        tasks: list of (标识, 计算函数, 参数dict)
+        parallel: bool
+            为False时逐个计算, 每个任务在前一个结果被处理之后才开始计算
+
+        workers大于1时, 计算将提交至线程池/进程池中并发进行(同时提交的任务数有上限),
+        结果仍按照tasks的顺序依次返回, 便于由单一的写入方按顺序写入
+        运行中(_run_pool)的所有计算均提交至本次运行共享的池, 使同时进行的计算不超过workers个
+        """
+        if self.workers <= 1 or (self._pool is None and (not parallel or len(tasks) <= 1)):
+            for tag, func, kwargs in tasks:
+                data, error, *timing = timed_call(func, kwargs)
+                self._record_compute(func, kwargs, *timing)
+                yield tag, data, error
+            return
+
+        with self._compute_pool() as pool:
+            pending = deque()
+            for tag, func, kwargs in tasks:
+                pending.append((tag, func, kwargs, pool.submit(timed_call, self._pool_func(func), kwargs)))
+                if parallel and len(pending) < self.workers * 4:
+                    continue
+                yield self._pop_result(pending)
+            while pending:
+                yield self._pop_result(pending)
+
+    @contextmanager
+    def _compute_pool(self):
+        """
+        计算所使用的池: 运行中时为本次运行共享的池, 否则(如直接调用update)为只用于本次计算的池
+        """
+        if self._pool is not None:
+            yield self._pool
+            return
+        pool_cls = ThreadPoolExecutor if self.executor == 'thread' else ProcessPoolExecutor
+        with pool_cls(max_workers=self.workers) as pool:
+            yield pool
+
+    @contextmanager
+    def _run_pool(self):
+        """
+        一次运行(range_update_all/dates_update_all/队列worker)中所有函数共享的线程池/进程池,
+        结束时关闭该池并清理进程池共享的大参数
+        """
+        if self._pool is not None:
+            yield
+            return
+        pool = None
+        if self.workers > 1:
+            pool_cls = ThreadPoolExecutor if self.executor == 'thread' else ProcessPoolExecutor
+            pool = pool_cls(max_workers=self.workers)
+        self._pool = pool
+        try:
+            yield
+        finally:
+            self._pool = None
+            if pool is not None:
+                pool.shutdown()
+            self.shared.close()
+
+    def _pool_func(self, func):
+        """
+        提交至进程池的函数: field函数的较大参数替换为共享文件的句柄, 避免每个任务pickle一次;
+        由py文件载入的函数替换为可以被pickle的LazyFunc
+        """
+        if self.executor != 'process':
+            return func
+        if isinstance(func, FieldFunc):
+            return func.shared(self.shared)
+        return picklable(func)
+
+    def _pop_result(self, pending):
+        """
+        取出最早提交的任务的 (标识, 计算结果, 计算错误), 并记录计算的耗时
+        """
+        tag, func, kwargs, future = pending.popleft()
+        try:
+            data, error, *timing = future.result()
+        except Exception as e:
+            return tag, None, e
+        self._record_compute(func, kwargs, *timing)
+        return tag, data, error
+
+    def _record_compute(self, func, kwargs, start_time, wall, cpu):
+        """
+        在运行报告中记录一次计算的耗时
+        """
+        self.report.add(_label(func.data_config), period_of(kwargs), 'compute', start_time, wall, cpu)
 
     def range_update_all(self, end_date):
         """
         更新所有range类数据至end_date
 
+        函数之间按照data_config中depends_on声明的依赖关系进行调度,
+        workers大于1时互不依赖的分支将并发更新, 所有计算共享同一个线程池/进程池
+
         Parameters
         ----------
         end_date: str 
             更新到的日期
+
+        Returns
+        -------
+        dict: {函数名: 更新失败的日期}
         """
-        for x in self.func_dict:
-            if self.func_dict[x].data_config['update_method'] == 'range':
-                self.update(func=self.func_dict[x], end_date=end_date)
+        func_dict = {x: self.func_dict[x] for x in self.func_dict
+                     if self.func_dict[x].data_config['update_method'] == 'range'}
+        with self._run_pool():
+            failed = run_dag(
+                build_dag(func_dict),
+                lambda x, skip_dates: self.update(func=func_dict[x], skip_dates=skip_dates, end_date=end_date),
+                self.workers
+            )
+        self.cache.log_stats()
+        return failed
 
-    def dates_update_all(self, date_list, frequency=None):
+    def dates_update_all(self, date_list, frequency=None, order='field'):
         """
-        更新驻日更新的数据
+        更新驻日更新的数据(update_method为dates或batch)
+
+        函数之间按照data_config中depends_on声明的依赖关系进行调度,
+        workers大于1时互不依赖的分支将并发更新, 所有计算共享同一个线程池/进程池, 上游更新失败的日期下游将跳过
 
         Parameters
         ---------
@@ -212,9 +968,68 @@ class DataUpdate:
             [YYYYmmdd]
         frequency: str, optional
             更新频率，对应data_config中的frequency, 用于标识
+        order: str, optional
+            field: 逐个函数更新, 每个函数内逐日更新
+            date: 同一张表下的field函数(如indicator_from_func生成的函数)按日期优先的顺序更新,
+                  每个日期计算所有field后一次性写入, 参见dates_update_by_date
+
+        Returns
+        -------
+        dict: {函数名(order='date'时field函数组为 *@表名): 更新失败的日期}
         """
-        for x in self.func_dict:
-            if self.func_dict[x].data_config['update_method'] == 'dates':
-                self.update(func=self.func_dict[x], date_list=date_list)
+        assert order in ('field', 'date'), "不支持的更新顺序"
+        func_dict = {x: self.func_dict[x] for x in self.func_dict
+                     if self.func_dict[x].data_config['update_method'] in ('dates', 'batch')}
+        self._journal_begin(date_list, order)
+        existing = self._batch_existing(self._unplanned(func_dict))
+        if order == 'date':
+            func_dict = _group_field_func(func_dict)
+
+        def _run(x, skip_dates):
+            if isinstance(func_dict[x], FuncGroup):
+                return self.dates_update_by_date(func_dict[x].func_dict, date_list, skip_dates,
+                                                 {y: existing[y] for y in func_dict[x].func_dict if y in existing})
+            return self.update(func=func_dict[x], skip_dates=skip_dates, date_list=date_list, existing=existing.get(x))
+
+        with self._run_pool():
+            failed = run_dag(build_dag(func_dict), _run, self.workers)
+        # 正常完成时结束运行日志, 更新失败的日期将在下次运行时重新检索
+        if self.journal is not None:
+            self.journal.end()
+        self.cache.log_stats()
+        return failed
 
 
+class FuncGroup:
+    """
+    同一张表下的一组field函数, 在调度中作为一个整体
+    """
+    def __init__(self, func_dict):
+        self.func_dict = func_dict
+        self.data_config = next(iter(func_dict.values())).data_config
+
+
+def _group_field_func(func_dict):
+    """
+    将同一张表下的多个逐日更新(dates)的field函数合并为一个FuncGroup, 其余函数保持不变
+
+    Returns
+    -------
+    dict: {函数名 / *@表名: function / FuncGroup}
+    """
+    tables = dict()
+    for x in func_dict:
+        if "field" in func_dict[x].data_config and func_dict[x].data_config['update_method'] == 'dates':
+            tables.setdefault(func_dict[x].data_config['table_name'], []).append(x)
+
+    grouped = dict()
+    for x in func_dict:
+        data_config = func_dict[x].data_config
+        if "field" not in data_config or data_config['update_method'] != 'dates' \
+                or len(tables[data_config['table_name']]) < 2:
+            grouped[x] = func_dict[x]
+        elif "*@{}".format(data_config['table_name']) not in grouped:
+            grouped["*@{}".format(data_config['table_name'])] = FuncGroup(
+                {y: func_dict[y] for y in tables[data_config['table_name']]}
+            )
+    return grouped
@@ -2,14 +2,32 @@
 函数相关方法
 """
 
+import os
+import json
+import hashlib
 import types
 import inspect 
+import logging
 import importlib
+import importlib.util
+import threading
+from copy import copy
+from collections.abc import Mapping
 from functools import wraps, partial
-from copy import deepcopy
 
+from .shared import resolve
 
-def get_func(path):
+
+module_logger = logging.getLogger(__name__)
+
+# 已载入的py文件: {(路径, mtime, 大小): module}
+_MODULES = dict()
+# 已载入的module名称与py文件路径: {module名称: 路径}
+_MODULE_PATHS = dict()
+_MODULES_LOCK = threading.Lock()
+
+
+def get_func(path, manifest=False):
     """
     以dictionary的形式获得 指定py文件中所有的function
     
@@ -17,12 +35,18 @@ def get_func(path):
     ---------
     path: str 
         指定的py文件路径
+    manifest: bool
+        是否使用缓存的函数清单. 为True时, 若py文件的修改时间与大小和清单中记录的一致,
+        则直接根据清单生成LazyFunc, 不执行py文件; 只有在某一函数被调用时才载入py文件
+        清单位于py文件所在目录的__pycache__中, py文件发生变化时重新生成
+        清单只根据该py文件本身判断是否过期, data_config依赖其他文件中的内容时不应使用
     """
-    # 根据路径载入module
-    spec = importlib.util.spec_from_file_location("temp_module", path)
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
+    if manifest:
+        FUNC = _read_manifest(path)
+        if FUNC is not None:
+            return FUNC
 
+    module = _load_module(path)
     FUNC = inspect.getmembers(module, inspect.isfunction)
     FUNC = {x[0]: x[1] for x in FUNC}
 
@@ -30,9 +54,131 @@ def get_func(path):
     FUNC = {x: FUNC[x] for x in FUNC if hasattr(FUNC[x], 'data_config')}
     # 只保留当前状态为更新的
     FUNC = {x: FUNC[x] for x in FUNC if FUNC[x].data_config['status']=='update'}
+
+    if manifest:
+        _write_manifest(path, FUNC)
     return FUNC
 
 
+class LazyFunc:
+    """
+    由函数清单生成的数据更新函数, data_config直接来自清单, 调用时才载入函数所在的py文件
+
+    可以被pickle(只记录路径与函数名), 适用于executor='process'
+    """
+    def __init__(self, path, name, data_config):
+        self.path = path
+        self.__name__ = name
+        self.__qualname__ = name
+        self.data_config = data_config
+
+    def load(self):
+        """
+        载入py文件并返回实际的函数
+        """
+        return getattr(_load_module(self.path), self.__name__)
+
+    @property
+    def __wrapped__(self):
+        return self.load()
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __reduce__(self):
+        return (LazyFunc, (self.path, self.__name__, self.data_config))
+
+    def __repr__(self):
+        return "<LazyFunc {} in {}>".format(self.__name__, self.path)
+
+
+def picklable(func):
+    """
+    提交至进程池的函数: 由py文件载入的函数(get_func)无法按module名称import, 无法被pickle,
+    替换为只记录路径与函数名的LazyFunc, worker进程中再载入该py文件; 其余函数原样返回
+    """
+    path = _MODULE_PATHS.get(getattr(func, '__module__', None))
+    if path is None or not isinstance(func, types.FunctionType):
+        return func
+    return LazyFunc(path, func.__name__, func.data_config)
+
+
+def _file_key(path):
+    """
+    py文件的路径, 修改时间与大小, 用于判断文件是否发生变化
+    """
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def _load_module(path):
+    """
+    根据路径载入module, 同一文件未发生变化时只载入一次
+    """
+    key = _file_key(path)
+    with _MODULES_LOCK:
+        if key not in _MODULES:
+            # 每个py文件使用不同的module名称, 以便由函数的__module__找到其所在的py文件
+            name = "_datarepo_{}".format(hashlib.md5(key[0].encode('utf-8')).hexdigest())
+            spec = importlib.util.spec_from_file_location(name, path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            _MODULES[key] = module
+            _MODULE_PATHS[name] = key[0]
+        return _MODULES[key]
+
+
+def _manifest_path(path):
+    """
+    函数清单的路径
+    """
+    path = os.path.abspath(path)
+    return os.path.join(os.path.dirname(path), '__pycache__',
+                        "{}.datarepo.json".format(os.path.splitext(os.path.basename(path))[0]))
+
+
+def _read_manifest(path):
+    """
+    读取函数清单, 清单不存在或已过期时返回None
+    """
+    try:
+        with open(_manifest_path(path), encoding='utf-8') as f:
+            content = json.load(f)
+    except (OSError, ValueError):
+        return None
+    _, mtime, size = _file_key(path)
+    if content.get('mtime') != mtime or content.get('size') != size:
+        return None
+    return {x: LazyFunc(path, x, config) for x, config in content['functions'].items()}
+
+
+def _write_manifest(path, func_dict):
+    """
+    写入函数清单, data_config无法以json保存时不写入
+    """
+    _, mtime, size = _file_key(path)
+    try:
+        content = json.dumps({
+            'mtime': mtime,
+            'size': size,
+            'functions': {x: func_dict[x].data_config for x in func_dict}
+        }, ensure_ascii=False)
+    except (TypeError, ValueError):
+        module_logger.debug("{}中的data_config无法以json保存, 不使用函数清单".format(path))
+        return
+    manifest_path = _manifest_path(path)
+    tmp_path = "{}.{}.tmp".format(manifest_path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, manifest_path)
+    except OSError as e:
+        module_logger.debug("函数清单{}写入失败: {}".format(manifest_path, e))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 def gen_func_list(func, field_list, table_name, **params):
     """
     给定一个prototype的计算func: func(date, field, ....)
@@ -43,21 +189,110 @@ def gen_func_list(func, field_list, table_name, **params):
                  ...
     }
     的形式
+
+    Returns
+    -------
+    FuncSet: 只保存一个prototype与field列表, 各field的函数在访问时生成
+    """
+    return FuncSet(func, field_list, table_name, **params)
+
+
+class Prototype:
+    """
+    预先绑定params的prototype函数, 函数签名只解析一次, params以引用的方式共享, 不进行复制
     """
+    def __init__(self, func, params):
+        self.func = func
+        self.params = params
+        self.signature = signature_args(func)
+        self.defaults = default_args(func)
+        self.is_shared = False
+
+    def shared(self, store):
+        """
+        将较大的params放入共享存储(shared.SharedStore), 用于进程池中的计算
+        同一store中只生成一次, 各field的任务共享同一个结果
+        """
+        def _build():
+            prototype = copy(self)
+            prototype.params = store.share_kwargs(self.params)
+            prototype.is_shared = True
+            return prototype
+        return store.derive(self, _build)
+
+    def call(self, field, args, kwargs):
+        """
+        以field及params调用prototype, 参数不足时返回curried函数
+        """
+        params = self.params
+        if self.is_shared:
+            params = {k: resolve(v) for k, v in params.items()}
+        state = {**self.defaults, **params, 'field': field, **kwargs}
+        if args:
+            state.update(zip([a for a in self.signature if a not in state], args))
+        if len(state) >= len(self.signature):
+            return self.func(**state)
+        return gen_curry_function(self.func)(**state)
+
+
+class FieldFunc:
+    """
+    FuncSet中某一field对应的数据更新函数, 调用时等同于 func(field=field, **params)
+    """
+    __slots__ = ('prototype', 'field', 'data_config')
+
+    def __init__(self, prototype, field, data_config):
+        self.prototype = prototype
+        self.field = field
+        self.data_config = data_config
+
+    def __call__(self, *args, **kwargs):
+        return self.prototype.call(self.field, args, kwargs)
+
+    def shared(self, store):
+        """
+        params放入共享存储后的函数, 参见Prototype.shared
+        """
+        return FieldFunc(self.prototype.shared(store), self.field, self.data_config)
+
+    @property
+    def __name__(self):
+        return self.prototype.func.__name__
+
+    @property
+    def __wrapped__(self):
+        return self.prototype.func
 
-    func_dict = dict()
-    for x in field_list:
-        _f = gen_curry_function(func)(field=x, **params)
+    def __repr__(self):
+        return "<FieldFunc {}(field={!r})>".format(self.prototype.func.__name__, self.field)
 
-        # 此处data_config的copy是有必要的，如不执行，不同的函数将会share同一个data_config
-        # 从而导致无法正常的更新field值
-        _f.data_config = deepcopy(_f.data_config)
-        _f.data_config['field'] = x
-        _f.data_config['table_name'] = table_name
-        func_dict.update({x: _f})
-        _f = None
 
-    return func_dict 
+class FuncSet(Mapping):
+    """
+    由一个prototype与field列表表示的函数组: {field: FieldFunc}
+
+    各field的data_config为prototype的data_config的浅拷贝(只替换field与table_name),
+    data_structure等其余内容共享, 不应被修改
+    """
+    def __init__(self, func, field_list, table_name, **params):
+        self.prototype = Prototype(func, params)
+        self.fields = list(field_list)
+        self.data_config = dict(func.data_config, table_name=table_name)
+        self._field_set = set(self.fields)
+        self._funcs = dict()
+
+    def __getitem__(self, field):
+        if field not in self._funcs:
+            if field not in self._field_set:
+                raise KeyError(field)
+            self._funcs[field] = FieldFunc(self.prototype, field, dict(self.data_config, field=field))
+        return self._funcs[field]
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
 
 
 class PositionalRebindNotAllowed(Exception):
@@ -89,6 +324,10 @@ def gen_curry_function(func, exe_on_demand=False):
     signature = signature_args(func)
     defaultargs = default_args(func)
 
+    def _expected_args(kwargs):
+        """按照位置顺序给出仍然缺失的参数名称, 使用预先解析的函数签名"""
+        return [a for a in signature if a not in kwargs]
+
     def _is_callable(elements):
         """Check we have available the minimum required arguments defined in'func'"""
         return sum(map(len, elements)) >= len(signature)
@@ -104,7 +343,7 @@ def gen_curry_function(func, exe_on_demand=False):
         @wraps(func)
         def g(*callargs, **callkwargs):
 
-            args_to_kwargs = {k: v for k, v in zip(expected_args(func, kwargs), args + callargs)}
+            args_to_kwargs = {k: v for k, v in zip(_expected_args(kwargs), args + callargs)}
 
             newstate = {
                 **kwargs,
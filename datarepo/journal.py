@@ -0,0 +1,183 @@
+"""
+数据更新的运行日志(journal)
+
+以JSON lines的形式记录一次dates_update_all中每个函数计划更新的日期(plan), 开始写入的日期(write)
+与已经写入成功的日期(done), 进程在更新中途退出后, 以相同的参数再次运行时将从日志中恢复:
+计划过的函数不再检索已有日期, 只计算计划中尚未完成的日期
+
+    {"event": "begin", "key": "...", "time": "..."}
+    {"event": "plan", "func": "field@table", "dates": ["20110104", ...]}
+    {"event": "write", "func": "field@table", "dates": ["20110104"]}
+    {"event": "done", "func": "field@table", "dates": ["20110104"]}
+    {"event": "end", "time": "..."}
+
+文件类存储(csv, pickle等)先追加数据再记录done, 两者之间退出时数据已经写入而日志中尚未完成,
+因此恢复时开始写入但尚未完成的日期(unconfirmed)需要先在存储中检查, 已写入的日期不再重复写入
+
+每条记录写入后立即flush, 只防范进程退出而非操作系统崩溃
+"""
+
+import os
+import json
+import hashlib
+import logging
+import datetime
+import threading
+
+
+module_logger = logging.getLogger(__name__)
+
+
+def run_key(method, **kwargs):
+    """
+    根据更新方式与参数生成一次运行的标识, 参数相同的运行才可以从日志中恢复
+    """
+    content = json.dumps(kwargs, sort_keys=True, default=str)
+    return "{}:{}".format(method, hashlib.md5(content.encode('utf-8')).hexdigest())
+
+
+class RunJournal:
+    """
+    数据更新的运行日志
+    """
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path: str
+            日志文件路径
+        """
+        self.path = path
+        self.plans = dict()
+        self.done = dict()
+        self.writing = dict()
+        self._file = None
+        self._lock = threading.Lock()
+
+    def begin(self, key):
+        """
+        开始一次运行, 若日志中最后一次运行的key相同且尚未结束, 则恢复其记录
+
+        Returns
+        -------
+        bool: 是否从中断的运行中恢复
+        """
+        with self._lock:
+            self.plans, self.done, self.writing = dict(), dict(), dict()
+            events = self._read()
+            begin = max([i for i, x in enumerate(events) if x.get('event') == 'begin'], default=None)
+            resumed = begin is not None and events[begin].get('key') == key \
+                and all(x.get('event') != 'end' for x in events[begin:])
+
+            if resumed:
+                for x in events[begin + 1:]:
+                    if x.get('event') == 'plan':
+                        self.plans[x['func']] = list(x['dates'])
+                    elif x.get('event') == 'write':
+                        self.writing.setdefault(x['func'], set()).update(x['dates'])
+                    elif x.get('event') == 'done':
+                        self.done.setdefault(x['func'], set()).update(x['dates'])
+                self._file = open(self.path, 'a', encoding='utf-8')
+                # 退出时未写完整的记录之后另起一行
+                if self._file.tell() > 0 and not _ends_with_newline(self.path):
+                    self._file.write('\n')
+                module_logger.info("从中断的运行中恢复: {}个函数已有更新计划".format(len(self.plans)))
+            else:
+                self._file = open(self.path, 'w', encoding='utf-8')
+                self._write({'event': 'begin', 'key': key, 'time': datetime.datetime.now().isoformat()})
+        return resumed
+
+    def end(self):
+        """
+        结束本次运行
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._write({'event': 'end', 'time': datetime.datetime.now().isoformat()})
+            self._file.close()
+            self._file = None
+            self.plans, self.done, self.writing = dict(), dict(), dict()
+
+    def remaining(self, func):
+        """
+        日志中记录的函数尚未完成的日期, 不在运行中或函数没有计划时返回None
+        """
+        with self._lock:
+            if self._file is None or func not in self.plans:
+                return None
+            done = self.done.get(func, set())
+            return [x for x in self.plans[func] if x not in done]
+
+    def unconfirmed(self, func):
+        """
+        开始写入但尚未记为完成的日期, 中断时可能已经写入存储
+        """
+        with self._lock:
+            done = self.done.get(func, set())
+            return [x for x in self.plans.get(func, []) if x in self.writing.get(func, set()) and x not in done]
+
+    def plan(self, func, dates):
+        """
+        记录函数计划更新的日期
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self.plans[func] = list(dates)
+            self._write({'event': 'plan', 'func': func, 'dates': list(dates)})
+
+    def mark_writing(self, func, dates):
+        """
+        记录函数即将写入的日期
+        """
+        if len(dates) == 0:
+            return
+        with self._lock:
+            if self._file is None:
+                return
+            self.writing.setdefault(func, set()).update(dates)
+            self._write({'event': 'write', 'func': func, 'dates': list(dates)})
+
+    def mark_done(self, func, dates):
+        """
+        记录函数写入成功的日期
+        """
+        if len(dates) == 0:
+            return
+        with self._lock:
+            if self._file is None:
+                return
+            self.done.setdefault(func, set()).update(dates)
+            self._write({'event': 'done', 'func': func, 'dates': list(dates)})
+
+    def _write(self, event):
+        """
+        写入一条记录
+        """
+        self._file.write(json.dumps(event, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def _read(self):
+        """
+        读取日志中的所有记录, 忽略退出时未写完整的记录
+        """
+        if not os.path.exists(self.path):
+            return []
+        events = list()
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue
+        return events
+
+
+def _ends_with_newline(path):
+    """
+    文件是否以换行结束
+    """
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
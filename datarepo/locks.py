@@ -0,0 +1,72 @@
+"""
+表的写入锁
+
+同一进程内的线程通过threading.Lock串行写入同一张表;
+多个进程(如多个队列worker)写入同一个文件类存储时, 还需要通过锁文件在进程之间串行
+"""
+
+import os
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+module_logger = logging.getLogger(__name__)
+
+
+class FileLock:
+    """
+    基于fcntl.flock的进程间互斥锁, 不支持fcntl的系统上不进行加锁
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        if fcntl is None:
+            module_logger.warning("当前系统不支持fcntl, 进程间的写入锁{}不生效".format(path))
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class TableLock:
+    """
+    表的写入锁: 线程锁, 以及lock_dir不为空时的进程间锁
+    """
+    def __init__(self, table_name, lock_dir=None):
+        self.table_name = table_name
+        self.lock_dir = lock_dir
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._file_lock = None
+        if self.lock_dir is not None:
+            try:
+                self._file_lock = FileLock(os.path.join(self.lock_dir, ".{}.lock".format(self.table_name)))
+                self._file_lock.__enter__()
+            except BaseException:
+                self._file_lock = None
+                self._lock.release()
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self._file_lock is not None:
+                self._file_lock.__exit__(exc_type, exc_value, traceback)
+        finally:
+            self._file_lock = None
+            self._lock.release()
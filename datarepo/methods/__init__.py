@@ -1,8 +1,20 @@
+"""
+存储方式的模块在第一次使用时才import, 见methods.DICT
+"""
 
+import importlib
 
 from . import methods
-from . import csvfolder_method 
-from . import pickle_method
-from . import postgresql_method
-from . import sql_method
-from . import csv_method
\ No newline at end of file
+
+
+def __getattr__(name):
+    """
+    兼容 datarepo.methods.csv_method 等直接访问存储方式模块的写法
+    """
+    if name.endswith('_method') or name in ('catalog', 'sql_utils'):
+        try:
+            return importlib.import_module('.' + name, __name__)
+        except ModuleNotFoundError as e:
+            if e.name != '{}.{}'.format(__name__, name):
+                raise
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,193 @@
+"""
+表状态目录(catalog)
+
+记录每张表(及每个field)已经完成更新的日期, 使得检索待更新的日期时不必扫描整张表
+- sql / postgresql: 存储于同一数据库中的 _datarepo_state 表
+- 文件类存储: 存储于conn目录下的 _datarepo_state.db (sqlite)
+
+表(或field)第一次被使用时会根据实际数据建立目录, 目录与数据不一致时可以通过rebuild重建
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+import sqlalchemy as sa
+
+from . import sql_utils
+
+
+STATE_TABLE = '_datarepo_state'
+REGISTRY_TABLE = '_datarepo_state_tables'
+# 注册为ALL_FIELDS时表示整张表的所有field均已记录在目录中
+ALL_FIELDS = '*'
+
+_ENGINES = dict()
+_INITIALIZED = set()
+_LOCK = threading.Lock()
+
+
+def get_engine(conn, storage_type):
+    """
+    获取目录所在的数据库连接, 若目录表不存在则创建
+    """
+    if storage_type in ('sql', 'postgresql'):
+        engine = conn
+    else:
+        path = os.path.abspath(os.path.join(conn, STATE_TABLE + '.db'))
+        with _LOCK:
+            if path not in _ENGINES:
+                _ENGINES[path] = sa.create_engine('sqlite:///{}'.format(path))
+            engine = _ENGINES[path]
+
+    with _LOCK:
+        if id(engine) not in _INITIALIZED:
+            with engine.begin() as c:
+                c.execute(sa.text("""
+                    CREATE TABLE IF NOT EXISTS {} (
+                        table_name VARCHAR(255), field VARCHAR(255), date CHAR(8),
+                        PRIMARY KEY (table_name, field, date)
+                    )
+                """.format(STATE_TABLE)))
+                c.execute(sa.text("""
+                    CREATE TABLE IF NOT EXISTS {} (
+                        table_name VARCHAR(255), field VARCHAR(255),
+                        PRIMARY KEY (table_name, field)
+                    )
+                """.format(REGISTRY_TABLE)))
+            _INITIALIZED.add(id(engine))
+    return engine
+
+
+@contextmanager
+def _connect(engine):
+    """
+    读取目录所使用的连接, 处于批量写入中时使用批量写入的连接, 以读取到尚未提交的记录
+    """
+    c = sql_utils.active_connection(engine)
+    if c is not None:
+        yield c
+    else:
+        with engine.connect() as c:
+            yield c
+
+
+def field_key(data_config):
+    """
+    目录中field对应的值, 没有field的表记为空字符串
+    """
+    return str(data_config['field']) if 'field' in data_config else ''
+
+
+def is_registered(engine, data_config):
+    """
+    检查表(或field)是否已经记录在目录中
+    """
+    with _connect(engine) as c:
+        rows = c.execute(sa.text(
+            "SELECT field FROM {} WHERE table_name=:t AND field IN (:f, :a)".format(REGISTRY_TABLE)
+        ), {'t': data_config['table_name'], 'f': field_key(data_config), 'a': ALL_FIELDS}).fetchall()
+    return len(rows) > 0
+
+
+def register(engine, data_config, field_date, all_fields=False):
+    """
+    根据实际数据重新记录表的状态
+
+    Parameters
+    ----------
+    field_date: dict
+        {field: list of YYYYmmdd}
+    all_fields: bool
+        field_date是否包含了整张表的所有field
+    """
+    table_name = data_config['table_name']
+    rows = [{'t': table_name, 'f': f, 'd': d} for f in field_date for d in field_date[f]]
+    registered = ALL_FIELDS if all_fields else field_key(data_config)
+
+    with _LOCK, sql_utils.transaction(engine) as c:
+        if all_fields:
+            c.execute(sa.text("DELETE FROM {} WHERE table_name=:t".format(STATE_TABLE)), {'t': table_name})
+        else:
+            c.execute(sa.text("DELETE FROM {} WHERE table_name=:t AND field=:f".format(STATE_TABLE)),
+                      {'t': table_name, 'f': registered})
+        if len(rows) > 0:
+            c.execute(sa.text("INSERT INTO {} (table_name, field, date) VALUES (:t, :f, :d)".format(STATE_TABLE)), rows)
+        c.execute(sa.text("DELETE FROM {} WHERE table_name=:t AND field=:f".format(REGISTRY_TABLE)),
+                  {'t': table_name, 'f': registered})
+        c.execute(sa.text("INSERT INTO {} (table_name, field) VALUES (:t, :f)".format(REGISTRY_TABLE)),
+                  {'t': table_name, 'f': registered})
+
+
+def unregister(engine, data_config):
+    """
+    从目录中删除表的所有记录
+    """
+    with _LOCK, sql_utils.transaction(engine) as c:
+        for t in (STATE_TABLE, REGISTRY_TABLE):
+            c.execute(sa.text("DELETE FROM {} WHERE table_name=:t".format(t)), {'t': data_config['table_name']})
+
+
+def record(engine, data_config, data):
+    """
+    记录新写入数据的日期
+
+    data中存在field列时按照数据中的field记录, 否则记录为data_config中的field
+    """
+    data = data.reindex(columns=['date', 'field'])
+    data['date'] = pd.to_datetime(data['date'].astype(str)).dt.strftime("%Y%m%d")
+    if 'field' in data_config:
+        data['field'] = data['field'].fillna(data_config['field']).astype(str)
+    else:
+        data['field'] = ''
+    data = data.drop_duplicates()
+
+    with _LOCK, sql_utils.transaction(engine) as c:
+        for f, dt in data.groupby('field')['date']:
+            existing = c.execute(
+                sa.text("SELECT date FROM {} WHERE table_name=:t AND field=:f AND date IN :d".format(STATE_TABLE))
+                  .bindparams(sa.bindparam('d', expanding=True)),
+                {'t': data_config['table_name'], 'f': f, 'd': dt.tolist()}
+            ).fetchall()
+            existing = set(x[0] for x in existing)
+            rows = [{'t': data_config['table_name'], 'f': f, 'd': d} for d in dt if d not in existing]
+            if len(rows) > 0:
+                c.execute(sa.text("INSERT INTO {} (table_name, field, date) VALUES (:t, :f, :d)".format(STATE_TABLE)), rows)
+
+
+def max_date(engine, data_config):
+    """
+    目录中记录的最大日期
+    """
+    with _connect(engine) as c:
+        dt = c.execute(sa.text("SELECT MAX(date) FROM {} WHERE table_name=:t AND field=:f".format(STATE_TABLE)),
+                       {'t': data_config['table_name'], 'f': field_key(data_config)}).scalar()
+    return dt
+
+
+def list_date(engine, data_config):
+    """
+    目录中记录的所有日期
+    """
+    with _connect(engine) as c:
+        dt = c.execute(sa.text("SELECT date FROM {} WHERE table_name=:t AND field=:f".format(STATE_TABLE)),
+                       {'t': data_config['table_name'], 'f': field_key(data_config)}).fetchall()
+    return sorted(x[0] for x in dt)
+
+
+def list_field_date(engine, data_config):
+    """
+    目录中记录的各个field的所有日期
+
+    Returns
+    -------
+    dict: {field: list of YYYYmmdd}
+    """
+    with _connect(engine) as c:
+        dt = c.execute(sa.text("SELECT field, date FROM {} WHERE table_name=:t".format(STATE_TABLE)),
+                       {'t': data_config['table_name']}).fetchall()
+    field_date = dict()
+    for f, d in dt:
+        field_date.setdefault(f, []).append(d)
+    return {f: sorted(field_date[f]) for f in field_date}
@@ -0,0 +1,127 @@
+"""
+文件类存储的压缩方式
+
+data_config中的compression指定表的压缩方式, 对写入与检索透明:
+- gzip / bz2 / xz: 标准库
+- zstd: 需要安装zstandard
+- lz4: 需要安装lz4
+
+所有压缩方式均以frame(流)为单位, 追加写入时在文件末尾追加一个新的frame, 读取时依次解压所有frame,
+因此追加写入不需要改写已有的数据
+"""
+
+import io
+import bz2
+import gzip
+import lzma
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+EXTENSION = {
+    'gzip': '.gz',
+    'bz2': '.bz2',
+    'xz': '.xz',
+    'zstd': '.zst',
+    'lz4': '.lz4'
+}
+
+
+def get_compression(data_config):
+    """
+    表的压缩方式, 不压缩时为None
+    """
+    compression = data_config.get('compression')
+    if compression is None:
+        return None
+    assert compression in EXTENSION, "不支持的压缩方式: {}".format(compression)
+    assert compression != 'zstd' or zstandard is not None, "使用zstd压缩需要安装zstandard"
+    assert compression != 'lz4' or lz4_frame is not None, "使用lz4压缩需要安装lz4"
+    return compression
+
+
+def extension(compression):
+    """
+    压缩文件的扩展名, 不压缩时为空
+    """
+    return EXTENSION[compression] if compression is not None else ''
+
+
+def from_extension(name):
+    """
+    根据文件名的扩展名判断压缩方式, 不压缩时为None
+    """
+    for compression, ext in EXTENSION.items():
+        if name.endswith(ext):
+            return compression
+    return None
+
+
+def reader(f, compression):
+    """
+    将二进制文件对象包装为解压读取的文件对象, 依次读取文件中所有的frame
+    """
+    if compression is None:
+        return f
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=f, mode='rb')
+    if compression == 'bz2':
+        return bz2.BZ2File(f, mode='rb')
+    if compression == 'xz':
+        return lzma.LZMAFile(f, mode='rb')
+    if compression == 'zstd':
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True))
+    return lz4_frame.LZ4FrameFile(f, mode='rb')
+
+
+def writer(f, compression):
+    """
+    将二进制文件对象包装为压缩写入的文件对象, 关闭时完成一个frame(不关闭f)
+    """
+    if compression is None:
+        return _Unclosed(f)
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=f, mode='wb')
+    if compression == 'bz2':
+        return bz2.BZ2File(f, mode='wb')
+    if compression == 'xz':
+        return lzma.LZMAFile(f, mode='wb')
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor().stream_writer(f, closefd=False)
+    return lz4_frame.LZ4FrameFile(f, mode='wb')
+
+
+@contextmanager
+def open_file(path, mode, compression):
+    """
+    打开文件, mode为 rb / wb / ab, 写入的数据在关闭时成为文件末尾的一个新的frame
+    """
+    with open(path, mode) as f:
+        stream = reader(f, compression) if 'r' in mode else writer(f, compression)
+        try:
+            yield stream
+        finally:
+            stream.close()
+
+
+class _Unclosed(io.RawIOBase):
+    """
+    不压缩时写入的包装, 关闭时不关闭底层文件
+    """
+    def __init__(self, f):
+        self._f = f
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return self._f.write(b)
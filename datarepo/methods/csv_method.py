@@ -1,12 +1,28 @@
 """
 csv 数据检索/更新方法
+
+追加写入前在 table_name.csv.pending 中记录文件原有的长度, 写入完成后删除:
+- 读取时只读取记录的长度之前的已提交部分, 忽略正在写入或写入中断的数据
+- 下一次写入前若发现写入中断留下的记录, 将文件截断至原有的长度
+data_config中指定compression时文件为 table_name.csv.gz 等, 每次追加写入一个新的压缩frame, 不改写已有的数据
 """
 
+import io
 import os 
+from contextlib import contextmanager
 
 import numpy as np 
 import pandas as pd 
 
+from . import compression
+from .filter_utils import filter_data, str_dtype
+
+
+# 检索日期时每次读取的行数
+CHUNKSIZE = 500000
+PENDING_SUFFIX = '.pending'
+
+
 def check_connection(conn):
     """
     检查数据连接是否存在
@@ -17,8 +33,7 @@ def check_table_exist(conn, data_config):
     """
     检查表是否存在
     """
-    path = os.path.join(conn, "{}.csv".format(data_config['table_name']))
-    return os.path.exists(path)
+    return os.path.exists(_path(conn, data_config))
 
 
 def create_table(conn, data_config):
@@ -26,43 +41,181 @@ def create_table(conn, data_config):
     创建csv文件表
     """
     col = list(data_config['data_structure'].keys())
-    pd.DataFrame(columns=col).to_csv(os.path.join(conn, "{}.csv".format(data_config['table_name'])), index=False)
+    with compression.open_file(_path(conn, data_config), 'wb', compression.get_compression(data_config)) as f:
+        f.write(pd.DataFrame(columns=col).to_csv(index=False).encode('utf-8'))
 
 
 def max_date(conn, data_config):
     """
     获取表中的最大日期
     当data_config中存在field字段时，将只在对应的field字段下进行检索
+    逐块读取, 内存占用与表的大小无关
     """
-    if 'field' in data_config:
-        dt = pd.read_csv(os.path.join(conn, "{}.csv".format(data_config['table_name']))).query("field=='{}'".format(data_config['field']))['date'].tolist()
-    else:
-        dt = pd.read_csv(os.path.join(conn, "{}.csv".format(data_config['table_name'])))['date'].tolist()
-    
-    if len(dt) > 0:
-        return max(dt)
-    else:
-        return None 
+    dt = None
+    for chunk in _iter_date(conn, data_config):
+        if len(chunk) > 0:
+            chunk_max = chunk['date'].max()
+            dt = chunk_max if dt is None else max(dt, chunk_max)
+    return dt
 
 
 def list_date(conn, data_config):
     """
     获取表中所有存在的日期
     当data_config中存在field字段时，将只在对应的field字段下进行检索
+    逐块读取, 内存占用只与日期的数量相关
     """
-    dt = pd.read_csv(os.path.join(conn, "{}.csv".format(data_config['table_name'])))
-    if "field" in data_config:
-        dt = dt.query("field=='{}'".format(data_config['field']))
-    dt = np.unique(dt['date'])
+    dt = set()
+    for chunk in _iter_date(conn, data_config):
+        dt.update(np.unique(chunk['date']))
     dt = sorted(dt)
     return dt 
 
 
+def list_field_date(conn, data_config):
+    """
+    一次性获取表中所有field下存在的日期
+
+    Returns
+    -------
+    dict: {field: list of date}
+    """
+    field_date = dict()
+    with _committed(conn, data_config) as f:
+        for chunk in pd.read_csv(f, usecols=['date', 'field'], dtype={'field': str}, chunksize=CHUNKSIZE):
+            for k, v in chunk.drop_duplicates().groupby('field')['date']:
+                field_date.setdefault(k, set()).update(v)
+    return {k: sorted(field_date[k]) for k in field_date}
+
+
+def read_data(conn, data_config, start_date=None, end_date=None, fields=None, columns=None):
+    """
+    逐块读取数据, 只读取所需的列并在每块内完成日期与field的筛选
+
+    Parameters
+    ----------
+    start_date, end_date: str, optional
+        YYYYmmdd, 包含两端
+    fields: list of str, optional
+        需要读取的field
+    columns: list of str, optional
+        需要读取的列, 默认读取所有列
+    """
+    usecols = None
+    if columns is not None:
+        usecols = list(columns)
+        for x in ['date'] + (['field'] if fields is not None else []):
+            if x not in usecols:
+                usecols.append(x)
+
+    data = list()
+    with _committed(conn, data_config) as f:
+        for chunk in pd.read_csv(f, usecols=usecols, dtype=str_dtype(data_config), chunksize=CHUNKSIZE):
+            data.append(filter_data(chunk, start_date, end_date, fields, columns))
+
+    if len(data) == 0:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(data, ignore_index=True)
+
+
+def _iter_date(conn, data_config):
+    """
+    逐块读取表中的date列(及field列), 当data_config中存在field字段时只保留对应field的记录
+    """
+    usecols = ['date', 'field'] if 'field' in data_config else ['date']
+    with _committed(conn, data_config) as f:
+        for chunk in pd.read_csv(f, usecols=usecols, dtype={'field': str}, chunksize=CHUNKSIZE):
+            if 'field' in data_config:
+                chunk = chunk.loc[chunk['field'] == str(data_config['field'])]
+            yield chunk
+
+
 def update_data(data, conn, data_config):
     """
-    数据更新
+    数据更新, 追加写入至文件末尾
     """
+    path = _path(conn, data_config)
     data = data.reindex(columns=data_config['data_structure'].keys())
-    data.to_csv(os.path.join(conn, "{}.csv".format(data_config['table_name'])), mode='a', index=False, header=False)
+    recover(path)
+
+    # 记录写入前文件的长度
+    with open(path + PENDING_SUFFIX + '.tmp', 'w') as f:
+        f.write(str(os.path.getsize(path)))
+    os.replace(path + PENDING_SUFFIX + '.tmp', path + PENDING_SUFFIX)
+
+    with open(path, 'ab') as f:
+        with compression.writer(f, compression.get_compression(data_config)) as w:
+            w.write(data.to_csv(index=False, header=False).encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.remove(path + PENDING_SUFFIX)
+
+
+def recover(path):
+    """
+    若上一次写入中断, 将文件截断至写入前的长度
+    """
+    offset = _pending_offset(path)
+    if offset is None:
+        return
+    with open(path, 'r+b') as f:
+        f.truncate(offset)
+    os.remove(path + PENDING_SUFFIX)
+
+
+def _path(conn, data_config):
+    """
+    表对应的csv文件路径
+    """
+    return os.path.join(conn, "{}.csv{}".format(
+        data_config['table_name'], compression.extension(compression.get_compression(data_config))
+    ))
+
+
+def _pending_offset(path):
+    """
+    正在进行(或中断)的写入之前文件的长度, 没有时返回None
+    """
+    try:
+        with open(path + PENDING_SUFFIX) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def _committed(conn, data_config):
+    """
+    打开文件中已提交的部分(解压后)
+    """
+    path = _path(conn, data_config)
+    size = os.path.getsize(path)
+    offset = _pending_offset(path)
+    if offset is not None:
+        size = min(size, offset)
+    with open(path, 'rb') as f:
+        with compression.reader(io.BufferedReader(_LimitedReader(f, size)),
+                                compression.get_compression(data_config)) as r:
+            yield r
+
+
+class _LimitedReader(io.RawIOBase):
+    """
+    只读取文件前limit个字节的reader
+    """
+    def __init__(self, f, limit):
+        self._f = f
+        self._remaining = limit
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self._remaining)
+        if n <= 0:
+            return 0
+        n = self._f.readinto(memoryview(b)[:n])
+        self._remaining -= n
+        return n
 
 
@@ -1,10 +1,32 @@
 """
 csvfolder 数据检索/更新方法
-需要注意的是csvfolder并不支持field字段进行字段内检索
+
+每张表为一个文件夹:
+    table_name/YYYYmmdd.csv                         data_structure中没有field时, 每个日期一个文件
+    table_name/date=YYYYmmdd/field=XXX.csv          data_structure中含有field时, 每个日期每个field一个文件
+含有field的表中, 不同的field函数(如indicator_from_func生成的函数)写入各自的文件, 互不覆盖, 可以并行写入;
+已有日期/最大日期(包括按field检索)直接由目录与文件名得到, 不需要读取任何数据
+
+旧版本写入的 table_name/YYYYmmdd.csv 仍可以读取, 可通过compact转换为按field分区的文件
+每个文件先写入临时文件再重命名, 写入中断不会留下不完整的文件
+data_config中指定compression时文件名带有对应的扩展名(如 field=XXX.csv.gz), 表的压缩方式创建后不应再更改
 """
 
-import os 
-import pandas as pd 
+import os
+import re
+import uuid
+from urllib.parse import quote, unquote
+
+import pandas as pd
+
+from . import compression
+from .filter_utils import filter_data, str_dtype
+
+
+# 日期文件的文件名, 临时文件等其他文件将被忽略; {ext}为压缩方式对应的扩展名
+DATE_FILE = r'^(\d{{8}})\.csv{ext}$'
+DATE_DIR = re.compile(r'^date=(\d{8})$')
+FIELD_FILE = r'^field=(.*)\.csv{ext}$'
 
 
 def check_connection(conn):
@@ -31,10 +53,9 @@ def create_table(conn, data_config):
 def max_date(conn, data_config):
     """
     找出当前已有的最大日期
+    当data_config中存在field字段时，将只在对应的field字段下进行检索
     """
-    path = os.path.join(conn, data_config['table_name'])
-    dt_list = os.listdir(path)
-    dt_list = [x.split('.')[0] for x in dt_list]
+    dt_list = list_date(conn, data_config)
     if len(dt_list) > 0:
         return max(dt_list)
     else:
@@ -43,23 +64,209 @@ def max_date(conn, data_config):
 def list_date(conn, data_config):
     """
     列出当前已有的所有日期
+    当data_config中存在field字段时，将只在对应的field字段下进行检索
+    """
+    path = os.path.join(conn, data_config['table_name'])
+    comp = compression.get_compression(data_config)
+    if "field" in data_config:
+        field = str(data_config['field'])
+        dt_list = [x for x in _list_partition(path)
+                   if os.path.exists(_field_path(path, x, field, comp))]
+        dt_list += [x for x in _list_legacy(path, comp) if field in _legacy_fields(path, x, comp)]
+    else:
+        dt_list = [x for x in _list_partition(path) if len(_list_field(path, x, comp)) > 0]
+        dt_list += _list_legacy(path, comp)
+    return sorted(set(dt_list))
+
+
+def list_field_date(conn, data_config):
+    """
+    根据目录与文件名一次性获取表中所有field下存在的日期
+
+    Returns
+    -------
+    dict: {field: list of date}
     """
     path = os.path.join(conn, data_config['table_name'])
-    dt_list = os.listdir(path)
-    dt_list = [x.split('.')[0] for x in dt_list]
-    return sorted(dt_list)
+    comp = compression.get_compression(data_config)
+    field_date = dict()
+    for x in _list_partition(path):
+        for f in _list_field(path, x, comp):
+            field_date.setdefault(f, set()).add(x)
+    for x in _list_legacy(path, comp):
+        for f in _legacy_fields(path, x, comp):
+            field_date.setdefault(f, set()).add(x)
+    return {f: sorted(field_date[f]) for f in field_date}
+
+
+def read_data(conn, data_config, start_date=None, end_date=None, fields=None, columns=None):
+    """
+    读取数据, 只读取日期区间内(及所需field)的文件
+
+    Parameters
+    ----------
+    start_date, end_date: str, optional
+        YYYYmmdd, 包含两端
+    fields: list of str, optional
+        需要读取的field
+    columns: list of str, optional
+        需要读取的列, 默认读取所有列
+    """
+    path = os.path.join(conn, data_config['table_name'])
+    comp = compression.get_compression(data_config)
+
+    def _in_range(x):
+        return (start_date is None or x >= start_date) and (end_date is None or x <= end_date)
+
+    usecols = None
+    if columns is not None:
+        usecols = [x for x in columns if x not in ('date', 'field')]
+
+    field_set = set(str(x) for x in fields) if fields is not None else None
+    data = list()
+    for x in sorted(filter(_in_range, _list_partition(path))):
+        field_list = _list_field(path, x, comp)
+        if fields is not None:
+            field_list = [f for f in field_list if f in field_set]
+        for f in field_list:
+            content = _read_csv(_field_path(path, x, f, comp), comp, usecols=usecols, dtype=str_dtype(data_config))
+            content.insert(0, 'date', x)
+            content.insert(1, 'field', f)
+            data.append(filter_data(content, columns=columns))
+
+    for x in sorted(filter(_in_range, _list_legacy(path, comp))):
+        legacy_usecols = None
+        if usecols is not None:
+            # 按field筛选时需要读取field列, 是否存在field列以文件中的列名为准
+            legacy_usecols = list(usecols)
+            if (fields is not None or 'field' in columns) \
+                    and 'field' in _read_csv(_date_path(path, x, comp), comp, nrows=0).columns:
+                legacy_usecols.append('field')
+        content = _read_csv(_date_path(path, x, comp), comp, usecols=legacy_usecols, dtype=str_dtype(data_config))
+        content.insert(0, 'date', x)
+        data.append(filter_data(content, fields=fields, columns=columns))
+
+    if len(data) == 0:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(data, ignore_index=True)
 
 
 def update_data(data, conn, data_config):
     """
-    更新数据存储为每日一个csv文件的形式
+    更新数据
+    data_structure中含有field时每个日期每个field写入一个csv文件, 否则每个日期写入一个csv文件
+    已存在的同一日期(及field)的文件将被覆盖
     """
     path = os.path.join(conn, data_config['table_name'])
+    comp = compression.get_compression(data_config)
 
+    data = data.copy()
     data['date'] = pd.to_datetime(data['date'].astype(str))
     data['date'] = data.date.dt.strftime("%Y%m%d")
-    all_dt = data['date'].unique()
-    for i in all_dt:
-        data.loc[data['date'] == i].drop(['date'], axis=1).to_csv(os.path.join(path, "{}.csv".format(i)), index=False)
 
+    if 'field' not in data_config['data_structure']:
+        for i, part in data.groupby('date'):
+            _write_csv(part.drop(['date'], axis=1), _date_path(path, i, comp), comp)
+        return
+
+    if 'field' not in data.columns:
+        data['field'] = data_config['field']
+    data['field'] = data['field'].astype(str)
+    for (i, f), part in data.groupby(['date', 'field']):
+        date_path = os.path.join(path, "date={}".format(i))
+        os.makedirs(date_path, exist_ok=True)
+        _write_csv(part.drop(['date', 'field'], axis=1), _field_path(path, i, f, comp), comp)
+
+
+def compact(conn, data_config):
+    """
+    将旧版本写入的 YYYYmmdd.csv 转换为按field分区的文件(data_structure中含有field的表)
+    """
+    if 'field' not in data_config['data_structure']:
+        return
+    path = os.path.join(conn, data_config['table_name'])
+    comp = compression.get_compression(data_config)
+    for x in _list_legacy(path, comp):
+        legacy_path = _date_path(path, x, comp)
+        content = _read_csv(legacy_path, comp, dtype=str_dtype(data_config))
+        content.insert(0, 'date', x)
+        # 已经存在分区文件的field以分区文件为准
+        existing = set(_list_field(path, x, comp))
+        content = content.loc[~content['field'].isin(existing)]
+        if len(content) > 0:
+            update_data(content, conn, data_config)
+        os.remove(legacy_path)
+
+
+def _write_csv(data, file_path, comp=None):
+    """
+    先写入临时文件, 完成后重命名为目标文件
+    """
+    tmp_path = os.path.join(os.path.dirname(file_path),
+                            ".{}.{}.tmp".format(os.path.basename(file_path), uuid.uuid4().hex[:8]))
+    try:
+        with compression.open_file(tmp_path, 'wb', comp) as f:
+            f.write(data.to_csv(index=False).encode('utf-8'))
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _read_csv(file_path, comp=None, **kwargs):
+    """
+    读取(压缩的)csv文件
+    """
+    with compression.open_file(file_path, 'rb', comp) as f:
+        return pd.read_csv(f, **kwargs)
+
+
+def _field_path(path, dt, field, comp=None):
+    """
+    日期与field对应的文件路径
+    """
+    return os.path.join(path, "date={}".format(dt),
+                        "field={}.csv{}".format(quote(str(field), safe=''), compression.extension(comp)))
+
+
+def _date_path(path, dt, comp=None):
+    """
+    每个日期一个文件时日期对应的文件路径
+    """
+    return os.path.join(path, "{}.csv{}".format(dt, compression.extension(comp)))
 
+
+def _list_partition(path):
+    """
+    列出所有日期分区目录对应的日期
+    """
+    dt_list = [DATE_DIR.match(x) for x in os.listdir(path)]
+    return [x.group(1) for x in dt_list if x is not None]
+
+
+def _list_field(path, dt, comp=None):
+    """
+    列出日期分区目录下所有的field
+    """
+    pattern = re.compile(FIELD_FILE.format(ext=re.escape(compression.extension(comp))))
+    field_list = [pattern.match(x) for x in os.listdir(os.path.join(path, "date={}".format(dt)))]
+    return [unquote(x.group(1)) for x in field_list if x is not None]
+
+
+def _list_legacy(path, comp=None):
+    """
+    列出所有每个日期一个文件的日期
+    """
+    pattern = re.compile(DATE_FILE.format(ext=re.escape(compression.extension(comp))))
+    dt_list = [pattern.match(x) for x in os.listdir(path)]
+    return [x.group(1) for x in dt_list if x is not None]
+
+
+def _legacy_fields(path, dt, comp=None):
+    """
+    每个日期一个文件的表中, 某一日期下存在的field, 文件中没有field列时为空
+    """
+    content = _read_csv(_date_path(path, dt, comp), comp, nrows=0)
+    if 'field' not in content.columns:
+        return set()
+    return set(_read_csv(_date_path(path, dt, comp), comp, usecols=['field'], dtype={'field': str})['field'])
@@ -0,0 +1,73 @@
+"""
+读取数据时的筛选与格式统一方法
+"""
+
+import pandas as pd
+
+
+def format_date(dt):
+    """
+    将日期列统一为YYYYmmdd格式的str
+    """
+    return pd.to_datetime(pd.Series(dt).astype(str)).dt.strftime("%Y%m%d")
+
+
+def filter_data(data, start_date=None, end_date=None, fields=None, columns=None):
+    """
+    按照日期区间与field筛选数据, 并只保留所需的列
+
+    Parameters
+    ----------
+    start_date, end_date: str, optional
+        YYYYmmdd, 包含两端
+    fields: list of str, optional
+        需要保留的field
+    columns: list of str, optional
+        需要保留的列
+    """
+    mask = pd.Series(True, index=data.index)
+    if start_date is not None or end_date is not None:
+        dt = format_date(data['date']).values
+        if start_date is not None:
+            mask &= dt >= start_date
+        if end_date is not None:
+            mask &= dt <= end_date
+    if fields is not None:
+        mask &= data['field'].astype(str).isin([str(x) for x in fields])
+
+    data = data.loc[mask]
+    if columns is not None:
+        data = data[list(columns)]
+    return data
+
+
+def str_dtype(data_config):
+    """
+    读取csv时需要按str读取的列: date, field 以及data_structure中声明为字符类型的列
+    避免 '000001' 等代码被读为整数
+    """
+    dtype = {'date': str, 'field': str}
+    for x, sql_type in data_config.get('data_structure', {}).items():
+        if any(t in str(sql_type).upper() for t in ('CHAR', 'TEXT')):
+            dtype[x] = str
+    return dtype
+
+
+def conform(data, data_config, columns=None):
+    """
+    统一各存储方式读取结果的格式: date为YYYYmmdd格式的str,
+    列的顺序为columns, 未指定时为data_structure中的顺序(未声明data_structure时date与field在前)
+    """
+    if 'date' in data.columns and len(data) > 0 and not pd.api.types.is_string_dtype(data['date']):
+        data = data.assign(date=format_date(data['date']).values)
+    if columns is not None:
+        order = list(columns)
+    elif 'data_structure' in data_config:
+        # 没有任何数据时返回data_structure中的所有列
+        order = [x for x in data_config['data_structure'] if x in data.columns or len(data.columns) == 0]
+    else:
+        order = [x for x in ('date', 'field') if x in data.columns]
+    order += [x for x in data.columns if x not in order]
+    if order != list(data.columns):
+        data = data.reindex(columns=order)
+    return data
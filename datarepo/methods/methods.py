@@ -2,24 +2,54 @@
 用于数据检查/更新的方法
 """
 
+import logging
 import datetime
+import importlib
+from collections.abc import Mapping
+from contextlib import nullcontext
 
 import pandas as pd 
 
-from . import sql_method
-from . import postgresql_method
-from . import csvfolder_method
-from . import pickle_method
-from . import csv_method
+from .filter_utils import conform
 
 
-DICT = {
-    'sql': sql_method,
-    'postgresql': postgresql_method, 
-    'csvfolder': csvfolder_method,
-    'pickle': pickle_method,
-    'csv': csv_method
-}
+module_logger = logging.getLogger(__name__)
+
+
+class _Backends(Mapping):
+    """
+    存储方式对应的模块, 第一次使用某一存储方式时才import,
+    因此只使用文件类存储时不需要import sqlalchemy等其他存储方式的依赖
+    """
+    def __init__(self, modules):
+        self._modules = modules
+
+    def __getitem__(self, storage_type):
+        return importlib.import_module('.' + self._modules[storage_type], __package__)
+
+    def __iter__(self):
+        return iter(self._modules)
+
+    def __len__(self):
+        return len(self._modules)
+
+
+DICT = _Backends({
+    'sql': 'sql_method',
+    'postgresql': 'postgresql_method',
+    'csvfolder': 'csvfolder_method',
+    'pickle': 'pickle_method',
+    'csv': 'csv_method',
+    'parquet': 'parquet_method'
+})
+
+
+def _state_catalog():
+    """
+    表状态目录模块, 依赖sqlalchemy, 只在catalog=True时import
+    """
+    from . import catalog
+    return catalog
 
 
 def check_connection(conn, storage_type):
@@ -41,45 +71,225 @@ def check_table_exist(conn, data_config, storage_type):
     return DICT[storage_type].check_table_exist(conn, data_config)
 
 
-def create_table(conn, data_config, storage_type):
+def create_table(conn, data_config, storage_type, catalog=False):
     """
     创建表
+    catalog为True时同时重置目录中该表的记录
     """
     DICT[storage_type].create_table(conn, data_config)
+    if catalog:
+        rebuild_catalog(conn, data_config, storage_type)
 
 
-def range_start_date(conn, data_config, storage_type):
+def range_start_date(conn, data_config, storage_type, catalog=False):
     """
     找到range更新开始更新的日期
+    catalog为True时根据目录中记录的最大日期确定, 不再扫描表
 
     Returns
     -------
     返回 YYYYmmdd的str日期
     """
-    dt = DICT[storage_type].max_date(conn, data_config)
+    if catalog:
+        dt = _state_catalog().max_date(_catalog_engine(conn, data_config, storage_type), data_config)
+    else:
+        dt = DICT[storage_type].max_date(conn, data_config)
     if dt is None:
         return None
     else:
         dt = (pd.Timestamp(str(int(dt))) + datetime.timedelta(days=1)).strftime("%Y%m%d")
         return dt 
 
-def existing_date_list(conn, data_config, storage_type):
+def existing_date_list(conn, data_config, storage_type, catalog=False):
     """
     列出数据已有的日期
+    catalog为True时从目录中读取, 不再扫描表
 
     """
+    if catalog:
+        return _state_catalog().list_date(_catalog_engine(conn, data_config, storage_type), data_config)
     dt_list = DICT[storage_type].list_date(conn, data_config)
+    return _format_date_list(dt_list)
+
+
+def missing_date_list(conn, data_config, storage_type, date_list, catalog=False):
+    """
+    列出date_list中数据缺失的日期
+
+    sql类存储在数据库中完成检索, 只传回缺失的日期; 其他存储方式(及catalog)列出已有日期后以集合运算得到
+
+    Returns
+    -------
+    list of YYYYmmdd, 保持date_list中的顺序
+    """
+    date_list = _format_date_list(date_list)
+    if not catalog and hasattr(DICT[storage_type], 'missing_date'):
+        try:
+            missing = DICT[storage_type].missing_date(conn, data_config, sorted(set(date_list)))
+        except Exception as e:
+            module_logger.debug("{} 在数据库中检索缺失日期失败, 改为列出已有日期: {}".format(data_config['table_name'], e))
+            missing = None
+        if missing is not None:
+            missing = set(_format_date_list(missing))
+            return [x for x in date_list if x in missing]
+
+    existing = set(existing_date_list(conn, data_config, storage_type, catalog))
+    return [x for x in date_list if x not in existing]
+
+
+def existing_field_date_dict(conn, data_config, storage_type, catalog=False):
+    """
+    一次性列出表中各个field已有的日期, 用于批量检索field函数所缺失的日期
+    catalog为True时从目录中读取, 不再扫描表
+
+    Returns
+    -------
+    dict: {field: list of YYYYmmdd}
+    若存储方式不支持按field批量检索, 则返回None
+    """
+    if not hasattr(DICT[storage_type], 'list_field_date'):
+        return None
+    if catalog:
+        return _state_catalog().list_field_date(_catalog_engine(conn, data_config, storage_type), data_config)
+    dt_dict = DICT[storage_type].list_field_date(conn, data_config)
+    return {str(k): _format_date_list(v) for k, v in dt_dict.items()}
+
+
+def rebuild_catalog(conn, data_config, storage_type):
+    """
+    根据表中的实际数据重建目录中该表的记录, 用于目录与数据不一致时的恢复
+
+    若存储方式支持按field批量检索, 则一次性重建整张表所有field的记录,
+    否则只重建data_config所对应field的记录
+
+    Returns
+    -------
+    bool: 是否重建了整张表的记录
+    """
+    engine = _state_catalog().get_engine(conn, storage_type)
+    if not DICT[storage_type].check_table_exist(conn, data_config):
+        _state_catalog().unregister(engine, data_config)
+        return True
+
+    if 'field' in data_config and hasattr(DICT[storage_type], 'list_field_date'):
+        _state_catalog().register(engine, data_config, existing_field_date_dict(conn, data_config, storage_type),
+                               all_fields=True)
+        return True
+
+    _state_catalog().register(engine, data_config,
+                           {_state_catalog().field_key(data_config): existing_date_list(conn, data_config, storage_type)})
+    return 'field' not in data_config
+
+
+def _catalog_engine(conn, data_config, storage_type):
+    """
+    获取目录所在的数据库连接, 表(或field)尚未记录在目录中时先根据实际数据建立记录
+    """
+    engine = _state_catalog().get_engine(conn, storage_type)
+    if not _state_catalog().is_registered(engine, data_config):
+        rebuild_catalog(conn, data_config, storage_type)
+    return engine
+
+
+def _format_date_list(dt_list):
+    """
+    将日期统一为YYYYmmdd格式的str
+    """
     dt_list = [str(x) for x in dt_list]
     dt_list = pd.to_datetime(dt_list)
     dt_list = [x.strftime("%Y%m%d") for x in dt_list]
     return dt_list 
 
 
-def update_data(data, conn, data_config, storage_type):
+def read_data(conn, table_name, storage_type, start_date=None, end_date=None, fields=None, columns=None,
+              data_config=None):
+    """
+    读取表中的数据, 筛选条件尽可能在存储端执行, 只读取所需的日期与列
+    各存储方式的结果格式一致: date为YYYYmmdd格式的str, 字符类型的列为str, 列的顺序与data_structure一致
+
+    Parameters
+    ----------
+    table_name: str
+        表名
+    start_date, end_date: str, optional
+        日期区间, 包含两端
+    fields: list of str, optional
+        需要读取的field
+    columns: list of str, optional
+        需要读取的列, 默认读取所有列
+    data_config: dict, optional
+        表的data_config, 提供时按其中的data_structure与compression读取
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    data_config = dict(data_config or {}, table_name=table_name)
+    data_config.pop('field', None)
+    if start_date is not None:
+        start_date = pd.Timestamp(start_date).strftime("%Y%m%d")
+    if end_date is not None:
+        end_date = pd.Timestamp(end_date).strftime("%Y%m%d")
+    if isinstance(fields, str):
+        fields = [fields]
+    if isinstance(columns, str):
+        columns = [columns]
+    data = DICT[storage_type].read_data(conn, data_config, start_date, end_date, fields, columns)
+    return conform(data, data_config, columns)
+
+
+def compact(conn, data_config, storage_type):
+    """
+    合并表的存储分段
+
+    Returns
+    -------
+    bool: 存储方式是否支持合并
+    """
+    if not hasattr(DICT[storage_type], 'compact'):
+        return False
+    DICT[storage_type].compact(conn, data_config)
+    return True
+
+
+def update_data(data, conn, data_config, storage_type, catalog=False):
     """
     数据更新写入
+    catalog为True时, 在数据写入成功后将新写入的日期记录在目录中
+    sql类存储(包括sqlite)中数据与目录在同一个事务中写入, 目录写入失败时数据一并回滚;
+    文件类存储若写入目录失败, 目录与数据将不一致, 可通过rebuild_catalog恢复
+    field函数的计算结果中没有field列时, 以data_config中的field填充
+    """
+    if 'field' in data_config and 'field' not in data.columns:
+        data = data.assign(field=data_config['field'])
+    # 表尚未记录在目录中时根据已有数据建立记录, 在写入之前进行
+    engine = _catalog_engine(conn, data_config, storage_type) if catalog else None
+    with write_batch(conn, storage_type, short=True):
+        DICT[storage_type].update_data(data, conn, data_config)
+        if catalog:
+            _state_catalog().record(engine, data_config, data)
+
+
+def write_batch(conn, storage_type, short=False):
     """
-    DICT[storage_type].update_data(data, conn, data_config)
+    一批写入共享同一个连接与事务(sql类存储), 用法:
 
+        with write_batch(conn, storage_type):
+            update_data(...)
+            update_data(...)
+
+    sqlite下只有short为True的短事务共享事务(参见sql_utils.write_batch)
+    不支持的存储方式不做任何处理
+    """
+    if hasattr(DICT[storage_type], 'write_batch'):
+        return DICT[storage_type].write_batch(conn, short)
+    return nullcontext()
 
 
+def in_write_batch(conn, storage_type):
+    """
+    当前线程中是否处于共享事务的批量写入中, 此时写入要到批量写入结束时才会提交
+    """
+    if hasattr(DICT[storage_type], 'in_write_batch'):
+        return DICT[storage_type].in_write_batch(conn)
+    return False
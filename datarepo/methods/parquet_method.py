@@ -0,0 +1,212 @@
+"""
+parquet 数据检索/更新方法
+
+每张表为一个按照日期(及field)分区的parquet数据集:
+    table_name/date=YYYYmmdd/part-xxx.parquet
+    table_name/date=YYYYmmdd/field=XXX/part-xxx.parquet     (data_structure中含有field时)
+已有日期/最大日期直接由分区目录名得到, 不需要读取任何数据
+每次写入均生成新的文件, 不会改写已有的文件; 文件先以.开头的临时文件名写入再重命名,
+写入中断的文件不会被读取
+data_config中的compression为parquet文件内部的压缩方式(snappy/gzip/zstd/lz4/brotli), 默认为snappy
+
+需要安装pyarrow
+"""
+
+import os
+import uuid
+from urllib.parse import quote, unquote
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    ds = None
+    pq = None
+
+
+def check_connection(conn):
+    """
+    检查数据连接是否存在
+    """
+    return pa is not None and os.path.exists(conn)
+
+
+def check_table_exist(conn, data_config):
+    """
+    检查表是否存在
+    """
+    return os.path.exists(os.path.join(conn, data_config['table_name']))
+
+
+def create_table(conn, data_config):
+    """
+    创建表
+    """
+    path = os.path.join(conn, data_config['table_name'])
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+
+def max_date(conn, data_config):
+    """
+    找出当前已有的最大日期
+    当data_config中存在field字段时，将只在对应的field字段下进行检索
+    """
+    dt = list_date(conn, data_config)
+    if len(dt) > 0:
+        return dt[-1]
+    else:
+        return None
+
+
+def list_date(conn, data_config):
+    """
+    根据分区目录列出所有已有的日期
+    当data_config中存在field字段时，将只在对应的field字段下进行检索
+    """
+    path = os.path.join(conn, data_config['table_name'])
+    dt = list()
+    for x in _list_partition(path, 'date'):
+        date_path = os.path.join(path, 'date={}'.format(x))
+        if "field" in data_config:
+            date_path = os.path.join(date_path, 'field={}'.format(quote(str(data_config['field']), safe='')))
+        if _has_data(date_path):
+            dt.append(x)
+    return sorted(dt)
+
+
+def list_field_date(conn, data_config):
+    """
+    根据分区目录一次性获取表中所有field下存在的日期
+
+    Returns
+    -------
+    dict: {field: list of date}
+    """
+    path = os.path.join(conn, data_config['table_name'])
+    field_date = dict()
+    for x in _list_partition(path, 'date'):
+        date_path = os.path.join(path, 'date={}'.format(x))
+        for f in _list_partition(date_path, 'field'):
+            if _has_data(os.path.join(date_path, 'field={}'.format(quote(f, safe='')))):
+                field_date.setdefault(f, []).append(x)
+    return {f: sorted(field_date[f]) for f in field_date}
+
+
+def update_data(data, conn, data_config):
+    """
+    数据更新, 每个分区写入一个新的parquet文件
+    """
+    path = os.path.join(conn, data_config['table_name'])
+    partition_col = ['date', 'field'] if 'field' in data_config['data_structure'] else ['date']
+
+    if 'field' in partition_col and 'field' not in data.columns:
+        data = data.assign(field=data_config['field'])
+    data = data.reindex(columns=data_config['data_structure'].keys())
+    data['date'] = pd.to_datetime(data['date'].astype(str)).dt.strftime("%Y%m%d")
+    schema = _schema(data_config)
+
+    for keys, part in data.groupby(partition_col):
+        if not isinstance(keys, tuple):
+            keys = (keys,)
+        part_path = os.path.join(path, *["{}={}".format(k, quote(str(v), safe='')) for k, v in zip(partition_col, keys)])
+        if not os.path.exists(part_path):
+            os.makedirs(part_path, exist_ok=True)
+
+        table = pa.Table.from_pandas(part.drop(partition_col, axis=1), schema=schema, preserve_index=False)
+        name = "part-{}.parquet".format(uuid.uuid4().hex)
+        tmp_path = os.path.join(part_path, ".{}.tmp".format(name))
+        try:
+            pq.write_table(table, tmp_path, compression=data_config.get('compression') or 'snappy')
+            os.replace(tmp_path, os.path.join(part_path, name))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def read_data(conn, data_config, start_date=None, end_date=None, fields=None, columns=None):
+    """
+    读取数据, 日期与field的筛选条件作用于分区, 只读取所需分区中所需的列
+
+    Parameters
+    ----------
+    start_date, end_date: str, optional
+        YYYYmmdd, 包含两端
+    fields: list of str, optional
+        需要读取的field
+    columns: list of str, optional
+        需要读取的列, 默认读取所有列
+    """
+    path = os.path.join(conn, data_config['table_name'])
+    # 根据第一个日期分区判断是否存在field分区
+    dates = _list_partition(path, 'date')
+    partition = [('date', pa.string())]
+    if len(dates) > 0 and len(_list_partition(os.path.join(path, 'date={}'.format(dates[0])), 'field')) > 0:
+        partition.append(('field', pa.string()))
+    dataset = ds.dataset(path, format='parquet', partitioning=ds.partitioning(pa.schema(partition), flavor='hive'))
+
+    condition = None
+    if start_date is not None:
+        condition = _and(condition, ds.field('date') >= start_date)
+    if end_date is not None:
+        condition = _and(condition, ds.field('date') <= end_date)
+    if fields is not None:
+        condition = _and(condition, ds.field('field').isin([str(x) for x in fields]))
+
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+def _and(condition, expr):
+    """
+    合并筛选条件
+    """
+    return expr if condition is None else condition & expr
+
+
+def _schema(data_config):
+    """
+    根据data_structure生成除分区列外的arrow schema
+    """
+    return pa.schema([
+        (x, _arrow_type(data_config['data_structure'][x]))
+        for x in data_config['data_structure'] if x not in ('date', 'field')
+    ])
+
+
+def _arrow_type(sql_type):
+    """
+    将data_structure中的SQL类型转换为arrow类型, 无法识别的类型按照string存储
+    """
+    t = sql_type.upper()
+    if t.startswith(('FLOAT', 'DOUBLE', 'REAL', 'NUMERIC', 'DECIMAL')):
+        return pa.float64()
+    if t.startswith(('INT', 'BIGINT', 'SMALLINT')):
+        return pa.int64()
+    if t.startswith('BOOL'):
+        return pa.bool_()
+    if t.startswith('TIMESTAMP'):
+        return pa.timestamp('ns')
+    return pa.string()
+
+
+def _list_partition(path, key):
+    """
+    列出path下key=value形式的分区值
+    """
+    if not os.path.exists(path):
+        return []
+    prefix = "{}=".format(key)
+    return [unquote(x[len(prefix):]) for x in os.listdir(path) if x.startswith(prefix)]
+
+
+def _has_data(path):
+    """
+    分区目录下是否存在数据文件(或子分区)
+    """
+    if not os.path.isdir(path):
+        return False
+    return any(x.endswith('.parquet') or '=' in x for x in os.listdir(path))
@@ -1,11 +1,29 @@
 """
 基于pickle的数据检查/更新方法
+
+每张表为一个文件夹, 每次写入生成一个新的pickle分段(segment), 不改写已有的数据:
+    table_name/seg-<写入时间>-<随机串>.pic
+    table_name/_index.txt           每行记录一个分段中包含的 分段名, field, 日期
+写入/检索最大日期/列出已有日期的开销只与更新的数据量或索引大小相关, 与历史数据的大小无关
+分段过多时可通过compact将所有分段合并为一个
+分段先写入临时文件再重命名, 写入完成后才追加索引, 写入中断的分段不会被读取
+data_config中指定compression时新的分段以对应的方式压缩(如 seg-xxx.pic.gz), 读取时根据分段的扩展名解压,
+因此更改表的压缩方式后已有的分段仍可以读取
 """
 
-import os 
+import os
+import time
+import uuid
 import pickle
 
-import pandas as pd 
+import pandas as pd
+
+from . import compression
+from .filter_utils import filter_data
+
+
+INDEX_FILE = '_index.txt'
+
 
 def check_connection(conn):
     """
@@ -17,68 +35,218 @@ def check_table_exist(conn, data_config):
     """
     检查表是否存在
     """
-    path = os.path.join(conn, data_config['table_name']+".pic")
-    return os.path.exists(path)
+    path = os.path.join(conn, data_config['table_name'])
+    return os.path.exists(os.path.join(path, INDEX_FILE))
 
 
 def create_table(conn, data_config):
     """
     创建表
+    若存在旧格式的单一pickle文件(table_name.pic), 则将其转换为第一个分段
     """
-    path = os.path.join(conn, data_config['table_name']+".pic")
+    path = os.path.join(conn, data_config['table_name'])
     if not os.path.exists(path):
-        dat = pd.DataFrame(columns=data_config['data_structure'].keys())
-        with open(path, 'wb') as f:
-            pickle.dump(dat, f)
+        os.mkdir(path)
+    if not os.path.exists(os.path.join(path, INDEX_FILE)):
+        open(os.path.join(path, INDEX_FILE), 'a').close()
+
+    legacy_path = path + ".pic"
+    if os.path.exists(legacy_path):
+        with open(legacy_path, 'rb') as f:
+            content = pickle.load(f)
+        if len(content) > 0:
+            _write_segment(path, content, data_config)
+        os.remove(legacy_path)
 
 
 def max_date(conn, data_config):
     """
     找出当前已有的最大日期
     """
-    path = os.path.join(conn, data_config['table_name']+".pic")
-    
-    content = None
-    with open(path, 'rb') as f:
-        content = pickle.load(f)
-    if "field" in data_config:
-        content = content.loc[content['field'] == data_config['field']]
-    
-    if len(content) > 0:
-        return content['date'].max()
+    dt = list_date(conn, data_config)
+    if len(dt) > 0:
+        return dt[-1]
     else:
-        return None 
+        return None
 
 
 def list_date(conn, data_config):
     """
-    列出所有已有的日期
+    根据索引列出所有已有的日期
     """
-    path = os.path.join(conn, data_config['table_name']+".pic")
-    
-    content = None
-    with open(path, 'rb') as f:
-        content = pickle.load(f)
+    index = _read_index(os.path.join(conn, data_config['table_name']))
     if "field" in data_config:
-        content = content.loc[content['field'] == data_config['field']]
-    
-    dt = content['date'].unique()
+        field = str(data_config['field'])
+        dt = set(x[2] for x in index if x[1] == field)
+    else:
+        dt = set(x[2] for x in index)
     return sorted(dt)
 
 
+def list_field_date(conn, data_config):
+    """
+    根据索引一次性获取表中所有field下存在的日期
+
+    Returns
+    -------
+    dict: {field: list of date}
+    """
+    index = _read_index(os.path.join(conn, data_config['table_name']))
+    field_date = dict()
+    for _, f, d in index:
+        field_date.setdefault(f, set()).add(d)
+    return {f: sorted(field_date[f]) for f in field_date}
+
+
 def update_data(data, conn, data_config):
     """
-    更新数据，写入表中
+    更新数据，写入为一个新的分段
+    """
+    _write_segment(os.path.join(conn, data_config['table_name']), data, data_config)
+
+
+def read_data(conn, data_config, start_date=None, end_date=None, fields=None, columns=None):
+    """
+    读取数据, 根据索引只载入包含所需日期与field的分段
+
+    Parameters
+    ----------
+    start_date, end_date: str, optional
+        YYYYmmdd, 包含两端
+    fields: list of str, optional
+        需要读取的field
+    columns: list of str, optional
+        需要读取的列, 默认读取所有列
+    """
+    path = os.path.join(conn, data_config['table_name'])
+    index = pd.DataFrame(_read_index(path), columns=['segment', 'field', 'date'])
+    if len(index) > 0:
+        index = filter_data(index, start_date, end_date, fields)
+
+    data = list()
+    for x in index['segment'].unique():
+        data.append(filter_data(_load(os.path.join(path, x)), start_date, end_date, fields, columns))
+
+    if len(data) == 0:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(data, ignore_index=True)
+
+
+def compact(conn, data_config):
+    """
+    将表的所有分段合并为一个分段, 并重写索引
+    """
+    path = os.path.join(conn, data_config['table_name'])
+    segments = sorted(set(x[0] for x in _read_index(path)))
+    if len(segments) <= 1:
+        return
+
+    content = list()
+    for x in segments:
+        content.append(_load(os.path.join(path, x)))
+    content = pd.concat(content, ignore_index=True)
+
+    # 先写入合并后的分段及新的索引, 再删除旧的分段
+    comp = compression.get_compression(data_config)
+    name = _next_segment(path, comp)
+    _dump(content, os.path.join(path, name), comp)
+    index_path = os.path.join(path, INDEX_FILE)
+    with open(index_path + '.tmp', 'w') as f:
+        f.writelines(_index_lines(name, content, data_config))
+    os.replace(index_path + '.tmp', index_path)
+
+    # 同时清理写入中断后残留的、未被索引记录的分段及临时文件
+    for x in os.listdir(path):
+        if (x.startswith('seg-') and x != name) or (x.startswith('.seg-') and x.endswith('.tmp')):
+            os.remove(os.path.join(path, x))
+
+
+def _write_segment(path, data, data_config):
+    """
+    写入一个新的分段, 并在索引末尾追加该分段包含的field与日期
+    """
+    if 'field' in data_config['data_structure'] and 'field' not in data.columns:
+        data = data.assign(field=data_config['field'])
+    data = data.reindex(columns=data_config['data_structure'].keys())
+    comp = compression.get_compression(data_config)
+    name = _next_segment(path, comp)
+    _dump(data, os.path.join(path, name), comp)
+    _repair_index(path)
+    with open(os.path.join(path, INDEX_FILE), 'a') as f:
+        f.writelines(_index_lines(name, data, data_config))
+
+
+def _dump(data, file_path, comp=None):
+    """
+    先写入临时文件再重命名, 文件要么不存在要么完整
     """
-    path = os.path.join(conn, data_config['table_name']+".pic")
+    tmp_path = os.path.join(os.path.dirname(file_path), ".{}.tmp".format(os.path.basename(file_path)))
+    try:
+        with compression.open_file(tmp_path, 'wb', comp) as f:
+            pickle.dump(data, f)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-    content = None
-    with open(path, 'rb') as f:
-        content = pickle.load(f)
 
-    content = content.append(data)
-    os.remove(path)
+def _load(file_path):
+    """
+    读取一个分段, 根据扩展名解压
+    """
+    with compression.open_file(file_path, 'rb', compression.from_extension(file_path)) as f:
+        return pickle.load(f)
 
-    with open(path, 'wb') as f:
-        pickle.dump(content, f)
 
+def _repair_index(path):
+    """
+    删除索引末尾写入中断导致的不完整的行, 避免新追加的行与其连在一起
+    """
+    index_path = os.path.join(path, INDEX_FILE)
+    with open(index_path, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+        f.seek(0)
+        content = f.read()
+        f.truncate(content.rfind(b'\n') + 1)
+
+
+def _index_lines(name, data, data_config):
+    """
+    生成分段对应的索引行
+    """
+    index = pd.DataFrame({
+        'date': data['date'].astype(str),
+        'field': data['field'].astype(str) if 'field' in data.columns else str(data_config.get('field', ''))
+    }).drop_duplicates()
+    return ["{}\t{}\t{}\n".format(name, f, d) for f, d in zip(index['field'], index['date'])]
+
+
+def _read_index(path):
+    """
+    读取索引
+
+    Returns
+    -------
+    list of (分段名, field, 日期)
+    """
+    index = list()
+    with open(os.path.join(path, INDEX_FILE)) as f:
+        for line in f:
+            x = line.rstrip('\n').split('\t')
+            # 忽略写入中断导致的不完整的行
+            if len(x) == 3 and line.endswith('\n'):
+                index.append(tuple(x))
+    return index
+
+
+def _next_segment(path, comp=None):
+    """
+    生成下一个分段的文件名, 按写入时间排序
+    """
+    return "seg-{:020d}-{}.pic{}".format(time.time_ns(), uuid.uuid4().hex[:8], compression.extension(comp))
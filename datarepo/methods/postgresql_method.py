@@ -4,7 +4,7 @@
 import pandas as pd 
 import sqlalchemy as sa 
 
-from io import StringIO
+from . import sql_utils
 
 
 def check_connection(conn):
@@ -52,14 +52,9 @@ def create_table(conn, data_config):
     cur = c.cursor()
     cur.execute(sql)
     
-    # 创建index
+    # 创建index, unique为True时创建唯一索引
     if "index" in data_config:
-        sql2 = """
-            CREATE INDEX IF NOT EXISTS {} ON {} ({});
-        """.format("idx_{}_{}".format(data_config['table_name'], "_".join(data_config['index'])),
-                    data_config['table_name'], ", ".join(data_config['index'])
-        )
-        cur.execute(sql2)
+        cur.execute(sql_utils.index_sql(data_config))
 
     c.commit()
     c.close()
@@ -97,22 +92,85 @@ def list_date(conn, data_config):
     return sorted(dt)
 
 
-def update_data(data, conn, data_config):
+def list_field_date(conn, data_config):
     """
-    数据更新，写入表中, 需要对齐顺序
+    一次性获取表中所有field下存在的日期
+
+    Returns
+    -------
+    dict: {field: list of date}
     """
-    output = StringIO()
-    if "data_structure" in data_config:
-        data = data.reindex(columns=data_config['data_structure'].keys())
-    data.to_csv(output, sep='\x01', header=False, encoding='utf-8', index=False)
-    output.seek(0)
+    dt = pd.read_sql("SELECT DISTINCT field, date FROM {}".format(data_config['table_name']), conn)
+    return {k: sorted(v.tolist()) for k, v in dt.groupby('field')['date']}
+
+
+def missing_date(conn, data_config, date_list):
+    """
+    在数据库中检索date_list中表内缺失的日期
+    当data_config中存在field字段时，将只在对应的field字段下进行检索
+    """
+    return sql_utils.missing_date(conn, data_config, date_list)
 
-    c = conn.raw_connection()
-    cur = c.cursor()
-    cur.copy_from(output, data_config['table_name'], sep='\x01', null='')
-    c.commit()
-    cur.close()
-    c.close()
 
+def read_data(conn, data_config, start_date=None, end_date=None, fields=None, columns=None):
+    """
+    读取数据, 日期与field的筛选条件在WHERE中执行, 只读取所需的列
+
+    Parameters
+    ----------
+    start_date, end_date: str, optional
+        YYYYmmdd, 包含两端
+    fields: list of str, optional
+        需要读取的field
+    columns: list of str, optional
+        需要读取的列, 默认读取所有列
+    """
+    condition = list()
+    params = dict()
+    if start_date is not None:
+        condition.append("date >= :start_date")
+        params['start_date'] = start_date
+    if end_date is not None:
+        condition.append("date <= :end_date")
+        params['end_date'] = end_date
+    if fields is not None:
+        condition.append("field IN :fields")
+        params['fields'] = [str(x) for x in fields]
+
+    sql = "SELECT {} FROM {}".format(", ".join(columns) if columns is not None else "*", data_config['table_name'])
+    if len(condition) > 0:
+        sql += " WHERE " + " AND ".join(condition)
+    sql = sa.text(sql)
+    if fields is not None:
+        sql = sql.bindparams(sa.bindparam('fields', expanding=True))
+
+    with conn.connect() as c:
+        return pd.read_sql(sql, c, params=params)
+
+
+def write_batch(conn, short=False):
+    """
+    一批写入共享同一个连接与事务, 参见sql_utils.write_batch
+    """
+    return sql_utils.write_batch(conn, short)
+
+
+def in_write_batch(conn):
+    """
+    当前线程中是否处于共享事务的批量写入中
+    """
+    return sql_utils.active_connection(conn) is not None
 
 
+def update_data(data, conn, data_config):
+    """
+    数据更新，写入表中, 需要对齐顺序
+    data_config中unique为True时以index为唯一键写入, 已存在的记录将被更新
+    """
+    if "data_structure" in data_config:
+        data = data.reindex(columns=data_config['data_structure'].keys())
+    with sql_utils.transaction(conn) as c:
+        if data_config.get('unique', False) and "index" in data_config:
+            sql_utils.upsert_data(data, c, data_config['table_name'], data_config['index'])
+        else:
+            sql_utils.copy_data(data, c, data_config['table_name'])
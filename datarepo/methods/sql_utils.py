@@ -0,0 +1,254 @@
+"""
+sql类存储共用的连接/事务与批量写入方法
+
+一批写入(如一个函数的逐日更新)可以通过write_batch共享同一个连接与事务,
+批内的每次写入通过transaction在SAVEPOINT中进行, 单次写入失败只回滚该次写入
+"""
+
+import re
+import uuid
+import datetime
+import threading
+from io import StringIO
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+
+
+# 非postgresql/sqlite的数据库使用 multi-row VALUES 写入时每条INSERT的行数上限
+MULTI_CHUNKSIZE = 1000
+# multi-row VALUES 每条INSERT中绑定参数(行数 x 列数)的上限, SQL Server最多允许2100个
+MULTI_MAX_PARAMS = 2000
+# 在数据库中检索缺失日期时每条查询包含的日期数
+MISSING_CHUNKSIZE = 500
+
+_local = threading.local()
+
+
+def active_connection(conn):
+    """
+    当前线程中conn上正在进行的批量写入所使用的连接, 不存在时返回None
+    """
+    return getattr(_local, 'connections', dict()).get(id(conn))
+
+
+@contextmanager
+def write_batch(conn, short=False):
+    """
+    在同一个连接与事务中进行一批写入, 结束时统一提交
+
+    sqlite的写事务会锁住整个数据库文件, 并发写入的其他线程将因此等待超时,
+    因此sqlite下只有short为True的短事务(如一次写入的数据与目录)共享事务, 批量写入中每次写入各自提交
+    """
+    if active_connection(conn) is not None or (conn.dialect.name == 'sqlite' and not short):
+        yield
+        return
+
+    if getattr(_local, 'connections', None) is None:
+        _local.connections = dict()
+    with conn.begin() as c:
+        _local.connections[id(conn)] = c
+        try:
+            yield
+        finally:
+            _local.connections.pop(id(conn), None)
+
+
+@contextmanager
+def transaction(conn):
+    """
+    进行一次写入所使用的连接
+
+    处于write_batch中时使用批量写入的连接, 并在SAVEPOINT中进行; 否则使用独立的连接与事务
+    sqlite驱动(pysqlite)中的SAVEPOINT会在共享事务之外自行提交, 因此sqlite下直接使用共享事务的连接,
+    sqlite只有短事务共享事务, 其中任一写入失败时整个事务回滚
+    """
+    c = active_connection(conn)
+    if c is None:
+        with conn.begin() as c:
+            yield c
+    elif c.dialect.name == 'sqlite':
+        yield c
+    else:
+        with c.begin_nested():
+            yield c
+
+
+def insert_data(data, c, table_name):
+    """
+    根据数据库类型使用最快的批量写入方式
+    - postgresql: COPY
+    - sqlite: executemany
+    - 其他: multi-row VALUES
+    """
+    dialect = c.dialect.name
+    if dialect == 'postgresql':
+        copy_data(data, c, table_name)
+    elif dialect == 'sqlite':
+        executemany_data(data, c, table_name)
+    else:
+        data.to_sql(table_name, c, index=False, if_exists='append', method='multi', chunksize=multi_chunksize(data))
+
+
+def multi_chunksize(data):
+    """
+    multi-row VALUES 写入时每条INSERT的行数, 使 行数 x 列数 不超过数据库绑定参数的上限
+    """
+    return max(1, min(MULTI_CHUNKSIZE, MULTI_MAX_PARAMS // max(len(data.columns), 1)))
+
+
+def copy_data(data, c, table_name):
+    """
+    通过COPY写入数据(postgresql)
+    """
+    output = StringIO()
+    data.to_csv(output, sep='\x01', header=False, encoding='utf-8', index=False)
+    output.seek(0)
+
+    cur = c.connection.cursor()
+    cur.copy_from(output, table_name, sep='\x01', null='', columns=list(data.columns))
+    cur.close()
+
+
+def executemany_data(data, c, table_name):
+    """
+    通过executemany写入数据(sqlite)
+    """
+    sql = "INSERT INTO {} ({}) VALUES ({})".format(
+        table_name, ", ".join(data.columns), ", ".join(["?"] * len(data.columns))
+    )
+    rows = _sqlite_values(data).values.tolist()
+    c.exec_driver_sql(sql, [tuple(x) for x in rows])
+
+
+def _sqlite_values(data):
+    """
+    转换为sqlite驱动可以直接写入的值: 缺失值为None, 日期时间为与to_sql相同格式的字符串
+    """
+    # 数值列不会含有日期时间, 只检查日期时间列与object列
+    check = [x for x in data.columns if data[x].dtype.kind not in 'biufc']
+    data = data.astype(object).where(data.notnull(), None)
+    for x in check:
+        if any(isinstance(v, (datetime.datetime, datetime.date)) for v in data[x]):
+            data[x] = [_sqlite_datetime(v) for v in data[x]]
+    return data
+
+
+def _sqlite_datetime(value):
+    """
+    日期时间以 YYYY-mm-dd HH:MM:SS.ffffff 的格式写入, 与pandas的to_sql一致
+    """
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+    if isinstance(value, datetime.date):
+        return value.strftime("%Y-%m-%d")
+    return value
+
+
+def upsert_data(data, c, table_name, key):
+    """
+    以key为唯一键写入数据, 已存在的记录将被更新, 要求表在key上存在唯一约束
+
+    数据先批量写入临时表, 再由数据库完成合并:
+    - postgresql / sqlite: INSERT ... ON CONFLICT (key) DO UPDATE
+    - 其他: 删除与临时表中key相同的记录后 INSERT ... SELECT
+    """
+    # 同一批数据中key重复时只保留最后一条, 否则ON CONFLICT无法在一条语句中多次更新同一行
+    data = data.drop_duplicates(list(key), keep='last')
+    dialect = c.dialect.name
+    stage = "_stage_{}".format(uuid.uuid4().hex[:12])
+    col = ", ".join(data.columns)
+    update_col = [x for x in data.columns if x not in key]
+
+    if dialect == 'postgresql':
+        c.exec_driver_sql("CREATE TEMP TABLE {} (LIKE {})".format(stage, table_name))
+        copy_data(data, c, stage)
+    elif dialect == 'sqlite':
+        c.exec_driver_sql("CREATE TEMP TABLE {} AS SELECT * FROM {} WHERE 0".format(stage, table_name))
+        executemany_data(data, c, stage)
+    else:
+        data.to_sql(stage, c, index=False, method='multi', chunksize=multi_chunksize(data))
+
+    if dialect in ('postgresql', 'sqlite'):
+        if len(update_col) > 0:
+            action = "DO UPDATE SET {}".format(", ".join("{0} = EXCLUDED.{0}".format(x) for x in update_col))
+        else:
+            action = "DO NOTHING"
+        # sqlite中 INSERT ... SELECT 与 ON CONFLICT 同时使用时需要WHERE子句以消除歧义
+        c.exec_driver_sql("INSERT INTO {0} ({1}) SELECT {1} FROM {2} WHERE true ON CONFLICT ({3}) {4}".format(
+            table_name, col, stage, ", ".join(key), action
+        ))
+    else:
+        c.exec_driver_sql("DELETE FROM {0} WHERE EXISTS (SELECT 1 FROM {1} WHERE {2})".format(
+            table_name, stage, " AND ".join("{0}.{2} = {1}.{2}".format(stage, table_name, x) for x in key)
+        ))
+        c.exec_driver_sql("INSERT INTO {0} ({1}) SELECT {1} FROM {2}".format(table_name, col, stage))
+    c.exec_driver_sql("DROP TABLE {}".format(stage))
+
+
+def missing_date(conn, data_config, date_list):
+    """
+    在数据库中检索date_list中表内缺失的日期
+
+    日期列表以VALUES的形式传入, 与表进行anti-join, 只有缺失的日期会被传回
+    当data_config中存在field字段时，将只在对应的field字段下进行检索
+
+    只有date列为YYYYmmdd字符串时才能在数据库中直接比较, DATE类型或其他格式的字符串(如to_sql写入的
+    'YYYY-mm-dd HH:MM:SS')返回None, 由调用方列出已有日期后统一格式再比较
+
+    Returns
+    -------
+    list of YYYYmmdd, 不支持的数据库或日期格式返回None
+    """
+    if conn.dialect.name not in ('postgresql', 'sqlite'):
+        return None
+    if not _is_yyyymmdd_date(conn, data_config):
+        return None
+
+    condition = "t.date = d.dt"
+    params = dict()
+    if "field" in data_config:
+        condition += " AND t.field = :field"
+        params['field'] = str(data_config['field'])
+
+    missing = list()
+    with conn.connect() as c:
+        for i in range(0, len(date_list), MISSING_CHUNKSIZE):
+            chunk = date_list[i: i + MISSING_CHUNKSIZE]
+            chunk_params = {"d{}".format(j): x for j, x in enumerate(chunk)}
+            chunk_params.update(params)
+            sql = "WITH d(dt) AS (VALUES {}) SELECT d.dt FROM d WHERE NOT EXISTS (SELECT 1 FROM {} t WHERE {})".format(
+                ", ".join("(:d{})".format(j) for j in range(len(chunk))), data_config['table_name'], condition
+            )
+            missing.extend(x[0] for x in c.execute(sa.text(sql), chunk_params).fetchall())
+    return missing
+
+
+def _is_yyyymmdd_date(conn, data_config):
+    """
+    表的date列是否以YYYYmmdd字符串存储: data_structure中声明为字符类型, 且表中的样本为8位数字
+    """
+    declared = str(data_config.get('data_structure', {}).get('date', 'CHAR(8)')).upper()
+    if not any(x in declared for x in ('CHAR', 'TEXT')):
+        return False
+    with conn.connect() as c:
+        sample = c.execute(sa.text("SELECT date FROM {} WHERE date IS NOT NULL LIMIT 1".format(
+            data_config['table_name']))).fetchall()
+    if len(sample) == 0:
+        return True
+    return isinstance(sample[0][0], str) and re.fullmatch(r'\d{8}', sample[0][0]) is not None
+
+
+def index_sql(data_config):
+    """
+    根据data_config中的index生成创建索引的sql, unique为True时创建唯一索引
+    """
+    if data_config.get('unique', False):
+        return "CREATE UNIQUE INDEX IF NOT EXISTS {} ON {} ({});".format(
+            "uidx_{}_{}".format(data_config['table_name'], "_".join(data_config['index'])),
+            data_config['table_name'], ", ".join(data_config['index'])
+        )
+    return "CREATE INDEX IF NOT EXISTS {} ON {} ({});".format(
+        "idx_{}_{}".format(data_config['table_name'], "_".join(data_config['index'])),
+        data_config['table_name'], ", ".join(data_config['index'])
+    )
@@ -0,0 +1,188 @@
+"""
+数据更新的运行报告
+
+记录每个函数在每个日期(或时间窗口)上各个阶段的耗时:
+- plan: 检索需要更新的日期/时间范围
+- compute: 计算
+- write: 写入, 同时记录写入的记录数与数据大小
+
+    update_instance.dates_update_all(TRADE_DT)
+    update_instance.report.summary()            # 按函数汇总, 耗时最多的函数排在最前
+    update_instance.report.to_json(path)
+    update_instance.save_report()               # 写入存储中的 _datarepo_runs 表
+"""
+
+import json
+import time
+import uuid
+import datetime
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+RUNS_TABLE = '_datarepo_runs'
+
+COLUMNS = ['run_id', 'date', 'func_name', 'period', 'stage', 'start_time', 'wall', 'cpu', 'n_rows', 'n_bytes']
+
+# 写入 _datarepo_runs 时使用的data_config
+# field为run_id, 使按field分区的存储(csvfolder, parquet)中同一天的多次运行写入各自的文件, 互不覆盖
+RUNS_CONFIG = {
+    'table_name': RUNS_TABLE,
+    'update_method': 'dates',
+    'data_structure': {
+        'run_id': 'CHAR(32)',
+        'date': 'CHAR(8)',
+        'field': 'CHAR(32)',
+        'func_name': 'VARCHAR(255)',
+        'period': 'VARCHAR(64)',
+        'stage': 'VARCHAR(16)',
+        'start_time': 'VARCHAR(32)',
+        'wall': 'FLOAT',
+        'cpu': 'FLOAT',
+        'n_rows': 'BIGINT',
+        'n_bytes': 'BIGINT'
+    },
+    'index': ['run_id']
+}
+
+
+def timed_call(func, kwargs):
+    """
+    调用计算函数并记录耗时, 在线程池/进程池的worker中运行, cpu时间为worker线程的cpu时间
+
+    Returns
+    -------
+    (计算结果, 计算错误, 开始时间, wall time, cpu time)
+    """
+    start_time = datetime.datetime.now()
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        data, error = func(**kwargs), None
+    except Exception as e:
+        data, error = None, e
+    return data, error, start_time, time.perf_counter() - wall, time.thread_time() - cpu
+
+
+def period_of(kwargs):
+    """
+    根据计算函数的参数生成日期(或时间窗口)的标识
+    """
+    if 'date' in kwargs:
+        return str(kwargs['date'])
+    if 'start_date' in kwargs:
+        return "{}~{}".format(kwargs['start_date'], kwargs['end_date'])
+    if 'date_list' in kwargs and len(kwargs['date_list']) > 0:
+        return "{}~{}({})".format(kwargs['date_list'][0], kwargs['date_list'][-1], len(kwargs['date_list']))
+    return ''
+
+
+def data_bytes(data):
+    """
+    数据占用的内存
+    """
+    try:
+        return int(data.memory_usage(deep=True).sum())
+    except Exception:
+        return None
+
+
+class RunReport:
+    """
+    数据更新的运行报告, 可以在多个线程中同时记录
+    """
+    def __init__(self):
+        self.records = list()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        清空记录, 并开始新的run_id
+        """
+        with self._lock:
+            self.run_id = uuid.uuid4().hex
+            self.records = list()
+
+    def add(self, func_name, period, stage, start_time, wall, cpu, n_rows=None, n_bytes=None):
+        """
+        添加一条记录
+
+        Parameters
+        ----------
+        func_name: str
+            函数标识, 同日志中的标识(field@table_name)
+        period: str
+            日期或时间窗口
+        stage: str
+            plan / compute / write
+        wall, cpu: float
+            耗时(秒)
+        n_rows, n_bytes: int, optional
+            写入的记录数与数据大小
+        """
+        with self._lock:
+            self.records.append({
+                'run_id': self.run_id,
+                'date': start_time.strftime("%Y%m%d"),
+                'func_name': func_name,
+                'period': period,
+                'stage': stage,
+                'start_time': start_time.isoformat(),
+                'wall': wall,
+                'cpu': cpu,
+                'n_rows': n_rows,
+                'n_bytes': n_bytes
+            })
+
+    @contextmanager
+    def timer(self, func_name, period, stage):
+        """
+        记录with代码块的耗时, cpu时间为当前线程的cpu时间
+        yield的dict中可以填入n_rows与n_bytes
+        """
+        size = dict()
+        start_time = datetime.datetime.now()
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield size
+        finally:
+            self.add(func_name, period, stage, start_time, time.perf_counter() - wall, time.thread_time() - cpu,
+                     size.get('n_rows'), size.get('n_bytes'))
+
+    def to_frame(self):
+        """
+        以DataFrame的形式返回所有记录
+        """
+        with self._lock:
+            return pd.DataFrame(list(self.records), columns=COLUMNS)
+
+    def to_json(self, path=None):
+        """
+        以JSON的形式返回所有记录, 提供path时同时写入文件
+        """
+        with self._lock:
+            content = json.dumps(self.records, ensure_ascii=False)
+        if path is not None:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(content)
+        return content
+
+    def summary(self):
+        """
+        按函数汇总耗时, 写入的记录数与数据大小, 按总耗时从大到小排列
+
+        Returns
+        -------
+        pd.DataFrame, index为函数
+            plan, compute, write: 各阶段的wall time
+            wall, cpu: 所有阶段合计的耗时
+            n_rows, n_bytes: 写入的记录数与数据大小
+        """
+        report = self.to_frame()
+        result = report.pivot_table(index='func_name', columns='stage', values='wall', aggfunc='sum')
+        result = result.reindex(columns=['plan', 'compute', 'write']).fillna(0)
+        result = result.join(report.groupby('func_name')[['wall', 'cpu']].sum())
+        result = result.join(report.loc[report['stage'] == 'write'].groupby('func_name')[['n_rows', 'n_bytes']].sum())
+        return result.sort_values('wall', ascending=False)
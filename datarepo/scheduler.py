@@ -0,0 +1,171 @@
+"""
+数据更新函数之间的依赖调度
+
+data_config中可以通过depends_on=[table_name, ...]声明计算时需要读取的上游表,
+调度时将按照依赖关系进行拓扑排序, 互不依赖的分支可以并发进行
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+module_logger = logging.getLogger(__name__)
+
+# 表示一个函数的全部日期均更新失败(如出现了预期外的错误)
+ALL_DATES = 'ALL_DATES'
+
+
+class CyclicDependencyError(Exception):
+    """
+    数据更新函数之间存在循环依赖
+    """
+    pass
+
+
+def build_dag(func_dict):
+    """
+    根据data_config中的depends_on构建函数之间的依赖关系
+
+    depends_on中声明的是表名, 同一张表可能对应多个函数(如indicator_from_func生成的field函数),
+    此时下游函数依赖于该表对应的所有函数. 不在func_dict中的表视为已经就绪
+
+    Parameters
+    ----------
+    func_dict: dict of function
+        使用data_config作为decorator的数据计算方法
+
+    Returns
+    -------
+    dict: {函数名: list of 上游函数名}
+    """
+    tables = dict()
+    for x in func_dict:
+        tables.setdefault(func_dict[x].data_config['table_name'], []).append(x)
+
+    dag = dict()
+    for x in func_dict:
+        upstream = []
+        for t in func_dict[x].data_config.get('depends_on', []):
+            if t not in tables:
+                module_logger.debug("{} 依赖的表{}不在本次更新中, 视为已就绪".format(x, t))
+            upstream.extend(y for y in tables.get(t, []) if y != x and y not in upstream)
+        dag[x] = upstream
+    return dag
+
+
+def topological_order(dag):
+    """
+    对依赖关系进行拓扑排序, 没有依赖关系的函数之间保持原有的顺序
+
+    Returns
+    -------
+    list of 函数名
+    """
+    remaining = {x: set(dag[x]) for x in dag}
+    order = list()
+    while remaining:
+        ready = [x for x in remaining if len(remaining[x]) == 0]
+        if len(ready) == 0:
+            raise CyclicDependencyError("存在循环依赖: {}".format(", ".join(remaining)))
+        for x in ready:
+            order.append(x)
+            remaining.pop(x)
+        for x in remaining:
+            remaining[x].difference_update(ready)
+    return order
+
+
+def merge_failed(failed_list):
+    """
+    合并多个上游函数的失败日期
+
+    Returns
+    -------
+    set of str / ALL_DATES
+    """
+    merged = set()
+    for x in failed_list:
+        if x == ALL_DATES:
+            return ALL_DATES
+        merged.update(x)
+    return merged
+
+
+def run_dag(dag, run, workers=1):
+    """
+    按依赖顺序运行数据更新
+
+    Parameters
+    ----------
+    dag: dict
+        build_dag的结果
+    run: callable
+        run(函数名, 上游失败日期) -> 该函数更新失败的日期(set of str / ALL_DATES)
+    workers: int
+        可以同时运行的分支数, 为1时按照拓扑顺序串行运行
+
+    Returns
+    -------
+    dict: {函数名: 更新失败的日期}
+    """
+    order = topological_order(dag)
+    failed = dict()
+
+    def _run(x):
+        try:
+            return run(x, merge_failed(failed[y] for y in dag[x]))
+        except Exception as e:
+            module_logger.error("{} 更新错误: {}".format(x, e), exc_info=True)
+            return ALL_DATES
+
+    if workers <= 1:
+        for x in order:
+            failed[x] = _run(x)
+        return failed
+
+    pending = list(order)
+    running = dict()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            # 所有上游均已完成的函数可以开始运行
+            ready = [x for x in pending if all(y in failed for y in dag[x])]
+            for x in ready:
+                pending.remove(x)
+                running[pool.submit(_run, x)] = x
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                failed[running.pop(future)] = future.result()
+    return failed
+
+
+async def arun_dag(dag, run):
+    """
+    run_dag的asyncio版本, 所有上游均已完成的函数作为独立的task并发运行
+
+    Parameters
+    ----------
+    dag: dict
+        build_dag的结果
+    run: coroutine function
+        await run(函数名, 上游失败日期) -> 该函数更新失败的日期(set of str / ALL_DATES)
+
+    Returns
+    -------
+    dict: {函数名: 更新失败的日期}
+    """
+    order = topological_order(dag)
+    tasks = dict()
+
+    async def _run(x):
+        # 拓扑顺序保证上游的task已经创建
+        skip_dates = merge_failed([await tasks[y] for y in dag[x]])
+        try:
+            return await run(x, skip_dates)
+        except Exception as e:
+            module_logger.error("{} 更新错误: {}".format(x, e), exc_info=True)
+            return ALL_DATES
+
+    for x in order:
+        tasks[x] = asyncio.ensure_future(_run(x))
+    return {x: await tasks[x] for x in order}
@@ -0,0 +1,164 @@
+"""
+进程池计算时大参数的共享
+
+indicator_from_func(..., **kwargs)中的参数(如全市场的收益率矩阵)在executor='process'时
+需要随每个任务pickle至worker进程. SharedStore在一次运行中将较大的numpy/pandas参数只写入一次
+.npy文件(有/dev/shm时位于内存中), 任务中只传递文件的路径(SharedArray);
+worker进程以mmap的方式只读打开, 同一进程内同一参数只打开一次, 不复制数据
+
+只共享元素类型单一的数值型数据(bool/int/uint/float/complex), 其余参数仍按原方式pickle
+worker中得到的数据为只读, 计算函数不应原地修改参数
+运行结束时(或SharedStore被回收时)删除所有文件
+"""
+
+import os
+import uuid
+import pickle
+import shutil
+import logging
+import tempfile
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+
+module_logger = logging.getLogger(__name__)
+
+# 默认只共享不小于1MB的参数
+SHARE_BYTES = 1024 ** 2
+
+# worker进程中已经打开的共享数据: {路径: 数据}
+_LOADED = dict()
+
+
+class SharedArray:
+    """
+    共享数据的句柄, pickle时只包含文件路径
+    """
+    __slots__ = ('path',)
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """
+        以mmap的方式只读打开共享数据, 同一进程内只打开一次
+        """
+        if self.path not in _LOADED:
+            with open(self.path + '.meta', 'rb') as f:
+                kind, meta = pickle.load(f)
+            values = np.load(self.path, mmap_mode='r')
+            if kind == 'frame':
+                value = pd.DataFrame(values, index=meta['index'], columns=meta['columns'], copy=False)
+            elif kind == 'series':
+                value = pd.Series(values, index=meta['index'], name=meta['name'], copy=False)
+            else:
+                value = values
+            _LOADED[self.path] = value
+        return _LOADED[self.path]
+
+    def __repr__(self):
+        return "<SharedArray {}>".format(self.path)
+
+
+def resolve(value):
+    """
+    将共享数据的句柄还原为数据, 其余参数原样返回
+    """
+    return value.load() if isinstance(value, SharedArray) else value
+
+
+class SharedStore:
+    """
+    一次运行中共享的参数, 同一对象只写入一次
+    """
+    def __init__(self, share_bytes=SHARE_BYTES):
+        self.share_bytes = share_bytes
+        self.path = None
+        self._shared = dict()
+        self._derived = dict()
+        self._lock = threading.RLock()
+        self._finalizer = None
+
+    def share(self, value):
+        """
+        较大的数值型numpy/pandas数据写入共享文件并返回句柄, 其余参数原样返回
+
+        同一对象只检查一次(拆分数组时可能复制整个DataFrame), 之后直接返回上次的结果
+        """
+        with self._lock:
+            # 同时记录对象本身, 避免运行期间对象被回收后id被其他对象复用
+            if id(value) not in self._shared:
+                values, kind, meta = _split(value)
+                if values is None or values.nbytes < self.share_bytes:
+                    self._shared[id(value)] = (value, value)
+                else:
+                    self._shared[id(value)] = (value, self._dump(values, kind, meta))
+            return self._shared[id(value)][1]
+
+    def share_kwargs(self, kwargs):
+        """
+        共享参数dict中较大的参数
+        """
+        return {k: self.share(v) for k, v in kwargs.items()}
+
+    def derive(self, obj, build):
+        """
+        由obj生成的共享版本(如参数共享后的Prototype), 同一对象只调用一次build(), 运行结束(close)时清除
+        """
+        with self._lock:
+            if id(obj) not in self._derived:
+                self._derived[id(obj)] = (obj, build())
+            return self._derived[id(obj)][1]
+
+    def close(self):
+        """
+        删除所有共享文件
+        """
+        with self._lock:
+            if self._finalizer is not None:
+                self._finalizer()
+                self._finalizer = None
+            self.path = None
+            self._shared = dict()
+            self._derived = dict()
+
+    def _dump(self, values, kind, meta):
+        """
+        写入.npy文件及其元数据(index, columns等)
+        """
+        if self.path is None:
+            self.path = tempfile.mkdtemp(prefix='datarepo_shared_',
+                                         dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+            self._finalizer = weakref.finalize(self, shutil.rmtree, self.path, True)
+        path = os.path.join(self.path, "{}.npy".format(uuid.uuid4().hex))
+        np.save(path, np.ascontiguousarray(values))
+        with open(path + '.meta', 'wb') as f:
+            pickle.dump((kind, meta), f)
+        module_logger.debug("共享参数{} ({} bytes)".format(path, values.nbytes))
+        return SharedArray(path)
+
+
+def _split(value):
+    """
+    拆分为数值型的numpy数组与还原所需的信息, 无法共享时数组为None
+
+    Returns
+    -------
+    (values, kind, meta)
+    """
+    if isinstance(value, pd.DataFrame):
+        if value.shape[1] == 0 or len(set(value.dtypes)) != 1:
+            return None, None, None
+        values, kind, meta = value.to_numpy(), 'frame', {'index': value.index, 'columns': value.columns}
+    elif isinstance(value, pd.Series):
+        values, kind, meta = value.to_numpy(), 'series', {'index': value.index, 'name': value.name}
+    elif isinstance(value, np.ndarray):
+        values, kind, meta = value, 'array', None
+    else:
+        return None, None, None
+    if not isinstance(values, np.ndarray) or values.dtype.kind not in 'biufc':
+        return None, None, None
+    return values, kind, meta
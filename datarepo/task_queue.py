@@ -0,0 +1,373 @@
+"""
+数据更新的任务队列
+
+将检索与计算分离: DataUpdate.enqueue检索需要更新的日期, 并将 (函数, 日期/批次/时间范围) 作为任务放入队列,
+任意数量的worker(可以位于不同的进程或机器上, 见 datarepo worker)从队列中领取任务, 计算并写入
+
+- 领取的任务带有租约(lease), worker在计算期间定期续约, 租约过期的任务可以被其他worker重新领取
+- 失败的任务将重新放回队列, 超过max_attempts次后记为失败
+- 按照depends_on的依赖关系分层, 同一次运行中上一层的任务全部结束后才会领取下一层的任务,
+  上游失败的日期下游将跳过
+
+TaskQueue定义了队列的接口, SQLiteQueue为基于sqlite文件的实现, 可供共享同一文件系统的多个进程使用
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+from .scheduler import ALL_DATES
+
+
+module_logger = logging.getLogger(__name__)
+
+TASK_TABLE = '_datarepo_tasks'
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class TaskQueue(ABC):
+    """
+    任务队列的接口
+
+    任务为dict:
+        run_id: 运行标识
+        func_name: 函数名
+        kwargs: 传入DataUpdate.update的参数(date_list / end_date)
+        dates: 任务包含的日期, range任务为空
+        upstream: 上游函数名
+        level: 依赖关系中的层级
+    """
+    @abstractmethod
+    def put(self, run_id, tasks):
+        """
+        放入一次运行的所有任务
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def claim(self, worker, lease):
+        """
+        领取一个任务, 没有可以领取的任务时返回None
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def extend(self, task_id, worker, lease):
+        """
+        续约, 任务已不属于该worker时返回False
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def complete(self, task_id, worker):
+        """
+        任务完成
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def fail(self, task_id, worker, error):
+        """
+        任务失败, 未超过重试次数时重新放回队列
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def skip(self, task_id, worker, reason):
+        """
+        因上游失败而跳过任务
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def failed_dates(self, run_id, func_list):
+        """
+        func_list中的函数在本次运行中失败或跳过的日期
+
+        Returns
+        -------
+        set of str / scheduler.ALL_DATES
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def unfinished(self, run_id=None):
+        """
+        尚未结束(等待中或运行中)的任务数量
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def stats(self, run_id=None):
+        """
+        各状态的任务数量
+
+        Returns
+        -------
+        dict: {状态: 数量}
+        """
+        raise NotImplementedError
+
+
+class SQLiteQueue(TaskQueue):
+    """
+    基于sqlite文件的任务队列
+    """
+    def __init__(self, path, max_attempts=3, timeout=60):
+        """
+        Parameters
+        ----------
+        path: str
+            队列所在的sqlite文件
+        max_attempts: int
+            每个任务最多尝试的次数
+        timeout: float
+            等待其他进程释放数据库锁的时间(秒)
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        with self._connect() as c:
+            c.execute("""
+                CREATE TABLE IF NOT EXISTS {} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    run_id TEXT, func_name TEXT, kwargs TEXT, dates TEXT, upstream TEXT, level INTEGER,
+                    status TEXT, attempts INTEGER DEFAULT 0, worker TEXT, lease_until REAL, error TEXT, updated REAL
+                )
+            """.format(TASK_TABLE))
+            c.execute("CREATE INDEX IF NOT EXISTS idx_{0}_status ON {0} (status, run_id, level)".format(TASK_TABLE))
+
+    def _connect(self):
+        """
+        打开数据库连接, 写操作通过 BEGIN IMMEDIATE 在进程之间互斥
+        """
+        c = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        c.row_factory = sqlite3.Row
+        return _Transaction(c)
+
+    def put(self, run_id, tasks):
+        now = time.time()
+        rows = [(run_id, x['func_name'], json.dumps(x['kwargs']), json.dumps(x['dates']), json.dumps(x['upstream']),
+                 x['level'], PENDING, now) for x in tasks]
+        with self._connect() as c:
+            c.executemany(
+                "INSERT INTO {} (run_id, func_name, kwargs, dates, upstream, level, status, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)".format(TASK_TABLE), rows
+            )
+
+    def claim(self, worker, lease):
+        now = time.time()
+        with self._connect() as c:
+            # 租约过期的任务重新放回队列, 超过重试次数的记为失败
+            c.execute("UPDATE {} SET status=?, error=?, updated=? WHERE status=? AND lease_until<? AND attempts>=?"
+                      .format(TASK_TABLE), (FAILED, "租约过期", now, RUNNING, now, self.max_attempts))
+            c.execute("UPDATE {} SET status=?, worker=NULL, updated=? WHERE status=? AND lease_until<?"
+                      .format(TASK_TABLE), (PENDING, now, RUNNING, now))
+            # 每次运行只领取尚未结束的最低层级的任务
+            row = c.execute("""
+                SELECT t.* FROM {0} t JOIN (
+                    SELECT run_id, MIN(level) AS level FROM {0} WHERE status IN (?, ?) GROUP BY run_id
+                ) r ON t.run_id = r.run_id AND t.level = r.level
+                WHERE t.status = ? ORDER BY t.id LIMIT 1
+            """.format(TASK_TABLE), (PENDING, RUNNING, PENDING)).fetchone()
+            if row is None:
+                return None
+            c.execute("UPDATE {} SET status=?, worker=?, attempts=attempts+1, lease_until=?, updated=? WHERE id=?"
+                      .format(TASK_TABLE), (RUNNING, worker, now + lease, now, row['id']))
+        return _task(row)
+
+    def extend(self, task_id, worker, lease):
+        with self._connect() as c:
+            cur = c.execute("UPDATE {} SET lease_until=? WHERE id=? AND worker=? AND status=?".format(TASK_TABLE),
+                            (time.time() + lease, task_id, worker, RUNNING))
+            return cur.rowcount > 0
+
+    def complete(self, task_id, worker):
+        self._finish(task_id, worker, DONE, None)
+
+    def fail(self, task_id, worker, error):
+        with self._connect() as c:
+            c.execute("UPDATE {} SET status=CASE WHEN attempts>=? THEN ? ELSE ? END, worker=NULL, error=?, updated=? "
+                      "WHERE id=? AND worker=? AND status=?".format(TASK_TABLE),
+                      (self.max_attempts, FAILED, PENDING, str(error), time.time(), task_id, worker, RUNNING))
+
+    def skip(self, task_id, worker, reason):
+        self._finish(task_id, worker, SKIPPED, reason)
+
+    def _finish(self, task_id, worker, status, error):
+        """
+        结束任务, 任务已被其他worker领取时不做处理
+        """
+        with self._connect() as c:
+            c.execute("UPDATE {} SET status=?, error=?, updated=? WHERE id=? AND worker=? AND status=?"
+                      .format(TASK_TABLE), (status, error, time.time(), task_id, worker, RUNNING))
+
+    def failed_dates(self, run_id, func_list):
+        if len(func_list) == 0:
+            return set()
+        with self._connect() as c:
+            rows = c.execute("SELECT dates FROM {} WHERE run_id=? AND status IN (?, ?) AND func_name IN ({})".format(
+                TASK_TABLE, ", ".join(["?"] * len(func_list))
+            ), [run_id, FAILED, SKIPPED] + list(func_list)).fetchall()
+        dates = set()
+        for x in rows:
+            x = json.loads(x['dates'])
+            # range任务没有具体的日期, 失败时视为所有日期均失败
+            if len(x) == 0:
+                return ALL_DATES
+            dates.update(x)
+        return dates
+
+    def unfinished(self, run_id=None):
+        return sum(v for k, v in self.stats(run_id).items() if k in (PENDING, RUNNING))
+
+    def stats(self, run_id=None):
+        sql = "SELECT status, COUNT(*) AS n FROM {}".format(TASK_TABLE)
+        params = []
+        if run_id is not None:
+            sql += " WHERE run_id=?"
+            params.append(run_id)
+        with self._connect() as c:
+            rows = c.execute(sql + " GROUP BY status", params).fetchall()
+        return {x['status']: x['n'] for x in rows}
+
+
+class _Transaction:
+    """
+    在 BEGIN IMMEDIATE 事务中使用sqlite连接, 结束时提交(出错时回滚)并关闭连接
+    """
+    def __init__(self, c):
+        self.c = c
+
+    def __enter__(self):
+        self.c.execute("BEGIN IMMEDIATE")
+        return self.c
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.c.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+        finally:
+            self.c.close()
+
+
+def _task(row):
+    """
+    将数据库中的记录转换为任务
+    """
+    return {
+        'id': row['id'],
+        'run_id': row['run_id'],
+        'func_name': row['func_name'],
+        'kwargs': json.loads(row['kwargs']),
+        'dates': json.loads(row['dates']),
+        'upstream': json.loads(row['upstream']),
+        'level': row['level'],
+        'attempts': row['attempts'] + 1
+    }
+
+
+def worker_name():
+    """
+    worker的默认名称: 主机名:进程号
+    """
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def run_task(update_instance, queue, task, worker, lease):
+    """
+    计算并写入一个任务, 计算期间在后台定期续约
+    """
+    label = "{}[{}]".format(task['func_name'], ", ".join(task['dates'][:1] + (['...'] if len(task['dates']) > 1 else [])))
+    if task['func_name'] not in update_instance.func_dict:
+        queue.fail(task['id'], worker, "worker中不存在函数{}".format(task['func_name']))
+        module_logger.error("{} worker中不存在该函数".format(label))
+        return
+
+    skip_dates = queue.failed_dates(task['run_id'], task['upstream'])
+    if skip_dates == ALL_DATES or (len(task['dates']) > 0 and set(task['dates']) <= skip_dates):
+        queue.skip(task['id'], worker, "上游数据更新失败")
+        module_logger.warning("{} 上游数据更新失败, 跳过".format(label))
+        return
+
+    stop = threading.Event()
+
+    def _heartbeat():
+        while not stop.wait(lease / 3):
+            if not queue.extend(task['id'], worker, lease):
+                module_logger.warning("{} 租约已失效".format(label))
+                return
+
+    heartbeat = threading.Thread(target=_heartbeat, daemon=True)
+    heartbeat.start()
+    try:
+        func = update_instance.func_dict[task['func_name']]
+        failed = update_instance.update(func, skip_dates=skip_dates, **task['kwargs'])
+    except Exception as e:
+        failed = ALL_DATES
+        module_logger.error("{} 更新错误: {}".format(label, e), exc_info=True)
+    finally:
+        stop.set()
+        heartbeat.join()
+
+    if failed != ALL_DATES:
+        failed = set(failed) - skip_dates
+    if failed == ALL_DATES or len(failed) > 0:
+        queue.fail(task['id'], worker, "更新失败的日期: {}".format(
+            failed if failed == ALL_DATES else ", ".join(sorted(failed))
+        ))
+        module_logger.error("{} 第{}次尝试失败".format(label, task['attempts']))
+    else:
+        queue.complete(task['id'], worker)
+        module_logger.info("{} 任务完成".format(label))
+
+
+def run_worker(update_instance, queue, worker=None, lease=600, poll=5, forever=False, max_tasks=None):
+    """
+    不断从队列中领取任务, 计算并写入
+
+    Parameters
+    ----------
+    update_instance: DataUpdate
+        包含任务中的函数的DataUpdate实例
+    queue: TaskQueue
+    worker: str, optional
+        worker名称, 默认为 主机名:进程号
+    lease: float
+        任务租约的时长(秒), 计算期间每 lease/3 秒续约一次
+    poll: float
+        没有可领取的任务时等待的时间(秒)
+    forever: bool
+        为False时, 队列中所有任务均结束后退出
+    max_tasks: int, optional
+        最多执行的任务数
+
+    Returns
+    -------
+    int: 执行的任务数
+    """
+    worker = worker or worker_name()
+    n = 0
+    module_logger.info("worker {} 开始运行".format(worker))
+    # 同一worker的各任务共享同一个线程池/进程池及进程池的大参数, 退出时清理
+    with update_instance._run_pool():
+        while max_tasks is None or n < max_tasks:
+            task = queue.claim(worker, lease)
+            if task is None:
+                if not forever and queue.unfinished() == 0:
+                    break
+                time.sleep(poll)
+                continue
+            run_task(update_instance, queue, task, worker, lease)
+            n += 1
+    module_logger.info("worker {} 结束运行, 共执行{}个任务".format(worker, n))
+    return n
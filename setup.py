@@ -20,5 +20,11 @@ setuptools.setup(
          "numpy",
          "pandas",
          "sqlalchemy"
-     ]
+     ],
+    extras_require={
+        "parquet": ["pyarrow"]
+    },
+    entry_points={
+        "console_scripts": ["datarepo=datarepo.cli:main"]
+    }
 )
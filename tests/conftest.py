@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """
+    临时的sqlite数据库
+    """
+    engine = sa.create_engine("sqlite:///{}".format(tmp_path / 'test.db'))
+    yield engine
+    engine.dispose()
+
+
+def count(engine, table_name):
+    """
+    表中的记录数
+    """
+    with engine.connect() as c:
+        return c.exec_driver_sql("SELECT COUNT(*) FROM {}".format(table_name)).scalar()
@@ -0,0 +1,57 @@
+"""
+batch更新: 缺失的日期按batch_size分批交给函数计算, 每一批的结果只写入一次
+"""
+
+import pandas as pd
+import pytest
+
+from datarepo import DataUpdate, data_config
+from datarepo.methods import methods
+
+
+DATES = ['20110103', '20110104', '20110105', '20110106', '20110107']
+BATCHES = list()
+FAIL = set()
+
+
+@data_config(status='update', table_name='batched', data_structure={'date': 'CHAR(8)', 'v': 'FLOAT'},
+             update_method='batch', batch_size=2)
+def batched(date_list):
+    BATCHES.append(list(date_list))
+    if FAIL.intersection(date_list):
+        raise ValueError("calculation error")
+    # 结果中不在本批次内的日期将被忽略
+    return pd.DataFrame({'date': list(date_list) + ['20100101'], 'v': [1.0] * (len(date_list) + 1)})
+
+
+@pytest.mark.parametrize('storage_type', ['csv', 'sql'])
+def test_missing_dates_are_split_into_batches(tmp_path, engine, monkeypatch, storage_type):
+    conn = engine if storage_type == 'sql' else str(tmp_path)
+    BATCHES.clear()
+    FAIL.clear()
+    writes = list()
+    update_data = methods.update_data
+    monkeypatch.setattr(methods, 'update_data', lambda data, *args, **kwargs: writes.append(data) or
+                        update_data(data, *args, **kwargs))
+
+    update_instance = DataUpdate({'batched': batched}, storage_type, conn)
+    assert update_instance.dates_update_all(DATES[:1]) == {'batched': set()}
+    assert update_instance.dates_update_all(DATES) == {'batched': set()}
+    assert BATCHES == [DATES[:1], DATES[1:3], DATES[3:5]]
+    assert [sorted(x['date']) for x in writes] == BATCHES
+    assert sorted(update_instance.read('batched', cache=False)['date']) == DATES
+
+
+def test_failed_batch_is_retried_alone(tmp_path):
+    BATCHES.clear()
+    FAIL.clear()
+    FAIL.add('20110105')
+    update_instance = DataUpdate({'batched': batched}, 'csvfolder', str(tmp_path))
+    assert update_instance.dates_update_all(DATES) == {'batched': {'20110105', '20110106'}}
+    assert sorted(update_instance.read('batched', cache=False)['date']) == ['20110103', '20110104', '20110107']
+
+    BATCHES.clear()
+    FAIL.clear()
+    assert update_instance.dates_update_all(DATES) == {'batched': set()}
+    assert BATCHES == [['20110105', '20110106']]
+    assert sorted(update_instance.read('batched', cache=False)['date']) == DATES
@@ -0,0 +1,75 @@
+"""
+表状态目录: 写入时的记录, 由目录检索缺失日期, 目录与数据不一致时的重建
+"""
+
+import pandas as pd
+import pytest
+
+from datarepo import DataUpdate, data_config
+from datarepo.methods import methods, catalog
+
+from conftest import count
+
+
+DATES = ['20110103', '20110104', '20110105']
+CALLS = list()
+
+
+@data_config(status='update', table_name='cataloged', data_structure={'date': 'CHAR(8)', 'v': 'FLOAT'},
+             update_method='dates')
+def cataloged(date):
+    CALLS.append(date)
+    return pd.DataFrame({'date': [date], 'v': [1.0]})
+
+
+def test_sqlite_catalog_error_rolls_back_data(engine, monkeypatch):
+    record = catalog.record
+
+    def _record(engine, data_config, data):
+        if '20110104' in set(data['date']):
+            raise RuntimeError("catalog error")
+        return record(engine, data_config, data)
+
+    monkeypatch.setattr(catalog, 'record', _record)
+    update_instance = DataUpdate({'cataloged': cataloged}, 'sql', engine, catalog=True)
+    assert update_instance.dates_update_all(DATES) == {'cataloged': {'20110104'}}
+    assert count(engine, 'cataloged') == 2
+
+    # 再次运行只写入失败的日期, 不产生重复的记录
+    monkeypatch.setattr(catalog, 'record', record)
+    assert update_instance.dates_update_all(DATES) == {'cataloged': set()}
+    data = update_instance.read('cataloged', cache=False)
+    assert sorted(data['date']) == DATES
+
+
+@pytest.mark.parametrize('storage_type', ['csvfolder', 'sql'])
+def test_catalog_plans_without_scanning_tables(tmp_path, engine, monkeypatch, storage_type):
+    conn = engine if storage_type == 'sql' else str(tmp_path)
+    CALLS.clear()
+    update_instance = DataUpdate({'cataloged': cataloged}, storage_type, conn, catalog=True)
+    update_instance.dates_update_all(DATES[:2])
+
+    # 目录已记录的表不再扫描
+    for x in ('list_date', 'list_field_date', 'max_date', 'missing_date_list'):
+        if hasattr(methods.DICT[storage_type], x):
+            monkeypatch.setattr(methods.DICT[storage_type], x, None)
+    config = cataloged.data_config
+    assert methods.missing_date_list(conn, config, storage_type, DATES, catalog=True) == ['20110105']
+    assert methods.range_start_date(conn, config, storage_type, catalog=True) == '20110105'
+    update_instance.dates_update_all(DATES)
+    assert CALLS == DATES
+
+
+def test_rebuild_catalog(tmp_path):
+    conn = str(tmp_path)
+    CALLS.clear()
+    update_instance = DataUpdate({'cataloged': cataloged}, 'csvfolder', conn, catalog=True)
+    update_instance.dates_update_all(DATES[:1])
+
+    # 绕过目录写入的数据在重建后才会被目录记录
+    methods.update_data(pd.DataFrame({'date': ['20110104'], 'v': [1.0]}), conn, cataloged.data_config, 'csvfolder')
+    assert methods.existing_date_list(conn, cataloged.data_config, 'csvfolder', catalog=True) == ['20110103']
+    update_instance.rebuild_catalog()
+    assert methods.existing_date_list(conn, cataloged.data_config, 'csvfolder', catalog=True) == DATES[:2]
+    update_instance.dates_update_all(DATES)
+    assert CALLS == ['20110103', '20110105']
@@ -0,0 +1,88 @@
+"""
+文件类存储: 按field/列读取, 格式一致的读取结果, 压缩, 运行报告
+"""
+
+import pandas as pd
+import pytest
+
+from datarepo import DataUpdate, data_config
+from datarepo.methods import methods
+
+
+STRUCTURE = {'date': 'CHAR(8)', 'field': 'VARCHAR(8)', 'sid': 'CHAR(6)', 'v': 'FLOAT'}
+DATES = ['20110103', '20110104']
+STORAGE = ['csvfolder', 'pickle', 'parquet', 'csv']
+
+
+@data_config(status='update', table_name='proto', data_structure=STRUCTURE, update_method='dates')
+def proto(date, field):
+    # 计算结果中没有field列, 由data_config中的field填充
+    return pd.DataFrame({'date': [date] * 2, 'sid': ['000001', '000002'], 'v': [1.0, 2.0]})
+
+
+def _update(storage_type, conn, **kwargs):
+    update_instance = DataUpdate.indicator_from_func(proto, storage_type, conn, ['a', 'b'], 'proto', **kwargs)
+    update_instance.dates_update_all(DATES)
+    return update_instance
+
+
+@pytest.mark.parametrize('storage_type', STORAGE)
+def test_read_fields_and_columns(tmp_path, storage_type):
+    update_instance = _update(storage_type, str(tmp_path))
+    data = update_instance.read('proto', fields=['a'], columns=['sid', 'date'], cache=False)
+    assert list(data.columns) == ['sid', 'date']
+    assert len(data) == 4
+    assert sorted(set(data['sid'])) == ['000001', '000002']
+
+
+@pytest.mark.parametrize('storage_type', STORAGE)
+def test_read_types_and_column_order(tmp_path, storage_type):
+    update_instance = _update(storage_type, str(tmp_path))
+    data = update_instance.read('proto', cache=False).sort_values(['date', 'field', 'sid'])
+    assert list(data.columns) == list(STRUCTURE)
+    assert data.iloc[0][['date', 'field', 'sid']].tolist() == ['20110103', 'a', '000001']
+    assert len(data) == 8
+    # 已写入的日期不再计算
+    assert methods.missing_date_list(str(tmp_path), update_instance.func_dict['a'].data_config,
+                                     storage_type, DATES) == []
+
+
+def test_csvfolder_reads_legacy_date_files(tmp_path):
+    conn = str(tmp_path)
+    config = dict(proto.data_config, table_name='proto')
+    methods.create_table(conn, config, 'csvfolder')
+    pd.DataFrame({'field': ['a', 'b'], 'sid': ['000003', '000003'], 'v': [3.0, 4.0]}).to_csv(
+        tmp_path / 'proto' / '20110105.csv', index=False)
+    _update('csvfolder', conn)
+    data = methods.read_data(conn, 'proto', 'csvfolder', fields=['b'], columns=['date', 'field', 'sid'],
+                             data_config=config)
+    assert sorted(data['date']) == ['20110103', '20110103', '20110104', '20110104', '20110105']
+    assert set(data['field']) == {'b'}
+    assert '000003' in set(data['sid'])
+
+
+@pytest.mark.parametrize('storage_type,codec', [
+    ('csv', 'gzip'), ('csv', 'xz'), ('csvfolder', 'gzip'), ('pickle', 'bz2'), ('parquet', 'gzip')
+])
+def test_compressed_tables(tmp_path, storage_type, codec):
+    update_instance = DataUpdate.indicator_from_func(
+        data_config(**dict(proto.data_config, compression=codec))(lambda date, field: proto(date, field)),
+        storage_type, str(tmp_path), ['a', 'b'], 'proto'
+    )
+    update_instance.dates_update_all(DATES[:1])
+    update_instance.dates_update_all(DATES)
+    data = update_instance.read('proto', cache=False)
+    assert len(data) == 8
+    assert sorted(set(data['date'])) == DATES
+
+
+@pytest.mark.parametrize('storage_type', STORAGE)
+def test_save_report_keeps_every_run(tmp_path, storage_type):
+    update_instance = _update(storage_type, str(tmp_path))
+    update_instance.save_report()
+    first = len(update_instance.read('_datarepo_runs', cache=False))
+    update_instance.dates_update_all(DATES + ['20110105'])
+    update_instance.save_report()
+    runs = update_instance.read('_datarepo_runs', cache=False)
+    assert len(runs) > first
+    assert runs['run_id'].nunique() == 2
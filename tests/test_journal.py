@@ -0,0 +1,81 @@
+"""
+运行日志: 中断后以相同的参数再次运行时从中断处继续
+"""
+
+import pandas as pd
+import pytest
+
+from datarepo import DataUpdate, data_config
+from datarepo.methods import methods
+from datarepo.journal import RunJournal
+
+
+DATES = ['20110103', '20110104', '20110105']
+CALLS = list()
+STOP_AT = set()
+
+
+@data_config(status='update', table_name='journaled', data_structure={'date': 'CHAR(8)', 'v': 'FLOAT'},
+             update_method='dates')
+def journaled(date):
+    if date in STOP_AT:
+        # 模拟进程中途退出
+        raise KeyboardInterrupt
+    CALLS.append(date)
+    return pd.DataFrame({'date': [date], 'v': [1.0]})
+
+
+@pytest.mark.parametrize('storage_type', ['csvfolder', 'sql'])
+def test_resume_from_journal(tmp_path, engine, monkeypatch, storage_type):
+    conn = engine if storage_type == 'sql' else str(tmp_path)
+    journal = str(tmp_path / 'run.jsonl')
+    CALLS.clear()
+    STOP_AT.clear()
+    STOP_AT.add('20110104')
+    with pytest.raises(KeyboardInterrupt):
+        DataUpdate({'journaled': journaled}, storage_type, conn, journal=journal).dates_update_all(DATES)
+    assert CALLS == ['20110103']
+
+    # 再次运行: 不再检索已有日期, 只计算计划中尚未完成的日期
+    probes = list()
+    missing_date_list = methods.missing_date_list
+    monkeypatch.setattr(methods, 'missing_date_list', lambda *args, **kwargs: probes.append(args) or
+                        missing_date_list(*args, **kwargs))
+    STOP_AT.clear()
+    update_instance = DataUpdate({'journaled': journaled}, storage_type, conn, journal=journal)
+    assert update_instance.dates_update_all(DATES) == {'journaled': set()}
+    assert CALLS == DATES
+    assert probes == []
+    assert sorted(update_instance.read('journaled', cache=False)['date']) == DATES
+
+    # 运行结束后日志关闭, 下一次运行重新检索
+    update_instance.dates_update_all(DATES)
+    assert CALLS == DATES
+    assert len(probes) > 0
+
+
+@pytest.mark.parametrize('storage_type', ['csv', 'pickle', 'csvfolder'])
+def test_resume_after_write_before_done(tmp_path, monkeypatch, storage_type):
+    conn = str(tmp_path)
+    journal = str(tmp_path / 'run.jsonl')
+    CALLS.clear()
+    STOP_AT.clear()
+
+    # 模拟数据写入之后, 运行日志记录之前退出
+    mark_done = RunJournal.mark_done
+
+    def _mark_done(self, func, dates):
+        if '20110104' in dates:
+            raise KeyboardInterrupt
+        return mark_done(self, func, dates)
+
+    monkeypatch.setattr(RunJournal, 'mark_done', _mark_done)
+    with pytest.raises(KeyboardInterrupt):
+        DataUpdate({'journaled': journaled}, storage_type, conn, journal=journal).dates_update_all(DATES)
+    monkeypatch.setattr(RunJournal, 'mark_done', mark_done)
+
+    # 恢复时检查中断前开始写入的日期, 已写入的日期不再重复写入
+    update_instance = DataUpdate({'journaled': journaled}, storage_type, conn, journal=journal)
+    assert update_instance.dates_update_all(DATES) == {'journaled': set()}
+    assert CALLS == DATES
+    assert sorted(update_instance.read('journaled', cache=False)['date']) == DATES
@@ -0,0 +1,92 @@
+"""
+range更新: 按chunk拆分时间范围, 逐个窗口计算并写入, 失败后从最后一个成功写入的窗口之后继续
+"""
+
+import time
+import threading
+
+import pandas as pd
+import pytest
+
+from datarepo import DataUpdate, data_config
+from datarepo.core import _split_range
+from datarepo.methods import methods
+
+
+WINDOWS = list()
+FAIL = set()
+RUNNING = {'now': 0, 'max': 0}
+LOCK = threading.Lock()
+
+
+def _range_data(start_date, end_date):
+    WINDOWS.append((start_date, end_date))
+    if start_date in FAIL:
+        raise ValueError("calculation error")
+    dates = pd.date_range(start_date, end_date, freq='MS').strftime("%Y%m%d")
+    return pd.DataFrame({'date': dates, 'v': [1.0] * len(dates)})
+
+
+@data_config(status='update', table_name='chunked', data_structure={'date': 'CHAR(8)', 'v': 'FLOAT'},
+             update_method='range', chunk='3M')
+def chunked(start_date, end_date):
+    return _range_data(start_date, end_date)
+
+
+@data_config(status='update', table_name='stateless', data_structure={'date': 'CHAR(8)', 'v': 'FLOAT'},
+             update_method='range', chunk='1M', stateless=True)
+def stateless(start_date, end_date):
+    with LOCK:
+        RUNNING['now'] += 1
+        RUNNING['max'] = max(RUNNING['max'], RUNNING['now'])
+    time.sleep(0.02)
+    with LOCK:
+        RUNNING['now'] -= 1
+    return _range_data(start_date, end_date)
+
+
+def test_split_range():
+    assert _split_range('20110101', '20110630') == [('20110101', '20110630')]
+    assert _split_range('20110101', '20110630', '3M') == [('20110101', '20110331'), ('20110401', '20110630')]
+    assert _split_range('20110101', '20110110', '1w') == [('20110101', '20110107'), ('20110108', '20110110')]
+    assert _split_range('20110101', '20121231', '1Y') == [('20110101', '20111231'), ('20120101', '20121231')]
+    with pytest.raises(AssertionError):
+        _split_range('20110101', '20110630', '3Q')
+
+
+@pytest.mark.parametrize('storage_type', ['pickle', 'sql'])
+def test_chunked_range_resumes_after_failed_window(tmp_path, engine, storage_type):
+    conn = engine if storage_type == 'sql' else str(tmp_path)
+    WINDOWS.clear()
+    FAIL.clear()
+    FAIL.add('20110401')
+    update_instance = DataUpdate({'chunked': chunked}, storage_type, conn, base_date='20110101')
+    failed = update_instance.range_update_all('20111231')['chunked']
+    assert min(failed) == '20110401' and max(failed) == '20111231'
+    # 失败窗口之后的窗口不再计算
+    assert WINDOWS == [('20110101', '20110331'), ('20110401', '20110630')]
+    assert sorted(update_instance.read('chunked', cache=False)['date']) == ['20110101', '20110201', '20110301']
+
+    WINDOWS.clear()
+    FAIL.clear()
+    assert update_instance.range_update_all('20111231') == {'chunked': set()}
+    # 从最后一条已写入记录的下一日开始
+    assert WINDOWS == _split_range('20110302', '20111231', '3M')
+    data = update_instance.read('chunked', cache=False)
+    assert list(data['date']) == list(pd.date_range('20110101', '20111231', freq='MS').strftime("%Y%m%d"))
+
+
+def test_stateless_windows_are_computed_concurrently_and_written_in_order(tmp_path, monkeypatch):
+    WINDOWS.clear()
+    FAIL.clear()
+    RUNNING.update(now=0, max=0)
+    writes = list()
+    update_data = methods.update_data
+    monkeypatch.setattr(methods, 'update_data', lambda data, *args, **kwargs: writes.append(data) or
+                        update_data(data, *args, **kwargs))
+
+    update_instance = DataUpdate({'stateless': stateless}, 'csv', str(tmp_path), base_date='20110101', workers=3)
+    assert update_instance.range_update_all('20110630') == {'stateless': set()}
+    assert RUNNING['max'] > 1
+    assert [list(x['date']) for x in writes] == [[x] for x in pd.date_range('20110101', '20110630', freq='MS')
+                                                 .strftime("%Y%m%d")]
@@ -0,0 +1,108 @@
+"""
+DataUpdate.read: 存储端筛选的结果与完整读取后筛选一致, 以及读取缓存
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from datarepo import DataUpdate, data_config
+from datarepo.cache import DataCache
+
+
+DATES = ['20110103', '20110104', '20110105', '20110106']
+FIELDS = ['s1', 's2', 's3']
+
+
+@data_config(status='update', table_name='signal', update_method='dates',
+             data_structure={'date': 'CHAR(8)', 'field': 'TEXT', 'sid': 'CHAR(6)', 'v': 'FLOAT'})
+def signal(date, field):
+    return pd.DataFrame({'date': [date] * 2, 'sid': ['000001', '000002'],
+                         'v': [float(date[-1]) + int(field[-1]) / 10, np.nan]})
+
+
+@pytest.mark.parametrize('storage_type', ['csv', 'parquet', 'sql', 'csvfolder', 'pickle'])
+def test_filtered_read_matches_full_read(tmp_path, engine, storage_type):
+    conn = engine if storage_type == 'sql' else str(tmp_path)
+    update_instance = DataUpdate.indicator_from_func(func=signal, storage_type=storage_type, conn=conn,
+                                                     field_list=FIELDS, table_name='signal')
+    update_instance.dates_update_all(DATES)
+    full = update_instance.read('signal', cache=False)
+    assert len(full) == len(DATES) * len(FIELDS) * 2
+    assert list(full.columns) == ['date', 'field', 'sid', 'v']
+
+    for start_date, end_date, fields, columns in [
+        ('20110104', '20110105', None, None),
+        (None, '20110104', ['s2'], None),
+        ('20110105', None, ['s1', 's3'], ['date', 'field', 'v']),
+        (None, None, None, ['v', 'sid']),
+        ('20120101', None, None, None),
+    ]:
+        result = update_instance.read('signal', start_date, end_date, fields, columns, cache=False)
+        expected = full
+        if start_date is not None:
+            expected = expected.loc[expected['date'] >= start_date]
+        if end_date is not None:
+            expected = expected.loc[expected['date'] <= end_date]
+        if fields is not None:
+            expected = expected.loc[expected['field'].isin(fields)]
+        expected = expected[columns] if columns is not None else expected
+        sort = [x for x in ('date', 'field', 'sid') if x in expected.columns]
+        pd.testing.assert_frame_equal(result.sort_values(sort).reset_index(drop=True),
+                                      expected.sort_values(sort).reset_index(drop=True), check_dtype=False)
+        assert list(result.columns) == list(expected.columns)
+
+
+def test_read_cache_is_invalidated_by_writes(tmp_path):
+    update_instance = DataUpdate.indicator_from_func(func=signal, storage_type='csvfolder', conn=str(tmp_path),
+                                                     field_list=FIELDS, table_name='signal')
+    update_instance.dates_update_all(DATES[:2])
+    first = update_instance.read('signal', fields=['s1'])
+    assert update_instance.read('signal', fields=['s1']) is first
+    assert update_instance.read('signal', fields=['s2']) is not first
+    assert (update_instance.cache.hits, update_instance.cache.misses) == (1, 2)
+
+    update_instance.dates_update_all(DATES)
+    assert sorted(set(update_instance.read('signal', fields=['s1'])['date'])) == DATES
+
+
+def test_cache_evicts_least_recently_used():
+    cache = DataCache(max_bytes=3000)
+    values = {x: np.zeros(125) for x in 'abcd'}
+    for x in 'abc':
+        cache.put(x, values[x])
+    # 访问a之后, 最久未使用的是b
+    assert cache.get('a', lambda: None) is values['a']
+    cache.put('d', values['d'])
+    assert cache.get('b', lambda: 'reloaded') == 'reloaded'
+    assert cache.get('a', lambda: None) is values['a']
+    assert cache.nbytes <= cache.max_bytes
+
+    # 超过内存预算的数据不进行缓存
+    cache.put('big', np.zeros(1000))
+    assert cache.get('big', lambda: 'reloaded') == 'reloaded'
+
+
+def test_cache_loads_a_key_once():
+    cache = DataCache()
+    loads = list()
+    event = threading.Event()
+
+    @cache.cached
+    def load(start_date, end_date=None):
+        loads.append(start_date)
+        event.wait(1)
+        return pd.DataFrame({'date': [start_date]})
+
+    threads = [threading.Thread(target=load, args=('20110103',)) for _ in range(4)]
+    for x in threads:
+        x.start()
+    event.set()
+    for x in threads:
+        x.join()
+    assert loads == ['20110103']
+    assert load('20110103') is load('20110103')
+    assert load('20110104') is not load('20110103')
+    assert cache.misses == 2
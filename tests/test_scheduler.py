@@ -0,0 +1,141 @@
+"""
+依赖调度与并发计算
+"""
+
+import time
+import asyncio
+import threading
+
+import pandas as pd
+import pytest
+
+from datarepo import core, DataUpdate, data_config
+from datarepo.scheduler import (build_dag, topological_order, run_dag, arun_dag, CyclicDependencyError,
+                                ALL_DATES)
+
+
+DATES = ['20110103', '20110104', '20110105', '20110106']
+RUNNING = {'now': 0, 'max': 0}
+LOCK = threading.Lock()
+
+
+def _make_func(table_name):
+    @data_config(status='update', table_name=table_name, data_structure={'date': 'CHAR(8)', 'v': 'FLOAT'},
+                 update_method='dates')
+    def func(date):
+        with LOCK:
+            RUNNING['now'] += 1
+            RUNNING['max'] = max(RUNNING['max'], RUNNING['now'])
+        time.sleep(0.02)
+        with LOCK:
+            RUNNING['now'] -= 1
+        return pd.DataFrame({'date': [date], 'v': [1.0]})
+    return func
+
+
+def test_workers_limit_calculations_of_a_run(tmp_path, monkeypatch):
+    pools = list()
+
+    class CountingPool(core.ThreadPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(self)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(core, 'ThreadPoolExecutor', CountingPool)
+    RUNNING.update(now=0, max=0)
+    func_dict = {x: _make_func(x) for x in ('t1', 't2', 't3', 't4')}
+    update_instance = DataUpdate(func_dict, 'csvfolder', str(tmp_path), workers=2)
+    assert update_instance.dates_update_all(DATES) == {x: set() for x in func_dict}
+    # 4个互不依赖的函数共享同一个池, 同时进行的计算不超过workers个
+    assert len(pools) == 1
+    assert RUNNING['max'] == 2
+    for x in func_dict:
+        assert sorted(update_instance.read(x, cache=False)['date']) == DATES
+
+
+class _Func:
+    """只有data_config的函数, 用于构建依赖关系"""
+    def __init__(self, table_name, depends_on=()):
+        self.data_config = {'table_name': table_name, 'depends_on': list(depends_on)}
+
+
+def test_build_dag_and_order():
+    func_dict = {
+        'child': _Func('child', ['a', 'external']),
+        'a1': _Func('a'),
+        'a2': _Func('a', ['base']),
+        'base': _Func('base'),
+    }
+    dag = build_dag(func_dict)
+    # 依赖同一张表的所有函数, 不在本次更新中的表视为已就绪
+    assert dag == {'child': ['a1', 'a2'], 'a1': [], 'a2': ['base'], 'base': []}
+    assert topological_order(dag) == ['a1', 'base', 'a2', 'child']
+    with pytest.raises(CyclicDependencyError):
+        topological_order({'x': ['y'], 'y': ['x'], 'z': []})
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_run_dag_skips_failed_upstream_dates(workers):
+    dag = {'a': [], 'b': [], 'c': ['a', 'b'], 'd': ['c'], 'e': ['boom'], 'boom': []}
+    finished = list()
+    received = dict()
+
+    def _run(x, skip_dates):
+        # 上游均已完成后才开始运行
+        assert all(y in finished for y in dag[x])
+        received[x] = skip_dates
+        finished.append(x)
+        if x == 'boom':
+            raise ValueError("unexpected error")
+        return {'a': {'20110104'}, 'b': {'20110105'}}.get(x, skip_dates)
+
+    failed = run_dag(dag, _run, workers)
+    assert received['c'] == {'20110104', '20110105'}
+    assert failed['d'] == {'20110104', '20110105'}
+    assert failed['boom'] == ALL_DATES and received['e'] == ALL_DATES
+
+
+def test_arun_dag_skips_failed_upstream_dates():
+    async def _run(x, skip_dates):
+        return {'a': {'20110104'}}.get(x, skip_dates)
+
+    failed = asyncio.run(arun_dag({'a': [], 'b': ['a']}, _run))
+    assert failed == {'a': {'20110104'}, 'b': {'20110104'}}
+
+
+CALLS = list()
+PARENT_FAIL = set()
+
+
+@data_config(status='update', table_name='parent', data_structure={'date': 'CHAR(8)', 'v': 'FLOAT'},
+             update_method='dates')
+def parent(date):
+    if date in PARENT_FAIL:
+        raise ValueError("calculation error")
+    CALLS.append(('parent', date))
+    return pd.DataFrame({'date': [date], 'v': [1.0]})
+
+
+@data_config(status='update', table_name='child', data_structure={'date': 'CHAR(8)', 'v': 'FLOAT'},
+             update_method='dates', depends_on=['parent'])
+def child(date):
+    CALLS.append(('child', date))
+    return pd.DataFrame({'date': [date], 'v': [2.0]})
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_downstream_skips_dates_failed_upstream(tmp_path, workers):
+    CALLS.clear()
+    PARENT_FAIL.clear()
+    PARENT_FAIL.add('20110104')
+    # child在func_dict中位于parent之前, 仍在parent之后更新
+    update_instance = DataUpdate({'child': child, 'parent': parent}, 'csvfolder', str(tmp_path), workers=workers)
+    assert update_instance.dates_update_all(DATES) == {'parent': {'20110104'}, 'child': {'20110104'}}
+    assert [x for x in CALLS if x[0] == 'child'] == [('child', x) for x in DATES if x != '20110104']
+    assert max(i for i, x in enumerate(CALLS) if x[0] == 'parent') < \
+        min(i for i, x in enumerate(CALLS) if x[0] == 'child')
+
+    CALLS.clear()
+    PARENT_FAIL.clear()
+    assert update_instance.dates_update_all(DATES) == {'parent': set(), 'child': set()}
+    assert CALLS == [('parent', '20110104'), ('child', '20110104')]
@@ -0,0 +1,104 @@
+"""
+进程池计算时大参数的共享
+"""
+
+import os
+import pickle
+import textwrap
+
+import numpy as np
+import pandas as pd
+
+from datarepo import data_config, DataUpdate
+from datarepo.methods import methods
+from datarepo import shared
+from datarepo.shared import SharedStore, SharedArray, resolve
+
+
+DATES = ['20110103', '20110104', '20110105']
+
+# 大于SHARE_BYTES的收益率矩阵
+RET = pd.DataFrame(np.arange(200 * 1000, dtype=float).reshape(200, 1000), index=np.arange(200))
+
+
+@data_config(status='update', table_name='sigperf', data_structure={'date': 'CHAR(8)', 'field': 'TEXT', 'ic': 'FLOAT'},
+             update_method='dates')
+def sigperf(date, field, ret, scale):
+    assert isinstance(ret, pd.DataFrame) and not ret.values.flags.writeable
+    return pd.DataFrame({'date': [date], 'field': [field], 'ic': [ret.iloc[0, 1] * scale + int(field[-1])]})
+
+
+def test_share_round_trip(tmp_path):
+    store = SharedStore()
+    shared = store.share(RET)
+    assert isinstance(shared, SharedArray)
+    # 同一对象只写入一次, pickle时只包含路径
+    assert store.share(RET) is shared
+    assert len(pickle.dumps(shared)) < 1024
+    loaded = resolve(pickle.loads(pickle.dumps(shared)))
+    pd.testing.assert_frame_equal(loaded, RET)
+
+    array = np.ones(SharedStore().share_bytes)
+    np.testing.assert_array_equal(resolve(store.share(array)), array)
+    series = pd.Series(array, name='s')
+    pd.testing.assert_series_equal(resolve(store.share(series)), series)
+
+    path = store.path
+    store.close()
+    assert store.path is None and not os.path.exists(path)
+
+
+def test_small_or_object_values_are_not_shared():
+    store = SharedStore()
+    small = np.ones(10)
+    mixed = pd.DataFrame({'a': np.ones(10 ** 6), 'b': ['x'] * 10 ** 6})
+    objects = np.array(['x'] * 10 ** 6, dtype=object)
+    for value in (small, mixed, objects, 'text', 1.5):
+        assert store.share(value) is value
+    assert store.path is None
+
+
+def test_process_executor_shares_kwargs(tmp_path, monkeypatch):
+    # 每个参数在一次运行中只拆分(复制)一次, 而不是每个任务一次
+    splits = list()
+    split = shared._split
+    monkeypatch.setattr(shared, '_split', lambda value: splits.append(value) or split(value))
+    conn = str(tmp_path / 'store')
+    os.mkdir(conn)
+    update_instance = DataUpdate.indicator_from_func(
+        func=sigperf, storage_type='csvfolder', conn=conn, field_list=['s1', 's2'], table_name='sigperf',
+        base_date='20110101', workers=2, executor='process', ret=RET, scale=2.0)
+    update_instance.dates_update_all(date_list=DATES)
+    assert update_instance.shared.path is None
+    assert len(splits) == 2
+
+    data = methods.read_data(conn, 'sigperf', 'csvfolder').sort_values(['field', 'date'])
+    assert list(data['date']) == DATES * 2
+    assert list(data['ic']) == [3.0] * 3 + [4.0] * 3
+
+
+FUNCTIONS = '''
+import pandas as pd
+from datarepo import data_config
+
+
+@data_config(status='update', table_name='from_file', data_structure={'date': 'CHAR(8)', 'v': 'FLOAT'},
+             update_method='dates')
+def from_file(date):
+    return pd.DataFrame({'date': [date], 'v': [float(date[-1])]})
+'''
+
+
+def test_process_executor_from_file_path(tmp_path):
+    path = tmp_path / 'functions.py'
+    path.write_text(textwrap.dedent(FUNCTIONS))
+    conn = str(tmp_path / 'store')
+    os.mkdir(conn)
+    # 第一次运行直接载入py文件, 第二次运行使用函数清单
+    for dates in (DATES[:2], DATES):
+        update_instance = DataUpdate.from_file_path(str(path), 'csvfolder', conn, workers=2, executor='process')
+        assert update_instance.dates_update_all(dates) == {'from_file': set()}
+
+    data = methods.read_data(conn, 'from_file', 'csvfolder').sort_values('date')
+    assert list(data['date']) == DATES
+    assert list(data['v']) == [3.0, 4.0, 5.0]
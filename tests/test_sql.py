@@ -0,0 +1,118 @@
+"""
+sql存储: 批量写入的失败处理, 唯一键写入, 日期时间列, 缺失日期的检索
+"""
+
+import datetime
+
+import pandas as pd
+
+from datarepo import DataUpdate, data_config
+from datarepo.methods import methods, sql_utils
+from datarepo.scheduler import ALL_DATES
+
+from conftest import count
+
+
+STRUCTURE = {'date': 'CHAR(8)', 'v': 'FLOAT'}
+DATES = ['20110103', '20110104']
+
+
+@data_config(status='update', table_name='no_date', data_structure=STRUCTURE, update_method='batch')
+def no_date(date_list):
+    return pd.DataFrame({'v': [1.0] * len(date_list)})
+
+
+@data_config(status='update', table_name='child', data_structure=STRUCTURE, update_method='dates',
+             depends_on=['no_date'])
+def child(date):
+    return pd.DataFrame({'date': [date], 'v': [2.0]})
+
+
+@data_config(status='update', table_name='uniq', data_structure=STRUCTURE, update_method='dates',
+             index=['date'], unique=True)
+def uniq(date):
+    return pd.DataFrame({'date': [date, date], 'v': [1.0, 2.0]})
+
+
+def test_batch_result_error_fails_function_and_skips_children(engine):
+    update_instance = DataUpdate({'no_date': no_date, 'child': child}, 'sql', engine)
+    failed = update_instance.dates_update_all(DATES)
+    assert failed['no_date'] == ALL_DATES
+    assert failed['child'] == ALL_DATES
+    assert count(engine, 'child') == 0
+
+
+def test_commit_error_marks_written_dates_failed(engine, monkeypatch):
+    update_instance = DataUpdate({'child': child}, 'sql', engine)
+    update_instance._create_table(child.data_config)
+
+    write_batch = methods.write_batch
+    calls = list()
+
+    class _FailOnCommit:
+        """最外层的批量写入(_write_batch)在提交时失败, 批内的单次写入正常进行"""
+        def __init__(self, conn, storage_type, short=False):
+            self.outer = len(calls) == 0
+            self.inner = write_batch(conn, storage_type, short)
+            calls.append(self)
+
+        def __enter__(self):
+            return self.inner.__enter__()
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            self.inner.__exit__(exc_type, exc_value, traceback)
+            if self.outer and exc_type is None:
+                raise RuntimeError("commit failed")
+
+    monkeypatch.setattr(methods, 'write_batch', _FailOnCommit)
+    failed = update_instance.dates_update_all(DATES)
+    assert len(calls) > 1
+    assert failed['child'] == set(DATES)
+
+
+def test_unique_index_upserts_without_duplicates(engine):
+    update_instance = DataUpdate({'uniq': uniq}, 'sql', engine)
+    update_instance.dates_update_all(DATES)
+    # 重复写入重叠的日期
+    methods.update_data(uniq('20110104'), engine, uniq.data_config, 'sql')
+    data = update_instance.read('uniq', cache=False)
+    assert sorted(data['date']) == DATES
+    assert data['v'].tolist() == [2.0, 2.0]
+
+
+def test_sqlite_writes_datetime_columns(engine):
+    config = {'table_name': 'ts', 'data_structure': {'date': 'CHAR(8)', 'ts': 'TIMESTAMP', 'v': 'FLOAT'}}
+    methods.create_table(engine, config, 'sql')
+    methods.update_data(pd.DataFrame({
+        'date': DATES,
+        'ts': [pd.Timestamp('2011-01-03'), pd.Timestamp('2011-01-04 10:00:01.5')],
+        'v': [1.0, None]
+    }), engine, config, 'sql')
+    methods.update_data(pd.DataFrame({'date': ['20110105'], 'ts': [datetime.date(2011, 1, 5)], 'v': [3.0]}),
+                        engine, config, 'sql')
+    with engine.connect() as c:
+        rows = c.exec_driver_sql("SELECT ts, v FROM ts ORDER BY date").fetchall()
+    assert rows == [('2011-01-03 00:00:00.000000', 1.0), ('2011-01-04 10:00:01.500000', None), ('2011-01-05', 3.0)]
+
+
+def test_missing_date_normalises_non_yyyymmdd_dates(engine):
+    # 以to_sql写入的日期时间列: 'YYYY-mm-dd HH:MM:SS'
+    pd.DataFrame({'date': pd.to_datetime(['2011-01-03']), 'v': [1.0]}).to_sql('legacy', engine, index=False)
+    config = {'table_name': 'legacy', 'data_structure': STRUCTURE}
+    assert methods.missing_date_list(engine, config, 'sql', DATES) == ['20110104']
+
+
+def test_missing_date_on_yyyymmdd_table(engine):
+    config = {'table_name': 'plain', 'data_structure': STRUCTURE}
+    methods.create_table(engine, config, 'sql')
+    assert methods.missing_date_list(engine, config, 'sql', DATES) == DATES
+    methods.update_data(pd.DataFrame({'date': ['20110103'], 'v': [1.0]}), engine, config, 'sql')
+    assert methods.missing_date_list(engine, config, 'sql', DATES) == ['20110104']
+
+
+def test_multi_row_chunksize_stays_under_parameter_limit():
+    assert sql_utils.multi_chunksize(pd.DataFrame(columns=['date', 'v'])) == sql_utils.MULTI_CHUNKSIZE
+    for n in (3, 50, 300, 2500):
+        chunksize = sql_utils.multi_chunksize(pd.DataFrame(columns=range(n)))
+        assert chunksize >= 1
+        assert chunksize * n <= sql_utils.MULTI_MAX_PARAMS or chunksize == 1
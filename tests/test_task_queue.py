@@ -0,0 +1,100 @@
+"""
+任务队列: 租约, 重试次数, 依赖层级, 以及命令行入口
+"""
+
+import json
+import time
+import textwrap
+
+import pytest
+
+from datarepo import cli
+from datarepo.methods import methods
+from datarepo.task_queue import SQLiteQueue, TaskQueue, DONE, FAILED
+
+
+def _task(func_name, level=0, dates=('20110103',)):
+    return {'func_name': func_name, 'kwargs': {'date_list': list(dates)}, 'dates': list(dates),
+            'upstream': [], 'level': level}
+
+
+def test_task_queue_is_abstract():
+    with pytest.raises(TypeError):
+        TaskQueue()
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    queue = SQLiteQueue(str(tmp_path / 'q.db'))
+    queue.put('run', [_task('f')])
+    first = queue.claim('w1', lease=0.01)
+    assert queue.claim('w2', lease=60) is None
+    time.sleep(0.05)
+    second = queue.claim('w2', lease=60)
+    assert second['id'] == first['id']
+    assert second['attempts'] == 2
+    # 租约已转移, 原worker的结果不再生效
+    assert not queue.extend(first['id'], 'w1', 60)
+    queue.complete(first['id'], 'w1')
+    assert queue.stats('run') == {'running': 1}
+    queue.complete(second['id'], 'w2')
+    assert queue.stats('run') == {DONE: 1}
+
+
+def test_task_fails_after_max_attempts(tmp_path):
+    queue = SQLiteQueue(str(tmp_path / 'q.db'), max_attempts=2)
+    queue.put('run', [_task('f')])
+    task = queue.claim('w1', lease=60)
+    queue.fail(task['id'], 'w1', "error")
+    task = queue.claim('w1', lease=0.01)
+    time.sleep(0.05)
+    assert queue.claim('w1', lease=60) is None
+    assert queue.stats('run') == {FAILED: 1}
+    assert queue.failed_dates('run', ['f']) == {'20110103'}
+
+
+def test_levels_are_claimed_in_order(tmp_path):
+    queue = SQLiteQueue(str(tmp_path / 'q.db'))
+    queue.put('run', [_task('child', level=1), _task('parent', level=0)])
+    task = queue.claim('w1', lease=60)
+    assert task['func_name'] == 'parent'
+    assert queue.claim('w2', lease=60) is None
+    queue.complete(task['id'], 'w1')
+    assert queue.claim('w2', lease=60)['func_name'] == 'child'
+
+
+FUNCTIONS = '''
+import pandas as pd
+from datarepo import data_config
+
+
+@data_config(status='update', table_name='parent', data_structure={'date': 'CHAR(8)', 'v': 'FLOAT'},
+             update_method='dates')
+def parent(date):
+    return pd.DataFrame({'date': [date], 'v': [1.0]})
+
+
+@data_config(status='update', table_name='child', data_structure={'date': 'CHAR(8)', 'v': 'FLOAT'},
+             update_method='dates', depends_on=['parent'])
+def child(date):
+    return pd.DataFrame({'date': [date], 'v': [2.0]})
+'''
+
+
+def test_cli_enqueue_worker_status(tmp_path, capsys):
+    path = tmp_path / 'functions.py'
+    path.write_text(textwrap.dedent(FUNCTIONS))
+    store = tmp_path / 'store'
+    store.mkdir()
+    common = ['--queue', str(tmp_path / 'q.db')]
+    storage = ['--path', str(path), '--storage', 'csvfolder', '--conn', str(store)]
+
+    cli.main(['enqueue'] + common + storage + ['--dates', '20110103', '20110104'])
+    run_id = capsys.readouterr().out.strip()
+    cli.main(['worker'] + common + storage + ['--poll', '0.01'])
+    capsys.readouterr()
+    cli.main(['status'] + common + ['--run-id', run_id])
+    assert json.loads(capsys.readouterr().out) == {DONE: 4}
+
+    for table_name in ('parent', 'child'):
+        data = methods.read_data(str(store), table_name, 'csvfolder')
+        assert sorted(data['date']) == ['20110103', '20110104']
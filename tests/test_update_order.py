@@ -0,0 +1,84 @@
+"""
+日期优先的更新顺序: 同一张表下的field函数逐日计算所有field后一次性写入
+"""
+
+import pandas as pd
+import pytest
+
+from datarepo import DataUpdate, data_config
+from datarepo.methods import methods
+
+
+DATES = ['20110103', '20110104', '20110105']
+FIELDS = ['s1', 's2', 's3']
+CALLS = list()
+FAIL = set()
+
+
+@data_config(status='update', table_name='signal', data_structure={'date': 'CHAR(8)', 'field': 'TEXT', 'v': 'FLOAT'},
+             update_method='dates')
+def signal(date, field, scale):
+    if (date, field) in FAIL:
+        raise ValueError("calculation error")
+    CALLS.append((date, field))
+    return pd.DataFrame({'date': [date], 'v': [float(date[-1]) * scale + int(field[-1])]})
+
+
+def _instance(storage_type, conn):
+    return DataUpdate.indicator_from_func(func=signal, storage_type=storage_type, conn=conn, field_list=FIELDS,
+                                          table_name='signal', scale=10.0)
+
+
+@pytest.mark.parametrize('storage_type', ['csvfolder', 'sql'])
+def test_date_order_computes_all_fields_of_a_date_in_one_write(tmp_path, engine, monkeypatch, storage_type):
+    conn = engine if storage_type == 'sql' else str(tmp_path)
+    CALLS.clear()
+    FAIL.clear()
+    writes = list()
+    update_data = methods.update_data
+    monkeypatch.setattr(methods, 'update_data', lambda data, *args, **kwargs: writes.append(data) or
+                        update_data(data, *args, **kwargs))
+
+    update_instance = _instance(storage_type, conn)
+    # s1已有第一个日期, 只计算缺失的field
+    update_instance._create_table(update_instance.func_dict['s1'].data_config)
+    update_data(pd.DataFrame({'date': ['20110103'], 'field': ['s1'], 'v': [31.0]}), conn,
+                update_instance.func_dict['s1'].data_config, storage_type)
+    assert update_instance.dates_update_all(DATES, order='date') == {'*@signal': set()}
+
+    expected = [(dt, x) for dt in DATES for x in FIELDS if (dt, x) != ('20110103', 's1')]
+    assert CALLS == expected
+    assert [sorted(set(x['date'])) for x in writes] == [[dt] for dt in DATES]
+    assert [len(x) for x in writes] == [2, 3, 3]
+
+    data = update_instance.read('signal', cache=False).sort_values(['date', 'field'])
+    assert list(zip(data['date'], data['field'])) == [(dt, x) for dt in DATES for x in FIELDS]
+    assert list(data['v']) == [float(dt[-1]) * 10 + int(x[-1]) for dt in DATES for x in FIELDS]
+
+
+def test_date_order_failure_only_fails_that_date(tmp_path):
+    CALLS.clear()
+    FAIL.clear()
+    FAIL.add(('20110104', 's2'))
+    update_instance = _instance('csvfolder', str(tmp_path))
+    assert update_instance.dates_update_all(DATES, order='date') == {'*@signal': {'20110104'}}
+
+    # 失败日期中已经计算成功的field仍然写入, 再次运行只计算失败的field
+    CALLS.clear()
+    FAIL.clear()
+    assert update_instance.dates_update_all(DATES, order='date') == {'*@signal': set()}
+    assert CALLS == [('20110104', 's2')]
+    data = update_instance.read('signal', cache=False)
+    assert len(data) == len(DATES) * len(FIELDS)
+
+
+def test_date_order_matches_field_order(tmp_path):
+    by_field, by_date = tmp_path / 'field', tmp_path / 'date'
+    by_field.mkdir()
+    by_date.mkdir()
+    FAIL.clear()
+    _instance('csvfolder', str(by_field)).dates_update_all(DATES, order='field')
+    _instance('csvfolder', str(by_date)).dates_update_all(DATES, order='date')
+    expected = methods.read_data(str(by_field), 'signal', 'csvfolder').sort_values(['date', 'field'])
+    result = methods.read_data(str(by_date), 'signal', 'csvfolder').sort_values(['date', 'field'])
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True))